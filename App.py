@@ -4,10 +4,14 @@ import tkinter.filedialog
 import tkinter as tk
 from functools import partial
 from tkinter import font
+import multiprocessing
 import platform
 
 from lib.config import Config, ConfigType
 from lib.impartus import Impartus
+from lib.ratelimiter import RateLimiter
+from lib.scheduler import Scheduler
+from lib.tempstorage import TempStorage
 from ui.colorschemes import ColorSchemes
 
 from ui.login_form import LoginForm
@@ -21,6 +25,9 @@ class App:
         self.impartus = Impartus()
         self.app = self.create_app()
 
+        # clean up temp files left over from earlier runs, in the background.
+        Scheduler.submit_task(TempStorage.reclaim)
+
         self._init_ui()
 
     def create_app(self):   # noqa
@@ -68,11 +75,16 @@ class App:
         callbacks_functions = {
             'authentication_callback': partial(self.content.show_video_callback, self.impartus),
             'auto_organize_callback': self.content.auto_organize,
+            'cancel_all_callback': self.content.cancel_all_downloads,
             'set_display_columns_callback': self.content.set_display_columns,
             'set_colorscheme_callback': self.colorschemes.set_colorscheme,
+            'set_bandwidth_limit_callback': self.set_bandwidth_limit,
         }
         self.menubar.add_menu(self.app, callbacks_functions)
         self.toolbar.add_toolbar(self.app, callbacks_functions)
+
+        # show the segment downloads in flight, as the limit adapts.
+        self.toolbar.watch_concurrency(Scheduler.segment_slot())
         self.login.add_login_form(self.app, partial(self.content.show_video_callback, self.impartus))
 
         self.app.rowconfigure(0, weight=0)
@@ -93,6 +105,12 @@ class App:
     def set_colorscheme(self, cs):
         self.app.config(bg=cs['root']['bg'])
 
+    def set_bandwidth_limit(self, limit):   # noqa
+        # -1: go back to the limit / schedule from the config.
+        RateLimiter.set_limit(None if limit < 0 else limit)
+
 
 if __name__ == '__main__':
+    # worker processes (worker_processes) of a frozen windows build start from the executable.
+    multiprocessing.freeze_support()
     App()
@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+
+class CancelToken:
+    """
+    Cancellation request for a lecture download, checked at every step of the download (segment fetch, decrypt,
+    join, encode). Blocking operations register a callback to be interrupted by cancel(), e.g. closing the
+    response being read, or killing ffmpeg.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = list()
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # interrupting is best effort, the cancellation is noticed at the next check anyway.
+                pass
+
+    def is_cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise DownloadCancelled()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait up to timeout seconds for a cancellation, return True if cancelled.
+        """
+        return self.event.wait(timeout)
+
+    def link(self) -> 'CancelToken':
+        """
+        Return a new token, cancelled along with this one, that can also be cancelled on its own, e.g. to stop part
+        of a download without cancelling the whole of it.
+        """
+        token = CancelToken()
+        with self.lock:
+            self.callbacks.append(token.cancel)
+            cancelled = self.event.is_set()
+        if cancelled:
+            token.cancel()
+        return token
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]):
+        """
+        Context manager calling callback() if the token is cancelled while inside it (or already cancelled).
+        """
+        with self.lock:
+            self.callbacks.append(callback)
+            cancelled = self.event.is_set()
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.callbacks.remove(callback)
+
+
+class DownloadCancelled(Exception):
+    pass
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from lib.cancellation import CancelToken
+from lib.config import Config, ConfigType
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of requests in flight, adjusting the limit AIMD style from the observed latencies and errors.
+    The limit grows additively (by about 1 for every limit requests completed) while it is fully used and
+    latencies hold steady, it is cut multiplicatively when the server pushes back (429, 5xx, timeouts), and
+    gently when the latency climbs well above the best seen, i.e. more requests in flight only queue up
+    somewhere without adding to the throughput.
+    The limit stays within min_inflight_segments and max_inflight_segments.
+    """
+    # multiplicative decrease on errors, and on latency build up.
+    error_backoff = 0.5
+    latency_backoff = 0.9
+
+    # latency (smoothed) above this multiple of the baseline latency counts as build up.
+    latency_tolerance = 2.0
+
+    # weight of the latest latency in the smoothed latency.
+    smoothing = 0.2
+
+    def __init__(self, min_limit: int = None, max_limit: int = None, adaptive: bool = None):
+        conf = Config.load(ConfigType.IMPARTUS)
+        self.max_limit = int(max_limit or conf.get('max_inflight_segments') or 16)
+        self.min_limit = max(1, min(self.max_limit, int(min_limit or conf.get('min_inflight_segments') or 1)))
+        self.adaptive = bool(adaptive if adaptive is not None else conf.get('adaptive_concurrency'))
+
+        self.limit = float(self.max_limit)
+        if self.adaptive:
+            self.limit = float(max(self.min_limit, self.max_limit // 2))
+
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.smoothed_latency = None
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+        self.listeners = list()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get_limit(self) -> int:
+        return int(self.limit)
+
+    def add_listener(self, callback: Callable[[int], None]):
+        """
+        Call callback(limit) whenever the limit changes.
+        """
+        self.listeners.append(callback)
+
+    def acquire(self, cancel_token: CancelToken = None, interval: float = 0.5):
+        """
+        Wait for a free slot and take it. With a cancel_token, the wait is given up with DownloadCancelled once the
+        token is cancelled, checked every interval seconds.
+        """
+        with self.condition:
+            while not self.condition.wait_for(lambda: self.in_flight < int(self.limit),
+                                              timeout=interval if cancel_token else None):
+                cancel_token.raise_if_cancelled()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def hold(self, cancel_token: CancelToken = None):
+        """
+        Context manager holding a slot, see acquire().
+        """
+        self.acquire(cancel_token)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def on_success(self, latency: float):
+        """
+        Record a request completed in latency seconds. Call before releasing the slot.
+        """
+        if not self.adaptive:
+            return
+        with self.condition:
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+            else:
+                self.smoothed_latency += self.smoothing * (latency - self.smoothed_latency)
+            # the baseline drifts up slowly, so that it follows lasting changes (e.g. a slower network).
+            if self.baseline_latency is None or self.smoothed_latency < self.baseline_latency:
+                self.baseline_latency = self.smoothed_latency
+            else:
+                self.baseline_latency *= 1.001
+
+            if self.smoothed_latency > self.latency_tolerance * self.baseline_latency:
+                self._decrease(self.latency_backoff, 'latency {:.1f}s, up from {:.1f}s'.format(
+                    self.smoothed_latency, self.baseline_latency))
+            elif self.in_flight >= int(self.limit):
+                # grow only if the limit is what holds the requests back.
+                self._set_limit(self.limit + 1 / self.limit, 'requests completing steadily')
+
+    def on_failure(self):
+        """
+        Record a request that failed due to the server pushing back, or timing out.
+        """
+        if not self.adaptive:
+            return
+        with self.condition:
+            self._decrease(self.error_backoff, 'server busy')
+
+    def _decrease(self, factor: float, reason: str):
+        # requests in flight fail together, cut the limit once per round trip.
+        now = time.monotonic()
+        if now - self.last_decrease < (self.smoothed_latency or 1.0):
+            return
+        self.last_decrease = now
+        self._set_limit(self.limit * factor, reason)
+
+    def _set_limit(self, limit: float, reason: str):
+        old_limit = int(self.limit)
+        self.limit = min(float(self.max_limit), max(float(self.min_limit), limit))
+        if int(self.limit) != old_limit:
+            self.logger.info("segment downloads in flight: {} (was {}), {}.".format(int(self.limit), old_limit, reason))
+            self.condition.notify_all()
+            for callback in self.listeners:
+                callback(int(self.limit))
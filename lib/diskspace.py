@@ -0,0 +1,110 @@
+import logging
+import os
+import shutil
+import threading
+from typing import Dict
+
+from lib.cancellation import CancelToken
+from lib.config import Config, ConfigType
+
+
+class DiskSpace:
+    """
+    Process wide book keeping of the disk space needed by the active downloads.
+    A download reserves its estimated temp / final sizes upfront, downloads that would not fit next to the
+    existing reservations wait for those to be released, and downloads that would not fit at all are refused.
+    """
+    _reservations = dict()
+    _condition = threading.Condition()
+
+    logger = logging.getLogger('DiskSpace')
+
+    @classmethod
+    def get_margin(cls) -> int:
+        """
+        Space in bytes to be always left free on a disk.
+        """
+        return int(Config.load(ConfigType.IMPARTUS).get('disk_space_margin') or 0) * 1024 * 1024
+
+    @classmethod
+    def get_device(cls, path: str):
+        """
+        Return the device of the nearest existing ancestor of path, reservations are accounted per device.
+        """
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return os.stat(path).st_dev, path
+
+    @classmethod
+    def get_needs(cls, space_needed: Dict[str, int]) -> Dict:
+        """
+        Combine the space needed (bytes) per path into space needed per device.
+        :return: dict device -> [existing path on the device, bytes]
+        """
+        needs = dict()
+        for path, num_bytes in space_needed.items():
+            device, existing_path = cls.get_device(path)
+            needs.setdefault(device, [existing_path, 0])[1] += max(0, int(num_bytes))
+        return needs
+
+    @classmethod
+    def get_reserved(cls, device) -> int:
+        return sum(needs.get(device, [None, 0])[1] for needs in cls._reservations.values())
+
+    @classmethod
+    def fits(cls, needs: Dict, with_reservations=True) -> bool:
+        for device, (path, num_bytes) in needs.items():
+            available = shutil.disk_usage(path).free - cls.get_margin()
+            if with_reservations:
+                available -= cls.get_reserved(device)
+            if num_bytes > available:
+                return False
+        return True
+
+    @classmethod
+    def reserve(cls, key, space_needed: Dict[str, int], wait: bool = True, cancel_token: CancelToken = None) -> bool:
+        """
+        Reserve disk space for a download.
+        :param key: key of the reservation (e.g. ttid), to be released with release(key).
+        :param space_needed: dict of path -> bytes to be written under that path.
+        :param wait: wait for other reservations to be released if the space is not available right now.
+        :param cancel_token: the wait is given up with DownloadCancelled if the download is cancelled.
+        :return: True if reserved, False if there is not enough free disk space.
+        """
+        needs = cls.get_needs(space_needed)
+        with cls._condition:
+            cls._reservations.pop(key, None)
+            if not cls.fits(needs, with_reservations=False):
+                return False
+            if not cls.fits(needs) and wait:
+                cls.logger.info("[{}]: waiting for disk space held by other downloads ..".format(key))
+            while not cls.fits(needs):
+                if not wait:
+                    return False
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                # re-checked periodically, space may also be freed outside of this application.
+                cls._condition.wait(timeout=1)
+            cls._reservations[key] = needs
+            return True
+
+    @classmethod
+    def release(cls, key):
+        with cls._condition:
+            if cls._reservations.pop(key, None) is not None:
+                cls._condition.notify_all()
+
+    @classmethod
+    def preallocate(cls, fh, offset: int, length: int):
+        """
+        Allocate length bytes for the file from offset onwards, so the writes land on contiguous blocks.
+        The file size grows to offset + length, truncate it to the bytes actually written in the end.
+        Only supported where os.posix_fallocate is available, otherwise nothing is done.
+        """
+        if length <= 0 or not hasattr(os, 'posix_fallocate'):
+            return
+        try:
+            os.posix_fallocate(fh.fileno(), offset, length)
+        except OSError as ex:
+            cls.logger.debug("preallocation failed: {}".format(ex))
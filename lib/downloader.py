@@ -0,0 +1,436 @@
+import logging
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import BinaryIO, Callable, Dict, List
+from urllib.parse import urlsplit
+
+import requests
+
+from lib.cancellation import CancelToken, DownloadCancelled
+from lib.concurrency import AdaptiveLimiter
+from lib.config import Config, ConfigType
+from lib.hedging import HedgePolicy, RequestCancelled
+from lib.hosthealth import HostHealth
+from lib.media.decrypter import Decrypter
+from lib.media.verifier import CorruptSegment, Verifier
+from lib.quality import Throughput
+from lib.ratelimiter import RateLimiter
+from lib.retry import HttpError, RetryBudget, RetryPolicy
+from lib.scheduler import Scheduler
+from lib.transport import Transport
+from lib.workerpool import TempFile, WorkerPool
+
+
+class SegmentDownloader:
+    """
+    Download the media segments of a lecture using a bounded pool of worker threads.
+    Segments are fetched concurrently, but are handed back to the caller in playlist order.
+    Response bodies are streamed in chunks and decrypted on the fly into a spooled buffer, which the caller
+    appends to the track file. A segment stays in memory unless it is larger than segment_spool_size, and only
+    a bounded number of segments are fetched ahead of the one the caller is waiting for.
+    Used as a context manager, concurrent download() calls (e.g. one per track) share the same worker threads.
+    """
+    chunk_size = 64 * 1024
+
+    # seconds between checks for a cancel, while waiting for a segment.
+    cancel_check_interval = 0.5
+
+    def __init__(self, ttid, pause_ev: threading.Event, resume_ev: threading.Event, key_func: Callable,
+                 temp_dir: str = None, retry_budget: RetryBudget = None, cancel_token: CancelToken = None):
+        """
+        :param ttid: video ttid, used for logging.
+        :param pause_ev: pause event, set while the download is paused.
+        :param resume_ev: resume event, set when a paused download is resumed.
+        :param key_func: function returning the encryption key for a given segment item.
+        :param temp_dir: directory for segments that overflow the in-memory spool.
+        :param retry_budget: retry budget of the lecture, shared with other requests made for it.
+        :param cancel_token: if cancelled, the segment requests in flight are abandoned, and the download raises
+        DownloadCancelled. The same happens on stop(), without cancelling cancel_token.
+        """
+        self.ttid = ttid
+        self.pause_ev = pause_ev
+        self.resume_ev = resume_ev
+        self.key_func = key_func
+        self.temp_dir = temp_dir
+        self.retry_budget = retry_budget
+        self.retry_policy = RetryPolicy()
+        self.cancel_token = cancel_token.link() if cancel_token else CancelToken()
+
+        self.conf = Config.load(ConfigType.IMPARTUS)
+        self.num_workers = max(1, int(self.conf.get('segment_download_threads') or 1))
+        if self.conf.get('adaptive_concurrency'):
+            # the adaptive limit is the only cap, a lecture may use all the segment slots it allows.
+            self.num_workers = max(1, int(self.conf.get('max_inflight_segments') or 16))
+        self.spool_size = int(self.conf.get('segment_spool_size') or 16) * 1024 * 1024
+
+        # segments fetched ahead of the one being consumed, limits the number of buffered segments.
+        self.window = 2 * self.num_workers
+
+        # only the first worker to notice a pause / resume logs it.
+        self.lock = threading.Lock()
+        self.paused = False
+
+        # every decrypted segment is verified, corrupt segments are fetched again.
+        self.verify = bool(self.conf.get('verify_segments'))
+        self.stats = {'verified': 0, 'corrupt': 0, 'accepted': 0, 'hedged': 0, 'hedge_wins': 0}
+
+        # straggler segments are raced against a duplicate request.
+        self.hedge_policy = HedgePolicy()
+
+        # throughput of this download, for the auto quality selection.
+        self.throughput = Throughput()
+
+        self.executor = None
+        self.hedge_executor = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def wait_if_paused(self):
+        """
+        Block the calling worker for as long as the download is paused.
+        """
+        if not self.pause_ev.is_set():
+            return
+
+        with self.lock:
+            if not self.paused:
+                self.logger.info("[{}]: Pausing download".format(self.ttid))
+                self.paused = True
+
+        self.resume_ev.wait()
+
+        with self.lock:
+            if self.paused:
+                self.logger.info("[{}]: Resuming download".format(self.ttid))
+                self.paused = False
+
+    def stop(self):
+        """
+        Stop the download as if cancelled, e.g. once a track of the lecture failed, the other tracks need not go on.
+        """
+        self.cancel_token.cancel()
+
+    def download_segment(self, item: Dict) -> BinaryIO:
+        """
+        Download a single media segment, decrypting it on the fly. Transient failures are retried as per
+        the retry policy, within the lecture's retry budget.
+        :param item: segment item as returned by M3u8Parser.
+        :return: file object holding the decrypted segment, positioned at the start. Caller must close it.
+        """
+        encryption_key = None
+        if item.get('encryption_method') != "NONE":
+            encryption_key = self.key_func(item)
+
+        description = '[{}]: segment {}'.format(self.ttid, item['url'])
+        try:
+            return self.hedged_fetch(item, encryption_key, description)
+        except CorruptSegment as ex:
+            if not ex.continuity_error:
+                raise
+            # the server keeps sending it this way, the segment is playable, if with a glitch.
+            self.logger.warning("{}: {}, accepting the segment anyway.".format(description, ex))
+            self.add_stat('accepted')
+            return self.fetch_segment(item, encryption_key, verify=False)
+
+    def hedged_fetch(self, item: Dict, encryption_key, description: str) -> BinaryIO:
+        """
+        Fetch a segment (with retries), duplicating the request if it turns out to be a straggler as per the
+        hedge policy. The first of the two requests to succeed wins, the other one is cancelled.
+        """
+        self.hedge_policy.count_request()
+        delay = self.hedge_policy.get_delay()
+        if delay is None or not self.hedge_executor:
+            return self.retried_fetch(item, encryption_key, description)
+
+        cancel_events = [threading.Event(), threading.Event()]
+        request = dict()
+        primary = self.hedge_executor.submit(self.retried_fetch, item, encryption_key, description, cancel_events[0],
+                                             request=request)
+        # a request is timed from the start of its current attempt, not while it waits for a segment slot, a retry
+        # or a resume. Waiting delay before it starts never overshoots its deadline.
+        while True:
+            start = request.get('start')
+            timeout = delay if start is None else start + delay - time.monotonic()
+            try:
+                return primary.result(timeout=max(0.0, timeout))
+            except FuturesTimeoutError:
+                if start is not None and start == request.get('start') and time.monotonic() - start >= delay:
+                    break
+
+        # a paused download is slow for a reason.
+        if self.pause_ev.is_set() or not self.hedge_policy.acquire_hedge():
+            return primary.result()
+
+        self.add_stat('hedged')
+        self.logger.debug("{}: no response in {:.1f}s, sending a hedged request.".format(description, delay))
+        # the duplicate goes to another host than the one the straggler is waiting on, if there is one.
+        duplicate = self.hedge_executor.submit(self.retried_fetch, item, encryption_key, description,
+                                               cancel_events[1], avoid_host=request.get('host'))
+
+        futures = [primary, duplicate]
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in [x for x in futures if x in done]:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                # cancel the other request, and discard its segment should it complete anyway.
+                for other, cancel_event in zip(futures, cancel_events):
+                    if other is not future:
+                        cancel_event.set()
+                        other.add_done_callback(lambda x: x.exception() is None and x.result().close())
+                if future is duplicate:
+                    self.add_stat('hedge_wins')
+                return future.result()
+        raise error
+
+    def retried_fetch(self, item: Dict, encryption_key, description: str, cancel_event: threading.Event = None,
+                      **kwargs):
+        """
+        Fetch a segment with retries. A cancelled request (or download) is not retried, nor kept waiting for its
+        next retry.
+        :param kwargs: passed on to fetch_segment.
+        """
+        # cancelling the download abandons the request as well.
+        interrupt = cancel_event or threading.Event()
+        try:
+            with self.cancel_token.on_cancel(interrupt.set):
+                return self.retry_policy.call(self.fetch_segment, item, encryption_key, budget=self.retry_budget,
+                                              description=description, interrupt=interrupt,
+                                              cancel_event=cancel_event, **kwargs)
+        except Exception as ex:
+            if self.cancel_token.is_cancelled() and not isinstance(ex, DownloadCancelled):
+                raise DownloadCancelled() from ex
+            raise
+
+    def fetch_segment(self, item: Dict, encryption_key, verify=True, cancel_event: threading.Event = None,
+                      request: Dict = None, avoid_host: str = None) -> BinaryIO:
+        """
+        Single attempt at downloading, decrypting and verifying a media segment, from the healthiest of the
+        equivalent media hosts.
+        :param cancel_event: if set, the download is abandoned with RequestCancelled.
+        :param request: if given, request['host'] is set to the host requested, and request['start'] to the time
+        the request started, once it holds a segment slot. 'start' is None while it does not.
+        :param avoid_host: host not to be requested, unless there is no other.
+        """
+        while True:
+            self.wait_if_paused()
+            self.cancel_token.raise_if_cancelled()
+            if cancel_event and cancel_event.is_set():
+                raise RequestCancelled()
+            try:
+                return self._fetch_segment(item, encryption_key, verify, cancel_event, request, avoid_host)
+            except DownloadPaused:
+                # the request was abandoned (and its connection closed) on pause, fetched again once resumed.
+                continue
+
+    def _fetch_segment(self, item: Dict, encryption_key, verify=True, cancel_event: threading.Event = None,
+                       request: Dict = None, avoid_host: str = None) -> BinaryIO:
+        url = HostHealth.choose_url(item['url'], exclude=avoid_host)
+        request = request if request is not None else dict()
+
+        # with worker processes, the segment is saved encrypted, to be decrypted by a worker.
+        worker_pool = WorkerPool.is_enabled()
+        if worker_pool:
+            segment_fh = TempFile.create(dir=self.temp_dir)
+        else:
+            segment_fh = tempfile.SpooledTemporaryFile(max_size=self.spool_size, dir=self.temp_dir)
+        # closes the response on cancel. Registered before the request is sent, a cancel while it connects or waits
+        # for the headers closes the response as soon as it arrives, download() does not wait for it meanwhile.
+        responses = list()
+        try:
+            # segments in flight are capped across all the active downloads.
+            with Scheduler.segment_slot().hold(self.cancel_token) as slot, self.track_latency(slot), \
+                    HostHealth.track(url, is_failure=self.is_server_failure), self.track_request(request, url), \
+                    self.cancel_token.on_cancel(lambda: [x.close() for x in responses]):
+                # the other request of a hedged pair may have won while this one waited for its slot.
+                if cancel_event and cancel_event.is_set():
+                    raise RequestCancelled()
+                with Transport.get(url, stream=True) as response:
+                    responses.append(response)
+                    self.cancel_token.raise_if_cancelled()
+                    RetryPolicy.raise_for_status(response)
+                    content_length = self.get_content_length(response)
+                    received = [0]
+
+                    def counted(chunks):
+                        for chunk in chunks:
+                            if cancel_event and cancel_event.is_set():
+                                raise RequestCancelled()
+                            self.cancel_token.raise_if_cancelled()
+                            if self.pause_ev.is_set():
+                                raise DownloadPaused()
+                            received[0] += len(chunk)
+                            yield chunk
+
+                    chunks = RateLimiter.throttle(counted(response.iter_content(self.chunk_size)), self.cancel_token)
+                    if worker_pool:
+                        for chunk in chunks:
+                            segment_fh.write(chunk)
+                    else:
+                        Decrypter.decrypt_stream(encryption_key, chunks, segment_fh)
+                # latency as seen by the hedge policy, from holding a slot to the end of the body.
+                self.hedge_policy.record(time.monotonic() - request['start'])
+
+            if worker_pool:
+                encrypted_fh = segment_fh
+                with encrypted_fh:
+                    segment_fh = WorkerPool.process_segment(encryption_key, encrypted_fh.name,
+                                                            self.verify and verify, content_length, received[0])
+            elif self.verify and verify:
+                Verifier.verify(segment_fh, content_length, received[0])
+            if self.verify and verify:
+                self.add_stat('verified')
+            self.throughput.record(received[0])
+            Throughput.history().record(received[0])
+            segment_fh.seek(0)
+            return segment_fh
+        except Exception as ex:
+            segment_fh.close()
+            # failed verification, or a truncated body that does not decrypt.
+            if isinstance(ex, CorruptSegment):
+                self.add_stat('corrupt')
+            # e.g. the response closed under the read, not to be retried.
+            if self.cancel_token.is_cancelled() and not isinstance(ex, DownloadCancelled):
+                raise DownloadCancelled() from ex
+            raise
+
+    @classmethod
+    @contextmanager
+    def track_request(cls, request: Dict, url: str):
+        """
+        Mark the request as started (see fetch_segment()) while inside the context.
+        """
+        request['host'] = urlsplit(url).netloc
+        request['start'] = time.monotonic()
+        try:
+            yield
+        finally:
+            request['start'] = None
+
+    @classmethod
+    @contextmanager
+    def track_latency(cls, slot: AdaptiveLimiter):
+        """
+        Report the outcome of a request to the concurrency limiter: its latency if it succeeds, or a failure
+        if the server pushed back or timed out.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as ex:
+            if cls.is_server_failure(ex):
+                slot.on_failure()
+            raise
+        slot.on_success(time.monotonic() - start)
+
+    @classmethod
+    def is_server_failure(cls, ex: Exception) -> bool:
+        """
+        True if the request failed due to the server pushing back (429, 5xx), timing out or dropping the connection.
+        """
+        if isinstance(ex, HttpError):
+            return ex.status_code in RetryPolicy.retryable_status_codes
+        return isinstance(ex, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                               TimeoutError, ConnectionError))
+
+    @classmethod
+    def get_content_length(cls, response):
+        """
+        Return the Content-Length of the response, None if not known. The length of an encoded (e.g. gzip) body
+        does not match the decoded content, and is ignored.
+        """
+        if response.headers.get('Content-Encoding', 'identity') != 'identity':
+            return None
+        try:
+            return int(response.headers['Content-Length'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def get_segment_size(self, item: Dict):
+        """
+        Return the size of a media segment as reported by the server, without downloading it. None if not known.
+        """
+        with Transport.head(item['url'], allow_redirects=True) as response:
+            if not 200 <= response.status_code < 300:
+                return None
+            return self.get_content_length(response)
+
+    def add_stat(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def log_stats(self):
+        if self.stats['hedged']:
+            self.logger.info("[{}]: hedged segment requests: {}, won by the hedged request: {}".format(
+                self.ttid, self.stats['hedged'], self.stats['hedge_wins']))
+        if self.verify:
+            self.logger.info("[{}]: segments verified: {}, corrupt segments re-fetched: {}, accepted with errors: {}"
+                             .format(self.ttid, self.stats['verified'], self.stats['corrupt'], self.stats['accepted']))
+
+    def __enter__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        if self.hedge_policy.enabled:
+            # runs the primary and the hedged request of every segment being downloaded.
+            self.hedge_executor = ThreadPoolExecutor(max_workers=2 * self.num_workers)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # once cancelled, requests still connecting / waiting for a response are left to finish in the background.
+        wait_for_workers = not self.cancel_token.is_cancelled()
+        self.executor.shutdown(wait=wait_for_workers)
+        self.executor = None
+        if self.hedge_executor:
+            self.hedge_executor.shutdown(wait=wait_for_workers)
+            self.hedge_executor = None
+
+    def download(self, items: List[Dict]):
+        """
+        Download all the given segments concurrently.
+        :param items: list of segment items as returned by M3u8Parser.
+        :return: generator yielding (item, segment file object) tuples in the same order as items. The segments
+        fetched ahead are discarded if the generator is closed early.
+        """
+        if self.executor is None:
+            with self:
+                yield from self.download(items)
+            return
+
+        items_iter = iter(items)
+        futures = deque()
+        for item in items_iter:
+            futures.append((item, self.executor.submit(self.download_segment, item)))
+            if len(futures) >= self.window:
+                break
+
+        try:
+            while futures:
+                item, future = futures[0]
+                # a cancelled download does not wait for a request stuck connecting / waiting for a response.
+                while True:
+                    try:
+                        segment_fh = future.result(timeout=self.cancel_check_interval)
+                        break
+                    except FuturesTimeoutError:
+                        self.cancel_token.raise_if_cancelled()
+                futures.popleft()
+
+                # keep the window full.
+                next_item = next(items_iter, None)
+                if next_item is not None:
+                    futures.append((next_item, self.executor.submit(self.download_segment, next_item)))
+                yield item, segment_fh
+        finally:
+            for _, future in futures:
+                if not future.cancel():
+                    future.add_done_callback(lambda x: x.exception() is None and x.result().close())
+
+
+class DownloadPaused(Exception):
+    pass
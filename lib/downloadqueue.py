@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+from typing import Dict
+
+from lib.config import Config, ConfigType
+from lib.tempstorage import TempStorage
+
+
+class DownloadQueue:
+    """
+    Process wide record of the lecture downloads requested and not completed yet, along with their pause state.
+    Saved to disk if persist_download_queue is set, so that the downloads can be queued again when the app is
+    restarted, each resuming from its journal.
+    """
+    filename = 'queue.json'
+
+    _entries = dict()
+    _lock = threading.Lock()
+    _loaded = False
+
+    @classmethod
+    def get_filepath(cls):
+        return os.path.join(TempStorage.get_dir(), cls.filename)
+
+    @classmethod
+    def is_persistent(cls):
+        return bool(Config.load(ConfigType.IMPARTUS).get('persist_download_queue'))
+
+    @classmethod
+    def _load(cls):
+        """
+        Load the queue saved on disk, on first use. Call with cls._lock held.
+        """
+        if cls._loaded:
+            return
+        cls._loaded = True
+        if cls.is_persistent() and os.path.exists(cls.get_filepath()):
+            try:
+                with open(cls.get_filepath(), 'r') as fh:
+                    cls._entries.update(json.load(fh))
+            except ValueError:
+                pass
+
+    @classmethod
+    def _save(cls):
+        """
+        Write the queue to disk, atomically. Call with cls._lock held.
+        """
+        if not cls.is_persistent():
+            return
+        filepath = cls.get_filepath()
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_filepath = '{}.tmp'.format(filepath)
+        with open(tmp_filepath, 'w') as fh:
+            json.dump(cls._entries, fh)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def add(cls, key: str, entry: Dict):
+        """
+        Record a download.
+        :param key: key of the download, e.g. the lecture's ttid.
+        :param entry: json serializable details needed to queue the download again, 'paused' is its pause state.
+        """
+        with cls._lock:
+            cls._load()
+            cls._entries[key] = dict(entry, paused=bool(entry.get('paused')))
+            cls._save()
+
+    @classmethod
+    def set_paused(cls, key: str, paused: bool):
+        with cls._lock:
+            cls._load()
+            if key in cls._entries:
+                cls._entries[key]['paused'] = paused
+                cls._save()
+
+    @classmethod
+    def remove(cls, key: str):
+        """
+        Forget a download, once it is complete (or has failed).
+        """
+        with cls._lock:
+            cls._load()
+            if cls._entries.pop(key, None) is not None:
+                cls._save()
+
+    @classmethod
+    def get_all(cls) -> Dict[str, Dict]:
+        """
+        Return the downloads recorded, in the order they were requested.
+        """
+        with cls._lock:
+            cls._load()
+            return {key: dict(entry) for key, entry in cls._entries.items()}
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+            cls._loaded = True
+            if os.path.exists(cls.get_filepath()):
+                os.unlink(cls.get_filepath())
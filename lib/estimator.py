@@ -0,0 +1,59 @@
+import logging
+from typing import Callable, Dict, List
+
+from lib.config import Config, ConfigType
+
+
+class SizeEstimator:
+    """
+    Estimate the download size of a lecture before the download starts, from the segment durations in the playlist
+    and the Content-Length of a few sampled segments.
+    """
+
+    def __init__(self, ttid, head_func: Callable, num_samples: int = None):
+        """
+        :param ttid: video ttid, used for logging.
+        :param head_func: function returning the Content-Length (int, None if not known) of a segment item.
+        :param num_samples: number of segments sampled, spread evenly over the lecture.
+        """
+        self.ttid = ttid
+        self.head_func = head_func
+        if num_samples is None:
+            num_samples = Config.load(ConfigType.IMPARTUS).get('size_estimate_samples')
+        self.num_samples = int(num_samples or 0)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get_samples(self, items: List[Dict]) -> List[Dict]:
+        if not items or self.num_samples <= 0:
+            return []
+        step = max(1, len(items) // self.num_samples)
+        return items[::step][:self.num_samples]
+
+    def estimate(self, tracks_info: List) -> Dict:
+        """
+        :param tracks_info: list of tracks as returned by M3u8Parser.
+        :return: dict with the estimated size in bytes of each track ('tracks') and of the lecture ('total'),
+        None if none of the sampled segments reported a size.
+        """
+        items = [item for track_info in tracks_info for item in track_info]
+        sampled_bytes, sampled_duration = 0, 0.0
+        for item in self.get_samples(items):
+            try:
+                content_length = self.head_func(item)
+            except Exception as ex:
+                self.logger.debug("[{}]: could not sample segment size: {}".format(self.ttid, ex))
+                continue
+            if content_length and item.get('duration'):
+                sampled_bytes += content_length
+                sampled_duration += item['duration']
+
+        if not sampled_duration:
+            return None
+
+        bytes_per_second = sampled_bytes / sampled_duration
+        tracks = [int(sum(item['duration'] for item in track_info) * bytes_per_second) for track_info in tracks_info]
+        self.logger.info("[{}]: estimated download size: {:.1f} MB".format(self.ttid, sum(tracks) / 1024 / 1024))
+        return {
+            'tracks': tracks,
+            'total': sum(tracks),
+        }
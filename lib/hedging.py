@@ -0,0 +1,83 @@
+import threading
+from collections import deque
+
+from lib.config import Config, ConfigType
+
+
+class LatencyTracker:
+    """
+    Sliding window of the most recent request latencies.
+    """
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def percentile(self, percent: float) -> float:
+        """
+        Return the given percentile (0-100) of the recorded latencies, None if nothing recorded yet.
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percent / 100))
+        return latencies[index]
+
+
+class HedgePolicy:
+    """
+    Decides when a slow (straggler) segment request is duplicated, the first of the two to finish is used.
+    A request is hedged once it takes longer than hedge_percentile of the recent segment downloads, and the
+    duplicate requests are capped at hedge_max_fraction of all the requests.
+    Duplicates go to another host than the request being hedged, if media_host_mirrors are configured.
+    """
+    # latencies needed before hedging kicks in.
+    min_samples = 20
+
+    def __init__(self, percentile: float = None, max_fraction: float = None):
+        conf = Config.load(ConfigType.IMPARTUS)
+        self.enabled = bool(conf.get('hedge_requests'))
+        self.percentile = float(percentile or conf.get('hedge_percentile') or 95)
+        self.max_fraction = float(max_fraction if max_fraction is not None else conf.get('hedge_max_fraction') or 0)
+
+        self.latencies = LatencyTracker()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+
+    def record(self, seconds: float):
+        self.latencies.record(seconds)
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def get_delay(self) -> float:
+        """
+        Return the time in seconds after which a request is to be hedged, None if requests are not hedged.
+        """
+        if not self.enabled or not self.max_fraction or len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def acquire_hedge(self) -> bool:
+        """
+        Return True if one more duplicate request is allowed.
+        """
+        with self.lock:
+            if self.hedges + 1 > self.max_fraction * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+class RequestCancelled(Exception):
+    pass
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+from lib.config import Config, ConfigType
+
+
+class HostHealth:
+    """
+    Process wide health of the media hosts: latency, requests in flight and failures per host.
+    Segment urls are spread over the host in the url and its equivalent hosts (media_host_mirrors), preferring
+    the ones responding fastest with the least requests in flight. A host failing circuit_breaker_failures
+    requests in a row is avoided (circuit open) for circuit_breaker_cooldown seconds, after which a single request
+    is let through to probe it (half open).
+    """
+    # weight of the latest latency in the smoothed latency.
+    smoothing = 0.2
+
+    _hosts = dict()
+    _lock = threading.Lock()
+
+    logger = logging.getLogger('HostHealth')
+
+    @classmethod
+    def get_mirrors(cls):
+        """
+        Return the configured mirror hosts as (scheme, netloc) tuples.
+        """
+        mirrors = list()
+        for mirror in Config.load(ConfigType.IMPARTUS).get('media_host_mirrors') or []:
+            parts = urlsplit(mirror if '//' in mirror else '//{}'.format(mirror))
+            mirrors.append((parts.scheme, parts.netloc))
+        return mirrors
+
+    @classmethod
+    def _get_host(cls, netloc: str):
+        """
+        Return the stats of a host. Call with cls._lock held.
+        """
+        return cls._hosts.setdefault(netloc, {
+            'latency': None,
+            'in_flight': 0,
+            'failures': 0,
+            'open_until': 0.0,
+            'probing': False,
+        })
+
+    @classmethod
+    def _is_available(cls, host, now: float) -> bool:
+        """
+        False while the host's circuit is open, or while its half open probe request is in flight.
+        """
+        if host['failures'] < cls.get_max_failures():
+            return True
+        return now >= host['open_until'] and not host['probing']
+
+    @classmethod
+    def get_max_failures(cls) -> int:
+        return int(Config.load(ConfigType.IMPARTUS).get('circuit_breaker_failures') or 5)
+
+    @classmethod
+    def choose_url(cls, url: str, exclude: str = None) -> str:
+        """
+        Return url, with its host replaced by the healthiest of the equivalent hosts.
+        :param url: media url.
+        :param exclude: host (netloc) to be avoided if there is any other available, e.g. the host of a request
+        being hedged.
+        """
+        parts = urlsplit(url)
+        candidates = [(parts.scheme, parts.netloc)]
+        candidates.extend([x for x in cls.get_mirrors() if x[1] != parts.netloc])
+        if len(candidates) == 1:
+            return url
+
+        now = time.monotonic()
+        with cls._lock:
+            available = [x for x in candidates if cls._is_available(cls._get_host(x[1]), now)]
+            preferred = [x for x in available if x[1] != exclude] or available or candidates
+
+            # a half open host gets its probe request, then hosts failing the fewest requests in a row, then the ones
+            # not tried yet, then by latency scaled by the requests in flight.
+            def score(candidate):
+                host = cls._get_host(candidate[1])
+                half_open = host['failures'] >= cls.get_max_failures()
+                return not half_open, host['failures'], (host['latency'] or 0.0) * (host['in_flight'] + 1)
+            scheme, netloc = min(preferred, key=score)
+
+        return urlunsplit((scheme or parts.scheme, netloc, parts.path, parts.query, parts.fragment))
+
+    @classmethod
+    @contextmanager
+    def track(cls, url: str, is_failure=lambda ex: True):
+        """
+        Context manager around a request to url, recording its latency, or its failure.
+        :param is_failure: function telling if an exception raised by the request counts against the host.
+        """
+        netloc = urlsplit(url).netloc
+        with cls._lock:
+            host = cls._get_host(netloc)
+            host['in_flight'] += 1
+            if host['failures'] >= cls.get_max_failures():
+                host['probing'] = True
+
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as ex:
+            with cls._lock:
+                host['in_flight'] -= 1
+                host['probing'] = False
+                if is_failure(ex):
+                    cls._record_failure(netloc, host)
+            raise
+
+        with cls._lock:
+            host['in_flight'] -= 1
+            host['probing'] = False
+            latency = time.monotonic() - start
+            if host['latency'] is None:
+                host['latency'] = latency
+            else:
+                host['latency'] += cls.smoothing * (latency - host['latency'])
+            if host['failures'] >= cls.get_max_failures():
+                cls.logger.info("{}: responding again, circuit closed.".format(netloc))
+            host['failures'] = 0
+
+    @classmethod
+    def _record_failure(cls, netloc: str, host):
+        """
+        Call with cls._lock held.
+        """
+        host['failures'] += 1
+        if host['failures'] >= cls.get_max_failures():
+            cooldown = float(Config.load(ConfigType.IMPARTUS).get('circuit_breaker_cooldown') or 30)
+            host['open_until'] = time.monotonic() + cooldown
+            cls.logger.warning("{}: {} failures in a row, circuit open for {:.0f}s.".format(
+                netloc, host['failures'], cooldown))
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._hosts.clear()
@@ -1,21 +1,37 @@
 import os
 import re
-import time
-import requests
+import shutil
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
+from typing import Callable, Dict, List
 import enzyme
 import platform
 from datetime import datetime, timedelta
 
+from lib.cancellation import CancelToken, DownloadCancelled
 from lib.config import Config, ConfigType
 from lib.utils import Utils
+from lib.diskspace import DiskSpace
+from lib.downloader import SegmentDownloader
+from lib.estimator import SizeEstimator
+from lib.journal import Journal
+from lib.keycache import KeyCache
+from lib.quality import AutoQuality
+from lib.ratelimiter import RateLimiter
+from lib.retry import HttpError, RetryBudget, RetryPolicy
+from lib.tempstorage import TempStorage
+from lib.transport import Transport
 from lib.media.encoder import Encoder
 from lib.media.m3u8parser import M3u8Parser
-from lib.media.decrypter import Decrypter
 
 
 class Impartus:
+    # the upgrade of a preview is encoded to <lecture><upgrade_suffix>.mkv, see get_upgrade_path().
+    upgrade_suffix = '.upgrade'
+
     def __init__(self, token=None):
         self.session = None
         self.token = None
@@ -27,12 +43,10 @@ class Impartus:
 
         # reuse the auth token, if we are already authenticated.
         if token:
-            self.token = token
-            self.session = requests.Session()
-            self.session.cookies.update({'Bearer': token})
-            self.session.headers.update({'Authorization': 'Bearer {}'.format(token)})
+            self.set_token(token)
 
         self.conf = Config.load(ConfigType.IMPARTUS)
+        self.retry_policy = RetryPolicy()
 
         # save the files here.
         platform_name = platform.system()
@@ -43,39 +57,47 @@ class Impartus:
             for key, value in self.conf['export_variables'].get(platform_name).items():
                 os.environ[key] = value
 
-        self.temp_downloads_dir = os.path.join(Utils.get_temp_dir(), 'impartus.media')
-        os.makedirs(self.temp_downloads_dir, exist_ok=True)
+        self.temp_downloads_dir = TempStorage.get_dir()
 
-    def _download_m3u8(self, root_url, ttid, flipped=False, video_quality='highest'):
+    def _get_variant_urls(self, root_url, ttid, flipped=False, retry_budget=None):
+        """
+        Return the playlist urls of the variants (qualities) of a video, listed in its master playlist.
+        """
         if flipped:
             master_url = '{}/api/fetchvideo?fcid={}&token={}&type=index.m3u8'.format(root_url, ttid, self.token)
         else:
             master_url = '{}/api/fetchvideo?ttid={}&token={}&type=index.m3u8'.format(root_url, ttid, self.token)
-        response = self.session.get(master_url)
+        response = self._get(master_url, retry_budget=retry_budget)
         m3u8_urls = []
         if response.status_code == 200:
             lines = response.text.splitlines()
             for line in lines:
                 if re.match('^http', line):
                     m3u8_urls.append(line.strip())
+        return m3u8_urls
 
-        url = None
-        if flipped:
-            if video_quality == 'highest':
-                url = self.get_url_for_highest_quality_video(m3u8_urls)
-            elif video_quality == 'lowest':
-                url = self.get_url_for_lowest_quality_video(m3u8_urls)
-            else:  # given a specific resolution.
-                url = self.get_url_for_resolution(m3u8_urls, video_quality)
-        elif len(m3u8_urls) > 0:
-            url = m3u8_urls[0]
-
+    def _download_m3u8(self, root_url, ttid, flipped=False, video_quality='highest', retry_budget=None):
+        m3u8_urls = self._get_variant_urls(root_url, ttid, flipped, retry_budget)
+        url = self.get_url_for_quality(m3u8_urls, flipped, video_quality)
         if url:
-            response = self.session.get(url)
+            response = self._get(url, retry_budget=retry_budget)
             if response.status_code == 200:
                 return response.text.splitlines()
         return None
 
+    def get_url_for_quality(self, m3u8_urls, flipped=False, video_quality='highest'):
+        """
+        Return the playlist url of the variant to download in video_quality, None if there is none.
+        """
+        if not flipped:
+            return m3u8_urls[0] if len(m3u8_urls) > 0 else None
+        if video_quality in ['highest', 'auto']:
+            return self.get_url_for_highest_quality_video(m3u8_urls)
+        elif video_quality == 'lowest':
+            return self.get_url_for_lowest_quality_video(m3u8_urls)
+        else:  # given a specific resolution.
+            return self.get_url_for_resolution(m3u8_urls, video_quality)
+
     def get_url_for_highest_quality_video(self, m3u8_urls):
         for resolution in self.conf.get('video_quality_order'):
             for url in m3u8_urls:
@@ -94,10 +116,53 @@ class Impartus:
                 return url
 
     def process_video(self, video_metadata, mkv_filepath, root_url, pause_ev, resume_ev, progress_callback_func,
-                      video_quality='highest'):
+                      video_quality='highest', time_range=None, tracks=None, cancel_token: CancelToken = None):
         """
         Download video and decrypt, join, encode to mkv
-        :return:
+        :param time_range: (start, end) in seconds to download only part of the lecture, end None for up to the end.
+        :param tracks: indices of the tracks to download, None for the download_tracks config.
+        :param cancel_token: cancels the download / encode, see download_video().
+        :return: True if the mkv file was created.
+        """
+        media = self.download_video(video_metadata, mkv_filepath, root_url, pause_ev, resume_ev,
+                                    progress_callback_func, video_quality, time_range, tracks,
+                                    cancel_token=cancel_token)
+        return self.encode_video(media, cancel_token) if media else False
+
+    def download_video(self, video_metadata, mkv_filepath, root_url, pause_ev, resume_ev, progress_callback_func,
+                       video_quality='highest', time_range=None, tracks=None, upgrade=False,
+                       cancel_token: CancelToken = None):
+        """
+        Download video streams, decrypt and join them into one ts file per track.
+        :param time_range: (start, end) in seconds to download only part of the lecture, end None for up to the end.
+        Only the segments covering the time range are downloaded, and trimmed to it when encoding.
+        :param tracks: indices of the tracks to download, None for the download_tracks config (default: all).
+        :param upgrade: True if this download is to replace the preview mkv at mkv_filepath, see
+        get_preview_quality(). The mkv is encoded next to it, and moved in place by encode_video().
+        :param cancel_token: if cancelled, the segment downloads stop, and the temp files are deleted (or kept as
+        per keep_cancelled_downloads).
+        :return: dict with the details needed by encode_video(), None if the download failed or was cancelled.
+        """
+        ttid = video_metadata.get('fcid') or video_metadata['ttid']
+
+        # owning the download directory, so that it is not reclaimed while the download is active.
+        # the reservation is released by encode_video() once the download is encoded, right away if it fails.
+        TempStorage.reserve(ttid, 0)
+        media = None
+        try:
+            media = self._download_video(video_metadata, mkv_filepath, root_url, pause_ev, resume_ev,
+                                         progress_callback_func, video_quality, time_range, tracks, upgrade,
+                                         cancel_token)
+            return media
+        finally:
+            if not media:
+                self.release_space(ttid)
+
+    def _download_video(self, video_metadata, mkv_filepath, root_url, pause_ev, resume_ev, progress_callback_func,
+                        video_quality='highest', time_range=None, tracks=None, upgrade=False,
+                        cancel_token: CancelToken = None):
+        """
+        Body of download_video(), run with the lecture's temp storage reserved.
         """
         if video_metadata.get('fcid'):
             ttid = video_metadata['fcid']
@@ -106,81 +171,504 @@ class Impartus:
             ttid = video_metadata['ttid']
             flipped = False
 
+        upgrade_of = None
+        if upgrade:
+            upgrade_of, mkv_filepath = mkv_filepath, self.get_upgrade_path(mkv_filepath)
+            # the preview is there to watch meanwhile, the upgrade need not adapt to the bandwidth.
+            if video_quality == 'auto':
+                video_quality = 'highest'
+
         number_of_tracks = int(video_metadata['tapNToggle'])
         duration = int(video_metadata['actualDuration'])
-        encryption_keys = dict()
+        retry_budget = RetryBudget()
+
+        # resume from the journal of an earlier, interrupted download if there is one.
+        download_dir = TempStorage.get_download_dir(ttid)
+        os.makedirs(download_dir, exist_ok=True)
+        journal = Journal(download_dir)
+        if upgrade and journal.is_complete('encode'):
+            # left behind by the preview (temp files are kept in debug mode), it is not to be resumed.
+            journal.delete()
+            journal = Journal(download_dir)
+
+        downloader = SegmentDownloader(ttid, pause_ev, resume_ev,
+                                       partial(self.get_encryption_key, ttid, journal=journal,
+                                               retry_budget=retry_budget),
+                                       temp_dir=download_dir, retry_budget=retry_budget, cancel_token=cancel_token)
 
         self.logger.info("[{}]: Starting download for {}".format(ttid, mkv_filepath))
         # download media files for this video.
-        m3u8_content = self._download_m3u8(root_url, ttid, flipped, video_quality)
+        auto_quality = None
+        m3u8_content = journal.get_playlist()
+        if m3u8_content:
+            self.logger.info("[{}]: Resuming an earlier download from {}".format(ttid, download_dir))
+        else:
+            try:
+                if flipped and video_quality == 'auto' and number_of_tracks == 1:
+                    auto_quality, m3u8_content = self.start_auto_quality(ttid, root_url, downloader, retry_budget)
+                if not m3u8_content:
+                    m3u8_content = self._download_m3u8(root_url, ttid, flipped, video_quality, retry_budget)
+            except (HttpError, *RetryPolicy.retryable_exceptions) as ex:
+                self.logger.error("[{}]: Error fetching the playlist for {}: {}".format(ttid, mkv_filepath, ex))
+                return None
+            if m3u8_content:
+                journal.set_playlist(m3u8_content)
         if m3u8_content:
-            summary, tracks_info = M3u8Parser(m3u8_content, num_tracks=number_of_tracks).parse()
-            download_dir = os.path.join(self.temp_downloads_dir, str(ttid))
-            os.makedirs(download_dir, exist_ok=True)
-
-            temp_files_to_delete = set()
-            ts_files = list()
-            items_processed = 0
-            for track_index, track_info in enumerate(tracks_info):
-                streams_to_join = list()
-                for item in track_info:
-
-                    # download encrypted stream..
-                    enc_stream_filepath = '{}/{}'.format(download_dir, item['file_number'])
-                    temp_files_to_delete.add(enc_stream_filepath)
-                    download_flag = False
-                    while not download_flag:
-                        if pause_ev.is_set():
-                            self.logger.info("[{}]: Pausing download for {}".format(ttid, mkv_filepath))
-                            resume_ev.wait()
-                            self.logger.info("[{}]: Resuming download for {}".format(ttid, mkv_filepath))
-                            resume_ev.clear()
-                        try:
-                            with open(enc_stream_filepath, 'wb') as fh:
-                                content = requests.get(item['url']).content
-                                fh.write(content)
-                                download_flag = True
-                        except TimeoutError:
-                            self.logger.warning("[{}]: Timeout error. retrying download for {}...".format(
-                                ttid, item['url']))
-                            time.sleep(self.conf.get('retry_wait'))
-
-                    # decrypt files if encrypted.
-                    if item.get('encryption_method') == "NONE":
-                        streams_to_join.append(enc_stream_filepath)
+            _, tracks_info = M3u8Parser(m3u8_content, num_tracks=number_of_tracks).parse()
+
+            # deselected tracks are not downloaded. Split tracks (all the tracks joined in track 0) need track 0
+            # downloaded whole, only the selected tracks are split out of it when encoding.
+            selected_tracks = self.get_selected_tracks(len(tracks_info), tracks)
+            encode_tracks = None
+            if all(tracks_info):
+                track_indices = selected_tracks
+                tracks_info = [tracks_info[x] for x in track_indices]
+            else:
+                track_indices = list(range(len(tracks_info)))
+                if selected_tracks != track_indices:
+                    encode_tracks = selected_tracks
+            if len(selected_tracks) < number_of_tracks:
+                self.logger.info("[{}]: downloading track(s) {} of {}".format(
+                    ttid, ', '.join([str(x) for x in selected_tracks]), number_of_tracks))
+
+            # progress made on another time range of the lecture is discarded.
+            journal.set_time_range(time_range)
+            trims = None
+            if time_range:
+                tracks_info, trims = self.select_time_range(ttid, tracks_info, time_range)
+                if not tracks_info:
+                    self.logger.error("[{}]: Time range starting at {} is beyond the end of {}".format(
+                        ttid, Utils.format_time(time_range[0]), mkv_filepath))
+                    return None
+            total_items = sum([len(x) for x in tracks_info])
+
+            # switching quality mid way is only done for whole lectures.
+            switch_func = None
+            if auto_quality and not time_range:
+                switch_func = partial(self.switch_auto_quality, auto_quality, journal)
+            # all the keys are fetched upfront, the first segment of a key period need not wait for its key.
+            try:
+                self.prefetch_encryption_keys(ttid, tracks_info, journal, retry_budget)
+            except (HttpError, *RetryPolicy.retryable_exceptions) as ex:
+                self.logger.error("[{}]: Error fetching encryption keys for {}: {}".format(ttid, mkv_filepath, ex))
+                return None
+
+            # estimated sizes are used to check for disk space upfront, and for the download progress.
+            estimate = SizeEstimator(ttid, downloader.get_segment_size).estimate(tracks_info)
+            stream = self.can_encode_from_stream(tracks_info, journal, track_indices)
+            ts_files = [Encoder.get_track_filepath(download_dir, x) for x in track_indices]
+            try:
+                if not self.reserve_space(ttid, estimate, [] if stream else ts_files, download_dir, mkv_filepath,
+                                          cancel_token):
+                    return None
+            except DownloadCancelled:
+                self.discard_cancelled(ttid, download_dir, mkv_filepath)
+                return None
+
+            # progress across all the tracks, the tracks are downloaded concurrently.
+            progress_lock = threading.Lock()
+            processed = {'items': 0, 'bytes': 0}
+
+            def report_progress(num_items, num_bytes):
+                with progress_lock:
+                    processed['items'] += num_items
+                    processed['bytes'] += num_bytes
+                    if estimate:
+                        progress_callback_func(min(99, processed['bytes'] * 100 // max(1, estimate['total'])))
                     else:
-                        if not encryption_keys.get(item['encryption_key_id']):
-                            key = self.session.get(item['encryption_key_url']).content[2:]
-                            key = key[::-1]  # reverse the bytes.
-                            encryption_keys[item['encryption_key_id']] = key
-                        encryption_key = encryption_keys[item['encryption_key_id']]
-                        decrypted_stream_filepath = Decrypter.decrypt(
-                            encryption_key, enc_stream_filepath,
-                            download_dir)
-                        streams_to_join.append(decrypted_stream_filepath)
-                        temp_files_to_delete.add(decrypted_stream_filepath)
-                    # update progress bar
-                    items_processed += 1
-                    items_processed_percent = items_processed * 100 // summary.get('media_files')
-                    progress_callback_func(items_processed_percent)
-
-                # All stream files for this track are decrypted, join them.
-                self.logger.info("[{}]: joining streams for track {} ..".format(ttid, track_index))
-                ts_file = Encoder.join(streams_to_join, download_dir, track_index)
-                ts_files.append(ts_file)
-                temp_files_to_delete.add(ts_file)
-
-            # Encode all ts files into a single output mkv.
-            os.makedirs(os.path.dirname(mkv_filepath), exist_ok=True)
-            success = Encoder.encode_mkv(ttid, ts_files, mkv_filepath, duration, self.conf.get('debug'))
+                        progress_callback_func(processed['items'] * 100 // max(1, total_items))
+
+            media = None
+            try:
+                if stream:
+                    media = self._download_and_encode_stream(ttid, tracks_info, downloader, journal, mkv_filepath,
+                                                             duration, download_dir, report_progress, trims)
+                else:
+                    media = self._download_tracks(ttid, tracks_info, ts_files, downloader, journal, mkv_filepath,
+                                                  duration, download_dir, report_progress, estimate, trims,
+                                                  track_indices, encode_tracks, switch_func)
+            except DownloadCancelled:
+                self.discard_cancelled(ttid, download_dir, mkv_filepath)
+            if media:
+                media['upgrade_of'] = upgrade_of
+                progress_callback_func(100)
+            return media
+
+        self.logger.error("[{}]: Error fetching the playlist for {}: no playlist found.".format(ttid, mkv_filepath))
+        return None
+
+    def get_selected_tracks(self, num_tracks: int, tracks: List[int] = None) -> List[int]:
+        """
+        Return the indices of the tracks to be downloaded: the given tracks, else download_tracks from the config,
+        else all of them. Tracks the lecture does not have are ignored.
+        """
+        if tracks is None:
+            tracks = self.conf.get('download_tracks')
+        selected = sorted(set([int(x) for x in tracks or [] if 0 <= int(x) < num_tracks]))
+        return selected or list(range(num_tracks))
+
+    def select_time_range(self, ttid, tracks_info: List, time_range):
+        """
+        Select the segments of every track covering the time range, using the segment durations.
+        :return: (tracks_info, trims) where trims is the per track (start offset, duration) for Encoder.encode_mkv(),
+        tracks_info is empty if the time range is beyond the end of the lecture.
+        """
+        start, end = time_range
+        length = end - start if end is not None else None
+        if not all(tracks_info):
+            # split tracks (all the tracks joined in track 0) are downloaded whole, and trimmed once split.
+            return tracks_info, [(start, length)] * len(tracks_info)
+
+        selected = [M3u8Parser.select_time_range(x, start, end) for x in tracks_info]
+        if not all([x[0] for x in selected]):
+            return [], None
+        self.logger.info("[{}]: downloading {} of {} segments for the time range {} - {}".format(
+            ttid, sum([len(x[0]) for x in selected]), sum([len(x) for x in tracks_info]), Utils.format_time(start),
+            Utils.format_time(end) if end is not None else 'end'))
+        return [x[0] for x in selected], [(offset, length) for _, offset in selected]
+
+    def reserve_space(self, ttid, estimate: Dict, ts_files: List, download_dir, mkv_filepath,
+                      cancel_token: CancelToken = None):
+        """
+        Reserve temp storage and disk space for the track files yet to be downloaded and the mkv file, waiting for
+        other downloads if need be. Released by encode_video().
+        :param cancel_token: the wait for space is given up with DownloadCancelled if cancelled.
+        :return: False if there is not enough space.
+        """
+        if not estimate:
+            return True
+
+        # track files of a download being resumed are partly on disk already.
+        downloaded = sum([os.path.getsize(x) for x in ts_files if os.path.exists(x)])
+        temp_needed = estimate['total'] - downloaded if ts_files else 0
+        if not TempStorage.reserve(ttid, temp_needed, cancel_token=cancel_token):
+            self.logger.error("[{}]: {:.1f} MB of temp storage needed to download {}, exceeds temp_storage_quota."
+                              .format(ttid, temp_needed / 1024 / 1024, mkv_filepath))
+            return False
+
+        if self.conf.get('check_disk_space') and \
+                not DiskSpace.reserve(ttid, {download_dir: temp_needed, mkv_filepath: estimate['total']},
+                                      cancel_token=cancel_token):
+            self.logger.error("[{}]: Not enough disk space to download {}, about {:.1f} MB needed.".format(
+                ttid, mkv_filepath, (temp_needed + estimate['total']) / 1024 / 1024))
+            return False
+        return True
+
+    def release_space(self, ttid):
+        DiskSpace.release(ttid)
+        TempStorage.release(ttid)
+
+    def _download_tracks(self, ttid, tracks_info: List, ts_files: List, downloader: SegmentDownloader,
+                         journal: Journal, mkv_filepath, duration, download_dir, report_progress, estimate: Dict,
+                         trims: List = None, track_indices: List[int] = None, encode_tracks: List[int] = None,
+                         switch_func: Callable = None):
+        """
+        Download all the tracks into track files.
+        :param trims: per track time range to be kept when encoding, for partial downloads.
+        :param track_indices: index of each of the tracks in the lecture, default: 0, 1, ..
+        :param encode_tracks: indices of the track files to be encoded, None for all.
+        :param switch_func: for a single track lecture, see _download_track().
+        :return: same as download_video()
+        """
+        # tracks are downloaded concurrently, sharing the segment download threads, and meet only at the encode.
+        track_sizes = estimate['tracks'] if estimate else [None] * len(tracks_info)
+        track_indices = track_indices or list(range(len(tracks_info)))
+        error = None
+        try:
+            with downloader, ThreadPoolExecutor(max_workers=len(tracks_info) or 1) as executor:
+                futures = [executor.submit(self._download_track, ttid, track_index, track_info, ts_file, downloader,
+                                           journal, report_progress, track_size,
+                                           switch_func if len(tracks_info) == 1 else None)
+                           for track_index, track_info, ts_file, track_size
+                           in zip(track_indices, tracks_info, ts_files, track_sizes)]
+                for future in as_completed(futures):
+                    error = future.exception()
+                    if error is not None:
+                        # fail fast, the other tracks are stopped rather than waited for.
+                        downloader.stop()
+                        break
+            if error is not None:
+                raise error
+        except (HttpError, *RetryPolicy.retryable_exceptions) as ex:
+            self.logger.error("[{}]: Error downloading {}: {}".format(ttid, mkv_filepath, ex))
+            self.logger.error("[{}]: Download again to resume from where it stopped.".format(ttid))
+            return None
+        finally:
+            downloader.log_stats()
+
+        return {
+            'ttid': ttid,
+            'ts_files': ts_files,
+            'mkv_filepath': mkv_filepath,
+            'duration': duration,
+            'download_dir': download_dir,
+            'trims': trims,
+            'tracks': encode_tracks,
+        }
+
+    def _download_track(self, ttid, track_index, track_info: List, ts_file, downloader: SegmentDownloader,
+                        journal: Journal, report_progress, track_size: int = None, switch_func: Callable = None):
+        """
+        Download, decrypt and join the segments of a track into its track file, resuming from the journal.
+        :param report_progress: called with the number of segments and bytes processed.
+        :param track_size: estimated size of the track, the track file is preallocated to this size.
+        :param switch_func: called with the number of segments done after every segment, returns the segment
+        items to download from there on instead of the rest of track_info (e.g. another quality), None to go on.
+        """
+        stage = 'download-track-{}'.format(track_index)
+        if journal.is_complete(stage) and os.path.exists(ts_file):
+            report_progress(len(track_info), os.path.getsize(ts_file))
+            return
+
+        # skip the segments already appended to the track file, discard anything written after those.
+        segments_done, bytes_done = journal.get_track_progress(track_index)
+        if not os.path.exists(ts_file) or os.path.getsize(ts_file) < bytes_done:
+            segments_done, bytes_done = 0, 0
+        report_progress(segments_done, bytes_done)
+
+        # download and decrypt streams, these are fetched in parallel but arrive here in playlist order,
+        # and are appended to the track file as they arrive.
+        with open(ts_file, 'r+b' if bytes_done else 'wb') as track_fh:
+            track_fh.truncate(bytes_done)
+            if track_size and self.conf.get('preallocate_track_files'):
+                DiskSpace.preallocate(track_fh, bytes_done, track_size - bytes_done)
+            track_fh.seek(bytes_done)
+            items = track_info[segments_done:]
+            while items:
+                next_items = None
+                for _, segment_fh in downloader.download(items):
+                    with segment_fh:
+                        shutil.copyfileobj(segment_fh, track_fh)
+                    track_fh.flush()
+                    segments_done += 1
+                    journal.set_track_progress(track_index, segments_done, track_fh.tell())
+                    report_progress(1, track_fh.tell() - bytes_done)
+                    bytes_done = track_fh.tell()
+                    if switch_func:
+                        next_items = switch_func(segments_done)
+                        if next_items:
+                            break
+                items = next_items
+
+            # drop the preallocated space not written to.
+            track_fh.truncate(track_fh.tell())
+
+        journal.set_complete(stage)
+        self.logger.info("[{}]: downloaded streams for track {} ..".format(ttid, track_index))
+
+    def start_auto_quality(self, ttid, root_url, downloader: SegmentDownloader, retry_budget: RetryBudget = None):
+        """
+        Fetch the playlists of all the variants of a (single track) flipped lecture, and pick the quality to start
+        with, see AutoQuality.
+        :return: (AutoQuality, playlist content of the quality picked), (None, None) if the variants could not be
+        sized up.
+        """
+        m3u8_urls = self._get_variant_urls(root_url, ttid, True, retry_budget)
+        contents, variants, sizes = dict(), dict(), dict()
+        for quality in self.conf.get('video_quality_order'):
+            url = self.get_url_for_resolution(m3u8_urls, quality)
+            if not url:
+                continue
+            response = self._get(url, retry_budget=retry_budget)
+            if response.status_code != 200:
+                continue
+            contents[quality] = response.text.splitlines()
+            _, tracks_info = M3u8Parser(contents[quality], num_tracks=1).parse()
+            estimate = SizeEstimator(ttid, downloader.get_segment_size).estimate(tracks_info)
+            if estimate and tracks_info[0]:
+                variants[quality] = tracks_info[0]
+                sizes[quality] = estimate['total']
+
+        if not variants:
+            return None, None
+        auto_quality = AutoQuality(ttid, variants, sizes, downloader.throughput)
+        return auto_quality, contents[auto_quality.start()]
+
+    def switch_auto_quality(self, auto_quality: AutoQuality, journal: Journal, segments_done: int):
+        """
+        Switch the quality of a lecture being downloaded, if need be. The journal's playlist is updated to the
+        segments downloaded followed by those of the new quality, so that the download resumes as it was.
+        :return: segment items of the new quality to download next, None to go on with the current quality.
+        """
+        items = auto_quality.check(segments_done)
+        if items:
+            journal.set_playlist(M3u8Parser.to_m3u8([auto_quality.track]))
+        return items
+
+    def can_encode_from_stream(self, tracks_info: List, journal: Journal, track_indices: List[int] = None):
+        """
+        Stream the decrypted segments straight into ffmpeg (encode_mode: 'pipe'), through stdin for single track
+        lectures, or through named pipes (POSIX only) for multi track lectures.
+        Split tracks (a track with no segments of its own), and downloads being resumed from the journal keep
+        using track files.
+        :param track_indices: index of each of the tracks in the lecture, default: 0, 1, ..
+        """
+        if self.conf.get('encode_mode') != 'pipe' or not tracks_info or not all(tracks_info):
+            return False
+        if len(tracks_info) > 1 and not hasattr(os, 'mkfifo'):
+            return False
+        for track_index in track_indices or range(len(tracks_info)):
+            if journal.get_track_progress(track_index) != (0, 0) or \
+                    journal.is_complete('download-track-{}'.format(track_index)):
+                return False
+        return True
+
+    def _download_and_encode_stream(self, ttid, tracks_info: List, downloader: SegmentDownloader, journal: Journal,
+                                    mkv_filepath, duration, download_dir, report_progress, trims: List = None):
+        """
+        Download the segments of all the tracks concurrently, and pipe them to ffmpeg as they arrive.
+        :return: same as download_video(), the encode stage finds the mkv already created.
+        """
+        def segments(track_info):
+            for _, segment_fh in downloader.download(track_info):
+                segment_size = segment_fh.seek(0, os.SEEK_END)
+                segment_fh.seek(0)
+                yield segment_fh
+                report_progress(1, segment_size)
+
+        os.makedirs(os.path.dirname(mkv_filepath), exist_ok=True)
+        try:
+            with downloader:
+                success = Encoder.encode_mkv_stream(ttid, [segments(x) for x in tracks_info], mkv_filepath,
+                                                    self.conf.get('debug'), trims, downloader.cancel_token,
+                                                    temp_dir=download_dir)
+        except (HttpError, *RetryPolicy.retryable_exceptions) as ex:
+            self.logger.error("[{}]: Error downloading {}: {}".format(ttid, mkv_filepath, ex))
+            return None
+        finally:
+            downloader.log_stats()
+        if not success:
+            return None
+
+        journal.set_complete('encode')
+        return {
+            'ttid': ttid,
+            'ts_files': [],
+            'mkv_filepath': mkv_filepath,
+            'duration': duration,
+            'download_dir': download_dir,
+            'trims': trims,
+        }
+
+    def encode_video(self, media: Dict, cancel_token: CancelToken = None):
+        """
+        Encode the track files downloaded by download_video() into a single mkv.
+        :param cancel_token: if cancelled, ffmpeg is stopped, and the temp files deleted as in download_video().
+        :return: True if the mkv file was created.
+        """
+        ttid = media['ttid']
+        mkv_filepath = media['mkv_filepath']
+        journal = Journal(media['download_dir'])
 
+        if journal.is_complete('encode') and os.path.exists(mkv_filepath):
+            success = True
+        else:
+            os.makedirs(os.path.dirname(mkv_filepath), exist_ok=True)
+            try:
+                success = Encoder.encode_mkv(ttid, media['ts_files'], mkv_filepath, media['duration'],
+                                             self.conf.get('debug'), media.get('trims'), media.get('tracks'),
+                                             cancel_token)
+            except DownloadCancelled:
+                self.discard_download(media)
+                return False
             if success:
-                self.logger.info("[{}]: Processed {}\n---".format(ttid, mkv_filepath))
+                journal.set_complete('encode')
+            else:
+                # the downloaded tracks and the journal are kept, downloading the lecture again resumes from those.
+                self.logger.error("[{}]: Failed to encode {}, temp files kept at {}".format(
+                    ttid, mkv_filepath, media['download_dir']))
+
+        self.release_space(ttid)
+        if success and media.get('upgrade_of'):
+            success = self.replace_preview(ttid, mkv_filepath, media['upgrade_of'])
+        if success:
+            self.logger.info("[{}]: Processed {}\n---".format(ttid, media.get('upgrade_of') or mkv_filepath))
+
+            # delete temp files, along with the journal.
+            if not self.conf.get('debug'):
+                shutil.rmtree(media['download_dir'], ignore_errors=True)
+        return success
+
+    def discard_download(self, media: Dict):
+        """
+        Clean up after a download cancelled before it was encoded, media as returned by download_video().
+        """
+        self.release_space(media['ttid'])
+        self.discard_cancelled(media['ttid'], media['download_dir'], media['mkv_filepath'])
 
-                # delete temp files.
-                if not self.conf.get('debug'):
-                    Utils.delete_files(list(temp_files_to_delete))
-                    os.rmdir(download_dir)
+    def discard_cancelled(self, ttid, download_dir, mkv_filepath):
+        """
+        Clean up after a cancelled download. The temp files are deleted, unless keep_cancelled_downloads is set,
+        in which case downloading the lecture again resumes from where it was cancelled.
+        """
+        if self.conf.get('keep_cancelled_downloads'):
+            self.logger.info("[{}]: Cancelled {}, download again to resume.".format(ttid, mkv_filepath))
+            return
+        shutil.rmtree(download_dir, ignore_errors=True)
+        self.logger.info("[{}]: Cancelled {}, temp files deleted.".format(ttid, mkv_filepath))
+
+    def replace_preview(self, ttid, upgrade_filepath, mkv_filepath):
+        """
+        Atomically replace the preview mkv with the upgraded one, a player never sees a partly written file.
+        """
+        try:
+            os.replace(upgrade_filepath, mkv_filepath)
+        except OSError as ex:
+            # e.g. on windows, while the preview is open in a player.
+            self.logger.error("[{}]: Error replacing the preview {}: {}".format(ttid, mkv_filepath, ex))
+            self.logger.error("[{}]: The upgraded video is at {}".format(ttid, upgrade_filepath))
+            return False
+        self.logger.info("[{}]: Upgraded the preview {}".format(ttid, mkv_filepath))
+        return True
+
+    def get_encryption_key(self, ttid, item: Dict, journal: Journal = None, retry_budget: RetryBudget = None):
+        """
+        Return the encryption key for a stream item, fetching it from the server on first use.
+        Keys are cached across lectures in KeyCache.
+        :param ttid: video ttid.
+        :param item: stream item as returned by M3u8Parser.
+        :param journal: if given, keys are looked up in / saved to the lecture's journal.
+        :param retry_budget: retry budget of the lecture.
+        """
+        def fetch_key():
+            key = journal.get_key(item['encryption_key_id']) if journal else None
+            if not key:
+                response = self._get(item['encryption_key_url'], retry_budget=retry_budget)
+                RetryPolicy.raise_for_status(response)
+                key = response.content[2:]
+                key = key[::-1]  # reverse the bytes.
+            return key
+
+        key = KeyCache.get_or_fetch(ttid, item['encryption_key_id'], fetch_key)
+        if journal and not journal.get_key(item['encryption_key_id']):
+            journal.set_key(item['encryption_key_id'], key)
+        return key
+
+    def prefetch_encryption_keys(self, ttid, tracks_info: List, journal: Journal = None,
+                                 retry_budget: RetryBudget = None):
+        """
+        Fetch the encryption keys of all the stream items concurrently, before the segment downloads start.
+        :param ttid: video ttid.
+        :param tracks_info: list of tracks as returned by M3u8Parser.
+        :param journal: journal of the lecture, fetched keys are saved to it.
+        :param retry_budget: retry budget of the lecture.
+        """
+        # one item per distinct key.
+        items = dict()
+        for track_info in tracks_info:
+            for item in track_info:
+                if item['encryption_method'] != "NONE" and item['encryption_key_url']:
+                    items.setdefault(item['encryption_key_id'], item)
+        if not items:
+            return
+
+        num_workers = min(len(items), int(self.conf.get('segment_download_threads') or 1))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(self.get_encryption_key, ttid, item, journal, retry_budget)
+                       for item in items.values()]
+            for future in futures:
+                future.result()
+        self.logger.info("[{}]: fetched {} encryption key(s).".format(ttid, len(items)))
 
     def _get_sanitized_path(self, filepath):
         if self.conf.get('use_safe_paths'):
@@ -191,6 +679,50 @@ class Impartus:
         mkv_path = self.conf.get('video_path').format(**video_metadata, target_dir=self.download_dir)
         return self._get_sanitized_path(mkv_path)
 
+    def get_preview_quality(self, video_metadata, video_quality, root_url):
+        """
+        With preview_then_upgrade set, a flipped lecture is first downloaded in the lowest quality so that it can be
+        watched soon, and then in video_quality in the background, replacing the preview. The upgrade of an 'auto'
+        quality download is in the highest quality, see download_video().
+        :return: quality of the preview, None if the lecture is to be downloaded in video_quality directly, e.g. if
+        the upgrade would be the same variant as the preview.
+        """
+        if not self.conf.get('preview_then_upgrade') or not video_metadata.get('fcid'):
+            return None
+        if video_quality == 'lowest' or video_quality == self.conf.get('video_quality_order')[-1]:
+            return None
+        try:
+            m3u8_urls = self._get_variant_urls(root_url, video_metadata['fcid'], True)
+        except (HttpError, *RetryPolicy.retryable_exceptions) as ex:
+            self.logger.error("[{}]: Error fetching the variants, not previewing: {}".format(
+                video_metadata['fcid'], ex))
+            return None
+        upgrade_url = self.get_url_for_quality(m3u8_urls, True, video_quality)
+        if not upgrade_url or upgrade_url == self.get_url_for_quality(m3u8_urls, True, 'lowest'):
+            return None
+        return 'lowest'
+
+    def get_upgrade_path(self, mkv_filepath):
+        """
+        Path the upgrade of a preview is encoded to, next to the preview, e.g. <lecture>.upgrade.mkv
+        """
+        root, ext = os.path.splitext(mkv_filepath)
+        return '{}{}{}'.format(root, self.upgrade_suffix, ext)
+
+    def get_clip_path(self, mkv_filepath, time_range=None, tracks: List[int] = None):
+        """
+        Path of the mkv holding part of a lecture (a time range and / or some of the tracks), next to the lecture's
+        mkv, e.g. <lecture>-[0.30.00-1.00.00].mkv, <lecture>-[tracks-1].mkv
+        """
+        root, ext = os.path.splitext(mkv_filepath)
+        if time_range:
+            start, end = time_range
+            root = '{}-[{}-{}]'.format(root, Utils.format_time(start, separator='.'),
+                                       Utils.format_time(end, separator='.') if end is not None else 'end')
+        if tracks:
+            root = '{}-[tracks-{}]'.format(root, '-'.join([str(x) for x in tracks]))
+        return self._get_sanitized_path('{}{}'.format(root, ext))
+
     def get_slides_path(self, video_metadata):
         slides_path = self.conf.get('slides_path').format(**video_metadata, target_dir=self.download_dir)
         return self._get_sanitized_path(slides_path)
@@ -202,6 +734,9 @@ class Impartus:
     def get_mkv_ttid_map(self):
         mkv_ttid_map = dict()
         for path in Path(self.download_dir).rglob('*.mkv'):
+            # an upgrade being encoded, the preview is the lecture's video till it is replaced.
+            if path.stem.endswith(self.upgrade_suffix):
+                continue
             try:
                 with open(path, 'rb') as f:
                     mkv = enzyme.MKV(f)
@@ -230,7 +765,7 @@ class Impartus:
         return False, path
 
     def get_lectures(self, root_url, subject):
-        response = self.session.get('{}/api/subjects/{}/lectures/{}'.format(
+        response = self._get('{}/api/subjects/{}/lectures/{}'.format(
             root_url, subject.get('subjectId'), subject.get('sessionId')))
 
         if response.status_code == 200:
@@ -240,7 +775,7 @@ class Impartus:
 
     def get_flipped_lectures(self, root_url, subject):
         flipped_lectures = []
-        response = self.session.get('{}/api/subjects/flipped/{}/{}'.format(
+        response = self._get('{}/api/subjects/flipped/{}/{}'.format(
             root_url, subject.get('subjectId'), subject.get('sessionId')))
         if response.status_code == 200:
             categories = response.json()
@@ -268,7 +803,7 @@ class Impartus:
         return flipped_lectures
 
     def get_slides(self, root_url, subject):
-        response = self.session.get('{}/api/subjects/backpack/{}/sessions/{}'.format(
+        response = self._get('{}/api/subjects/backpack/{}/sessions/{}'.format(
             root_url, subject.get('subjectId'), subject.get('sessionId')))
         if response.status_code == 200:
             return response.json()
@@ -276,14 +811,14 @@ class Impartus:
             return []
 
     def get_subjects(self, root_url):
-        response = self.session.get('{}/api/subjects'.format(root_url))
+        response = self._get('{}/api/subjects'.format(root_url))
         if response.status_code == 200:
             return response.json()
         else:
             return []
 
     def get_chats(self, video_metadata, root_url):
-        response = self.session.get('{}/api/videos/{}/chat'.format(
+        response = self._get('{}/api/videos/{}/chat'.format(
             root_url, video_metadata['ttid']))
 
         if response.status_code == 200:
@@ -305,17 +840,20 @@ class Impartus:
                 self.logger.warning('Downloading {}. Files of type {} not allowed, see config.'.format(url, ext))
                 continue
 
-            response = requests.get(url, headers={'Cookie': 'Bearer={}'.format(self.token)})
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-                with open(filepath, 'wb+') as fh:
-                    fh.write(response.content)
-                download_status = True
-            else:
-                self.logger.error('[{}]: Error fetching slides from url: {}'.format(ttid, file_url))
-                self.logger.error('[{}]: Http response code: {}, response body: {}: '.format(
-                    ttid, response.status_code, response.text))
+            with self.retry_policy.call(Transport.get, url, stream=True,
+                                        headers={'Cookie': 'Bearer={}'.format(self.token)}) as response:
+                if response.status_code == 200:
+                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+                    # slides count towards the bandwidth limit as well.
+                    with open(filepath, 'wb+') as fh:
+                        for chunk in RateLimiter.throttle(response.iter_content(SegmentDownloader.chunk_size)):
+                            fh.write(chunk)
+                    download_status = True
+                else:
+                    self.logger.error('[{}]: Error fetching slides from url: {}'.format(ttid, file_url))
+                    self.logger.error('[{}]: Http response code: {}, response body: {}: '.format(
+                        ttid, response.status_code, response.text))
         return download_status
 
     def map_slides_to_videos(self, videos_metadata, slides_metadata):
@@ -331,18 +869,28 @@ class Impartus:
                     mapping[video_item['ttid']] = slide_item['filePath']
         return mapping
 
+    def set_token(self, token):
+        # all Impartus objects share the pooled transport, the auth token is sent per request.
+        self.token = token
+        self.session = Transport.get_session()
+
+    def _get(self, url, retry_budget: RetryBudget = None, **kwargs):
+        """
+        GET an Impartus api url over the shared transport, with the auth token. Transient failures are retried.
+        :param retry_budget: if given, retries are charged to this budget.
+        """
+        return self.retry_policy.call(Transport.get, url, budget=retry_budget, cookies={'Bearer': self.token},
+                                      headers={'Authorization': 'Bearer {}'.format(self.token)}, **kwargs)
+
     def authenticate(self, username, password, url):
-        self.session = requests.Session()
         data = {
             'username': username,
             'password': password
         }
         url = '{}/api/auth/signin'.format(url)
-        response = self.session.post(url, json=data, timeout=30)
+        response = self.retry_policy.call(Transport.post, url, json=data)
         if response.status_code == 200:
-            self.token = response.json()['token']
-            self.session.cookies.update({'Bearer': self.token})
-            self.session.headers.update({'Authorization': 'Bearer {}'.format(self.token)})
+            self.set_token(response.json()['token'])
             return True
         else:
             self.logger.error('Error authenticating to {} with username {}.'.format(url, username))
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from typing import List
+
+
+class Journal:
+    """
+    On-disk journal of the download progress of a lecture, kept in the lecture's temp download directory.
+    Records the playlist, encryption keys, time range being downloaded, number of segments (and bytes) appended to
+    each track file, and the pipeline stages completed, so that an interrupted download can be resumed.
+    """
+    filename = 'journal.json'
+    playlist_filename = 'playlist.m3u8'
+
+    def __init__(self, download_dir: str):
+        self.filepath = os.path.join(download_dir, self.filename)
+        self.playlist_filepath = os.path.join(download_dir, self.playlist_filename)
+        self.lock = threading.Lock()
+        self.data = {
+            'keys': dict(),
+            'tracks': dict(),
+            'stages': list(),
+            'time_range': None,
+        }
+
+        if os.path.exists(self.filepath):
+            try:
+                with open(self.filepath, 'r') as fh:
+                    self.data.update(json.load(fh))
+            except ValueError:
+                # a corrupt journal is as good as none.
+                pass
+
+    def save(self):
+        """
+        Write the journal to disk. The file is replaced atomically, so a crash never leaves a partial journal.
+        """
+        with self.lock:
+            tmp_filepath = '{}.tmp'.format(self.filepath)
+            with open(tmp_filepath, 'w') as fh:
+                json.dump(self.data, fh)
+            os.replace(tmp_filepath, self.filepath)
+
+    def delete(self):
+        for filepath in [self.filepath, self.playlist_filepath]:
+            if os.path.exists(filepath):
+                os.unlink(filepath)
+
+    def get_playlist(self):
+        """
+        Return the playlist content (list of lines) saved with the journal, None if not saved.
+        """
+        if not os.path.exists(self.playlist_filepath):
+            return None
+        with open(self.playlist_filepath, 'r') as fh:
+            return fh.read().splitlines()
+
+    def set_playlist(self, m3u8_content: List):
+        with open(self.playlist_filepath, 'w') as fh:
+            fh.write('\n'.join(m3u8_content))
+
+    def get_key(self, key_id):
+        key = self.data['keys'].get(str(key_id))
+        return bytes.fromhex(key) if key else None
+
+    def set_key(self, key_id, key: bytes):
+        with self.lock:
+            self.data['keys'][str(key_id)] = key.hex()
+        self.save()
+
+    def get_track_progress(self, track_index: int):
+        """
+        Return (number of segments, number of bytes) appended to the track file so far.
+        """
+        track = self.data['tracks'].get(str(track_index), {})
+        return track.get('segments', 0), track.get('bytes', 0)
+
+    def set_track_progress(self, track_index: int, segments: int, num_bytes: int):
+        with self.lock:
+            track = self.data['tracks'].setdefault(str(track_index), {})
+            track['segments'] = segments
+            track['bytes'] = num_bytes
+        self.save()
+
+    def is_complete(self, stage: str):
+        """
+        :param stage: stage name, e.g. 'download-track-0', 'encode'
+        """
+        return stage in self.data['stages']
+
+    def set_complete(self, stage: str):
+        with self.lock:
+            if stage not in self.data['stages']:
+                self.data['stages'].append(stage)
+        self.save()
+
+    def get_time_range(self):
+        """
+        Return the [start, end] time range (in seconds) being downloaded, None for the whole lecture.
+        """
+        return self.data.get('time_range')
+
+    def set_time_range(self, time_range):
+        """
+        Set the time range being downloaded. Progress made on a different time range is discarded,
+        as the track files hold different segments.
+        """
+        time_range = list(time_range) if time_range else None
+        if time_range == self.get_time_range():
+            return
+        with self.lock:
+            self.data['time_range'] = time_range
+            self.data['tracks'] = dict()
+            self.data['stages'] = list()
+        self.save()
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+from typing import Callable
+
+from lib.config import Config, ConfigType
+from lib.tempstorage import TempStorage
+
+
+class KeyCache:
+    """
+    Process wide cache of the stream encryption keys, shared across lectures, so re-downloads and resumes
+    do not fetch the keys again.
+    Keys are cached in memory, and also saved to disk if persist_key_cache is set.
+    """
+    filename = 'keys.json'
+
+    _keys = dict()
+    _lock = threading.Lock()
+    # one lock per key, so that a key being fetched by one thread is not fetched again by another.
+    _key_locks = dict()
+    _loaded = False
+
+    @classmethod
+    def get_filepath(cls):
+        return os.path.join(TempStorage.get_dir(), cls.filename)
+
+    @classmethod
+    def is_persistent(cls):
+        return bool(Config.load(ConfigType.IMPARTUS).get('persist_key_cache'))
+
+    @classmethod
+    def _load(cls):
+        """
+        Load the keys saved on disk, on first use. Call with cls._lock held.
+        """
+        if cls._loaded:
+            return
+        cls._loaded = True
+        if cls.is_persistent() and os.path.exists(cls.get_filepath()):
+            try:
+                with open(cls.get_filepath(), 'r') as fh:
+                    cls._keys.update({k: bytes.fromhex(v) for k, v in json.load(fh).items()})
+            except ValueError:
+                pass
+
+    @classmethod
+    def _save(cls):
+        """
+        Write the keys to disk, atomically. Call with cls._lock held.
+        """
+        if not cls.is_persistent():
+            return
+        filepath = cls.get_filepath()
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_filepath = '{}.tmp'.format(filepath)
+        with open(tmp_filepath, 'w') as fh:
+            json.dump({k: v.hex() for k, v in cls._keys.items()}, fh)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def _cache_key(cls, ttid, key_id):
+        return '{}:{}'.format(ttid, key_id)
+
+    @classmethod
+    def get(cls, ttid, key_id):
+        """
+        Return the cached key, None if not cached.
+        """
+        with cls._lock:
+            cls._load()
+            return cls._keys.get(cls._cache_key(ttid, key_id))
+
+    @classmethod
+    def set(cls, ttid, key_id, key: bytes):
+        with cls._lock:
+            cls._load()
+            cls._keys[cls._cache_key(ttid, key_id)] = key
+            cls._save()
+
+    @classmethod
+    def get_or_fetch(cls, ttid, key_id, fetch_func: Callable[[], bytes]) -> bytes:
+        """
+        Return the cached key, calling fetch_func() to fetch it if not cached.
+        Concurrent calls for the same key wait for a single fetch.
+        """
+        with cls._lock:
+            key_lock = cls._key_locks.setdefault(cls._cache_key(ttid, key_id), threading.Lock())
+
+        with key_lock:
+            key = cls.get(ttid, key_id)
+            if not key:
+                key = fetch_func()
+                cls.set(ttid, key_id, key)
+            return key
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._keys.clear()
+            cls._key_locks.clear()
+            cls._loaded = True
+            if os.path.exists(cls.get_filepath()):
+                os.unlink(cls.get_filepath())
@@ -1,12 +1,16 @@
 from Crypto.Cipher import AES  # noqa
-from typing import Any
+from typing import Any, BinaryIO, Iterable
 import os
 
+from lib.media.verifier import CorruptSegment
+
 
 class Decrypter:
     """
     Utility functions for decrypting AES-128 encrypted streams.
     """
+    iv = bytes('\0' * 16, 'utf-8')
+
     def __init__(self):
         pass
 
@@ -24,21 +28,61 @@ class Decrypter:
         out_filepath = os.path.join(out_dir, os.path.basename(in_filepath) + ".ts")  # default path
 
         if encryption_key:
-            if type(encryption_key) == str:
-                dec_key_bytes = bytes(encryption_key, 'utf-8')
-            elif type(encryption_key) == bytes:
-                dec_key_bytes = encryption_key
-            else:
-                assert False, "Implement handling for type {}".format(type(encryption_key))
-
-            iv = bytes('\0' * 16, 'utf-8')
+            dec_key_bytes = cls.get_key_bytes(encryption_key)
             with open(out_filepath, 'wb+') as out_fh:
                 with open(in_filepath, 'rb') as in_fh:
                     ciphertext = in_fh.read()
-                    aes = AES.new(dec_key_bytes, AES.MODE_CBC, iv)
+                    aes = AES.new(dec_key_bytes, AES.MODE_CBC, cls.iv)
                     out_fh.write(aes.decrypt(ciphertext))
         else:
             # nothing to be done.
             out_filepath = in_filepath
 
         return out_filepath
+
+    @classmethod
+    def decrypt_stream(cls, encryption_key: Any, chunks: Iterable[bytes], out_fh: BinaryIO) -> int:
+        """
+        Decrypt an AES-128 encrypted stream incrementally, as the chunks arrive, and write the decrypted
+        content to out_fh. Chunks may be of any size, a partial cipher block is carried over to the next chunk.
+        :param cls: class name.
+        :param encryption_key: Encryption key (string and bytes type supported), None if the stream is not encrypted.
+        :param chunks: iterable of bytes, for example requests.Response.iter_content()
+        :param out_fh: file handle (opened in binary mode) for the decrypted content.
+        :Return : number of bytes written to out_fh.
+        Raises CorruptSegment if the encrypted stream is truncated, i.e. not a whole number of cipher blocks.
+        """
+        aes = AES.new(cls.get_key_bytes(encryption_key), AES.MODE_CBC, cls.iv) if encryption_key else None
+
+        remainder = b''
+        bytes_written = 0
+        bytes_read = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            bytes_read += len(chunk)
+            if aes:
+                chunk = remainder + chunk
+                usable_length = len(chunk) - len(chunk) % AES.block_size
+                remainder = chunk[usable_length:]
+                chunk = aes.decrypt(chunk[:usable_length])
+            out_fh.write(chunk)
+            bytes_written += len(chunk)
+
+        if remainder:
+            raise CorruptSegment('truncated body: {} bytes not a multiple of {}'.format(bytes_read, AES.block_size))
+        return bytes_written
+
+    @classmethod
+    def get_key_bytes(cls, encryption_key: Any) -> bytes:
+        """
+        Return the encryption key as bytes.
+        :param cls: class name.
+        :param encryption_key: Encryption key (string and bytes type supported)
+        """
+        if type(encryption_key) == str:
+            return bytes(encryption_key, 'utf-8')
+        elif type(encryption_key) == bytes:
+            return encryption_key
+        else:
+            assert False, "Implement handling for type {}".format(type(encryption_key))
@@ -1,7 +1,13 @@
 import os
 import logging
+import shutil
+import subprocess
+import tempfile
+import threading
 from shutil import move
-from typing import List
+from typing import IO, Iterable, List, Optional, Tuple
+
+from lib.cancellation import CancelToken, DownloadCancelled
 
 
 class Encoder:
@@ -10,7 +16,8 @@ class Encoder:
     """
 
     @classmethod
-    def split_track(cls, ts_files: List, duration: int, debug: bool = False):
+    def split_track(cls, ts_files: List, duration: int, debug: bool = False, tracks: List[int] = None,
+                    cancel_token: CancelToken = None):
         """
         Impartus platform has some m3u8 streams that are badly coded, and put all the stream
         contents to a single track, despite the metadata claiming to have more than 1 tracks.
@@ -21,6 +28,9 @@ class Encoder:
         :param duration: Duration of the lecture from the metadata.
         Total size of track 0 is expected to be number_of_tracks * duration
         :param debug: If true, print verbose output of ffmpeg command.
+        :param tracks: indices of the tracks needed, the others are not split out. None for all.
+        :param cancel_token: ffmpeg is killed if cancelled, see run().
+        :return: True if the tracks were split, False if ffmpeg failed.
         """
         if debug:
             loglevel = "verbose"
@@ -29,25 +39,31 @@ class Encoder:
 
         # take out splices from track 0 ts_file and create ts_file1, ts_file2 ..
         for index in range(1, len(ts_files)):
+            if tracks is not None and index not in tracks:
+                continue
             start_ss = index * duration
-            (
-                os.system("ffmpeg -y -loglevel {level} -i {input} -c copy -ss {start} -t {duration} {output}"
-                          .format(level=loglevel, input=ts_files[0], start=start_ss, duration=duration,
-                                  output=ts_files[index]))
-            )
+            if cls.run(['ffmpeg', '-y', '-loglevel', loglevel, '-i', ts_files[0], '-c', 'copy', '-ss', str(start_ss),
+                        '-t', str(duration), ts_files[index]], cancel_token) != 0:
+                return False
+
+        if tracks is not None and 0 not in tracks:
+            return True
 
         # trim ts_file 0, so that it contains only track 0 content
         tmp_file_path = os.path.join(os.path.dirname(ts_files[0]), "tmp.ts")
-        (
-            os.system("ffmpeg -y -loglevel {level} -i {input} -c copy -ss {start} -t {duration} {output}"
-                      .format(level=loglevel, input=ts_files[0], start=0, duration=duration, output=tmp_file_path))
-        )
+        if cls.run(['ffmpeg', '-y', '-loglevel', loglevel, '-i', ts_files[0], '-c', 'copy', '-ss', '0',
+                    '-t', str(duration), tmp_file_path], cancel_token) != 0:
+            # track 0 is left as it was.
+            return False
         # os.rename() fails on windows if the target file exists.
         # using shutils.move
         move(tmp_file_path, ts_files[0])
+        return True
 
     @classmethod
-    def encode_mkv(cls, ttid, ts_files, filepath, duration, debug=False):
+    def encode_mkv(cls, ttid, ts_files, filepath, duration, debug=False,
+                   trims: List[Optional[Tuple[float, Optional[float]]]] = None, tracks: List[int] = None,
+                   cancel_token: CancelToken = None):
         """
         Encode to mkv using ffmpeg and create a multiview video file.
         :param ttid: video ttid
@@ -55,7 +71,12 @@ class Encoder:
         :param filepath: path of the output mkv file to be created.
         :param duration: duration from the metadata.
         :param debug: debug flag, if True print verbose output from ffmpeg.
-        :return: True if encode successful.
+        :param trims: per track (start offset, duration) in seconds to be kept, for partial downloads. Applied after
+        splitting the tracks. None to keep the whole track(s).
+        :param tracks: indices of the track files to be put in the mkv, None for all. All the track files are
+        needed if track 0 is to be split, only the selected tracks are split out of it.
+        :param cancel_token: if cancelled, ffmpeg is killed, the partial mkv deleted, and DownloadCancelled raised.
+        :return: True if encode successful, False if ffmpeg failed (the partial mkv is deleted).
         """
 
         # probe size is needed to lookup timestamp info in files where multiple tracks are
@@ -73,27 +94,43 @@ class Encoder:
             map_args = list()
 
             split_flag = False
+            selected = tracks if tracks is not None else range(len(ts_files))
             for index, ts_file in enumerate(ts_files):
-                in_args.append(
-                    "-analyzeduration {} -probesize {} -i {}".format(probe_size, probe_size, ts_file))
-                map_args.append("-map {}".format(index))
-
                 # if any of the ts_file is 0 sized, it's content exists in track 0
                 # split track 0, if that is the case.
                 if os.stat(ts_file).st_size == 0:
                     split_flag = True
 
+                if index not in selected:
+                    continue
+                map_args.extend(['-map', str(len(map_args) // 2)])
+                in_args.extend(['-analyzeduration', str(probe_size), '-probesize', str(probe_size)])
+                in_args.extend(cls.get_trim_args(trims[index] if trims else None))
+                in_args.extend(['-i', ts_file])
+
             if split_flag:
                 logger.info("[{}]: splitting track 0 .. ".format(ttid))
-                Encoder.split_track(ts_files, duration, debug)
+                if not Encoder.split_track(ts_files, duration, debug, tracks, cancel_token):
+                    logger.error("[{}]: ffmpeg failed to split track 0".format(ttid))
+                    logger.error("[{}]: Check the ts file(s) generated at location: {}".format(
+                        ttid, ', '.join(ts_files)))
+                    return False
 
             logger.info("[{}]: encoding output file ..".format(ttid))
             # adding ttid to metadata.
-            (
-                os.system("ffmpeg -y -loglevel {level} {input} -metadata ttid={ttid} -c copy {maps} {output}"
-                          .format(level=log_level, ttid=ttid, input=' '.join(in_args), maps=' '.join(map_args),
-                                  output=filepath))
-            )
+            return_code = cls.run(['ffmpeg', '-y', '-loglevel', log_level, *in_args, '-metadata',
+                                   'ttid={}'.format(ttid), '-c', 'copy', *map_args, filepath], cancel_token)
+            if return_code != 0:
+                # e.g. disk full, do not leave a partly written mkv behind.
+                if os.path.exists(filepath):
+                    os.unlink(filepath)
+                logger.error("[{}]: ffmpeg failed to encode {}, exit code: {}".format(ttid, filepath, return_code))
+                logger.error("[{}]: Check the ts file(s) generated at location: {}".format(ttid, ', '.join(ts_files)))
+                return False
+        except DownloadCancelled:
+            if os.path.exists(filepath):
+                os.unlink(filepath)
+            raise
         except Exception as ex:
             logger.error("[{}]: ffmpeg exception: {}".format(ttid, ex))
             logger.error("[{}]: Check the ts file(s) generated at location: {}".format(ttid, ', '.join(ts_files)))
@@ -101,6 +138,145 @@ class Encoder:
 
         return True
 
+    @classmethod
+    def encode_mkv_stream(cls, ttid, tracks: List[Iterable[IO]], filepath, debug=False,
+                          trims: List[Optional[Tuple[float, Optional[float]]]] = None,
+                          cancel_token: CancelToken = None, temp_dir: str = None):
+        """
+        Encode to mkv using ffmpeg, reading the tracks while their segments are still being downloaded, so that
+        no intermediate track files are needed. A single track is fed through stdin, multiple tracks through
+        named pipes (POSIX only), each fed by its own thread.
+        The mkv is written to a temporary file next to filepath, and moved in place once ffmpeg succeeds.
+        :param ttid: video ttid
+        :param tracks: list of tracks, each an iterable of decrypted segment file objects in playlist order.
+        :param filepath: path of the output mkv file to be created.
+        :param debug: debug flag, if True print verbose output from ffmpeg.
+        :param trims: per track (start offset, duration) in seconds to be kept, as in encode_mkv().
+        :param cancel_token: if cancelled, ffmpeg is killed, and DownloadCancelled raised.
+        :param temp_dir: directory the named pipes are created in, e.g. the lecture's temp dir. Default: the system
+        temp dir.
+        :return: True if encode successful.
+        """
+        log_level = "verbose" if debug else "quiet"
+        logger = logging.getLogger(cls.__name__)
+        tmp_filepath = '{}.part'.format(filepath)
+
+        fifo_dir = None
+        if len(tracks) == 1:
+            inputs = ['pipe:0']
+        else:
+            fifo_dir = tempfile.mkdtemp(prefix='fifo-', dir=temp_dir)
+            inputs = [os.path.join(fifo_dir, 'track-{}'.format(index)) for index in range(len(tracks))]
+            for fifo in inputs:
+                os.mkfifo(fifo)
+
+        # no huge probesize here, ffmpeg would otherwise buffer most of the stream before writing anything.
+        # split tracks (multiple tracks joined in one channel) are never encoded from a pipe.
+        command = ['ffmpeg', '-y', '-loglevel', log_level]
+        for index, source in enumerate(inputs):
+            command.extend(cls.get_trim_args(trims[index] if trims else None))
+            command.extend(['-i', source])
+        command.extend(['-metadata', 'ttid={}'.format(ttid), '-c', 'copy'])
+        for index in range(len(inputs)):
+            command.extend(['-map', str(index)])
+        command.extend(['-f', 'matroska', tmp_filepath])
+
+        logger.info("[{}]: encoding output file from stream ..".format(ttid))
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if fifo_dir is None else subprocess.DEVNULL)
+        errors = list()
+
+        def feed(index, segments):
+            try:
+                out_fh = process.stdin if fifo_dir is None else open(inputs[index], 'wb')
+                with out_fh:
+                    for segment_fh in segments:
+                        with segment_fh:
+                            shutil.copyfileobj(segment_fh, out_fh)
+            except BrokenPipeError:
+                logger.error("[{}]: ffmpeg exited while track {} was being written.".format(ttid, index))
+            except BaseException as ex:
+                errors.append(ex)
+                process.kill()
+
+        feeders = [threading.Thread(target=feed, args=(index, segments), daemon=True)
+                   for index, segments in enumerate(tracks)]
+        try:
+            for feeder in feeders:
+                feeder.start()
+            return_code = cls.wait(process, cancel_token)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            if fifo_dir:
+                # feeders still waiting for ffmpeg to open their pipe, are released with a broken pipe.
+                for fifo in inputs:
+                    os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+            for feeder in feeders:
+                feeder.join()
+            if fifo_dir:
+                shutil.rmtree(fifo_dir, ignore_errors=True)
+
+        if errors or return_code is None or return_code != 0:
+            if os.path.exists(tmp_filepath):
+                os.unlink(tmp_filepath)
+            if return_code is None:
+                raise DownloadCancelled()
+            if errors:
+                raise errors[0]
+            logger.error("[{}]: ffmpeg failed to encode {}".format(ttid, filepath))
+            return False
+
+        os.replace(tmp_filepath, filepath)
+        return True
+
+    @classmethod
+    def run(cls, command: List[str], cancel_token: CancelToken = None):
+        """
+        Run an ffmpeg command, given as a list of arguments, and return its exit code. With a cancel_token, ffmpeg
+        is killed if the token is cancelled, and DownloadCancelled raised.
+        """
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        # no shell in between, killing the process kills ffmpeg itself (on windows too).
+        process = subprocess.Popen(command)
+        return_code = cls.wait(process, cancel_token)
+        if return_code is None:
+            raise DownloadCancelled()
+        return return_code
+
+    @classmethod
+    def wait(cls, process: subprocess.Popen, cancel_token: CancelToken = None, interval: float = 0.5):
+        """
+        Wait for a process to exit, killing it if cancel_token is cancelled meanwhile.
+        :return: exit code of the process, None if it was killed.
+        """
+        if cancel_token is None:
+            return process.wait()
+        while True:
+            try:
+                return process.wait(timeout=interval)
+            except subprocess.TimeoutExpired:
+                if cancel_token.is_cancelled():
+                    process.kill()
+                    process.wait()
+                    return None
+
+    @classmethod
+    def get_trim_args(cls, trim: Optional[Tuple[float, Optional[float]]]) -> List[str]:
+        """
+        Return the ffmpeg input options to read only part of an input.
+        :param trim: (start offset, duration) in seconds, duration None for up to the end. None to read it all.
+        """
+        if not trim:
+            return []
+        start, length = trim
+        args = ['-ss', '{:.3f}'.format(start)] if start else []
+        if length is not None:
+            args.extend(['-t', '{:.3f}'.format(length)])
+        return args
+
     @classmethod
     def join(cls, files_list, out_dirpath: str, track_number: int):
         """
@@ -110,11 +286,19 @@ class Encoder:
         :param track_number: track number.
         :return: return a track file combining all the decrypted media files.
         """
-        out_filename = "track-{}.ts".format(track_number)
-        out_filepath = os.path.join(out_dirpath, out_filename)
+        out_filepath = cls.get_track_filepath(out_dirpath, track_number)
         with open(out_filepath, 'wb+') as out_fh:
             for file in files_list:
                 with open(file, 'rb') as in_fh:
                     out_fh.write(in_fh.read())
 
         return out_filepath
+
+    @classmethod
+    def get_track_filepath(cls, out_dirpath: str, track_number: int):
+        """
+        Return the path of the track file for the given track number.
+        :param out_dirpath: output directory path.
+        :param track_number: track number.
+        """
+        return os.path.join(out_dirpath, "track-{}.ts".format(track_number))
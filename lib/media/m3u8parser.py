@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 import re
 
 
@@ -94,3 +94,51 @@ class M3u8Parser:
             "total_duration": round(total_duration),   # combined of all tracks.
         }
         return self.summary, self.tracks
+
+    @classmethod
+    def select_time_range(cls, track_info: List, start: float, end: Optional[float] = None):
+        """
+        Select the segments of a track covering the time range [start, end), using the duration of each segment.
+        :param track_info: list of segment items of a track, as returned by parse().
+        :param start: start time in seconds, from the start of the track.
+        :param end: end time in seconds, None for the end of the track.
+        :return: (list of segment items, offset of start from the start of the first segment item in seconds)
+        """
+        items = list()
+        offset = 0.0
+        elapsed = 0.0
+        for item in track_info:
+            item_start = elapsed
+            elapsed += item['duration']
+            if elapsed <= start:
+                continue
+            if end is not None and item_start >= end:
+                break
+            if not items:
+                offset = max(0.0, start - item_start)
+            items.append(item)
+        return items, offset
+
+    @classmethod
+    def to_m3u8(cls, tracks: List) -> List:
+        """
+        Write tracks (as returned by parse()) back as m3u8 content, that parse() reads back into the same tracks.
+        :return: list of lines.
+        """
+        lines = ['#EXTM3U']
+        for track_index, track_info in enumerate(tracks):
+            lines.append('#EXT-X-MEDIA-SEQUENCE:{}'.format(track_index))
+            key = None
+            for item in track_info:
+                if (item['encryption_method'], item['encryption_key_url']) != key:
+                    key = (item['encryption_method'], item['encryption_key_url'])
+                    if item['encryption_method'] == "NONE":
+                        lines.append('#EXT-X-KEY:METHOD=NONE')
+                    else:
+                        lines.append('#EXT-X-KEY:METHOD={},URI="{}"'.format(*key))
+                lines.append('#EXTINF:{:f},'.format(item['duration']))
+                lines.append(item['url'])
+            if track_index < len(tracks) - 1:
+                lines.append('#EXT-X-DISCONTINUITY')
+        lines.append('#EXT-X-ENDLIST')
+        return lines
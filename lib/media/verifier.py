@@ -0,0 +1,99 @@
+from typing import BinaryIO
+
+
+class Verifier:
+    """
+    Cheap integrity checks on a decrypted MPEG-TS media segment, to catch truncated downloads and error pages
+    served in place of the media.
+    """
+    packet_size = 188
+    sync_byte = 0x47
+    null_pid = 0x1fff
+
+    # decrypted segments keep their AES block padding, tolerate up to a block of trailing bytes.
+    max_padding = 16
+
+    # packets read at a time.
+    read_packets = 512
+
+    @classmethod
+    def verify(cls, segment_fh: BinaryIO, content_length: int = None, received_length: int = None):
+        """
+        Verify a decrypted segment, raise CorruptSegment if it fails any of the checks:
+        length of the response body as per the Content-Length header, MPEG-TS sync byte at every 188 byte
+        packet boundary, and continuity counters of every stream in the segment.
+        The file position is reset to the start of the segment.
+        :param segment_fh: file object holding the decrypted segment.
+        :param content_length: Content-Length of the response, None if not known.
+        :param received_length: number of bytes received in the response body.
+        """
+        if content_length is not None and received_length is not None and content_length != received_length:
+            raise CorruptSegment('expected {} bytes, received {} bytes'.format(content_length, received_length))
+
+        segment_fh.seek(0)
+        try:
+            cls.verify_packets(segment_fh)
+        finally:
+            segment_fh.seek(0)
+
+    @classmethod
+    def verify_packets(cls, segment_fh: BinaryIO):
+        continuity_counters = dict()
+        offset = 0
+        while True:
+            data = segment_fh.read(cls.packet_size * cls.read_packets)
+            if not data:
+                break
+
+            for start in range(0, len(data), cls.packet_size):
+                packet = data[start:start + cls.packet_size]
+                if len(packet) < cls.packet_size:
+                    # only the padding of the last cipher block may trail the last packet.
+                    if len(packet) > cls.max_padding or segment_fh.read(1):
+                        raise CorruptSegment('truncated packet at offset {}'.format(offset + start))
+                    break
+                if packet[0] != cls.sync_byte:
+                    raise CorruptSegment('sync byte missing at offset {}'.format(offset + start))
+                cls.check_continuity(packet, continuity_counters, offset + start)
+            offset += len(data)
+
+        if offset == 0:
+            raise CorruptSegment('empty segment')
+
+    @classmethod
+    def check_continuity(cls, packet: bytes, continuity_counters: dict, offset: int):
+        """
+        The 4 bit continuity counter of a stream (pid) is incremented for every packet carrying a payload.
+        A packet may be repeated once (same counter), and the discontinuity indicator allows a jump.
+        """
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        if pid == cls.null_pid:
+            return
+
+        adaptation_field_control = (packet[3] >> 4) & 0x3
+        counter = packet[3] & 0xf
+        has_payload = adaptation_field_control & 0x1
+        discontinuity = adaptation_field_control & 0x2 and packet[4] > 0 and packet[5] & 0x80
+
+        last_counter = continuity_counters.get(pid)
+        continuity_counters[pid] = counter
+        if last_counter is None or discontinuity or not has_payload:
+            return
+        if counter not in [last_counter, (last_counter + 1) & 0xf]:
+            raise CorruptSegment('continuity counter of pid {} jumped from {} to {} at offset {}'.format(
+                pid, last_counter, counter, offset), continuity_error=True)
+
+
+class CorruptSegment(Exception):
+    def __init__(self, reason, continuity_error=False):
+        """
+        :param reason: description of the failed check.
+        :param continuity_error: True if only the continuity counters are off, the segment is otherwise playable.
+        """
+        super().__init__('Corrupt segment: {}'.format(reason))
+        self.reason = reason
+        self.continuity_error = continuity_error
+
+    def __reduce__(self):
+        # raised in worker processes too, see WorkerPool.
+        return self.__class__, (self.reason, self.continuity_error)
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+from lib.config import Config, ConfigType
+from lib.media.m3u8parser import M3u8Parser
+
+
+class Throughput:
+    """
+    Download throughput, measured from the segments completed over a sliding window of time.
+    The process wide history (Throughput.history()) covers the segment downloads of all the lectures, and is
+    used to pick the quality of a lecture before any of its segments are downloaded.
+    """
+    _history = None
+    _history_lock = threading.Lock()
+
+    def __init__(self, window: float = 30.0, min_samples: int = 3):
+        """
+        :param window: only the segments completed in the last window seconds are counted.
+        :param min_samples: segments needed for a measurement.
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = deque()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def history(cls) -> 'Throughput':
+        with cls._history_lock:
+            if cls._history is None:
+                cls._history = Throughput(window=120.0)
+            return cls._history
+
+    def record(self, num_bytes: int, now: float = None):
+        """
+        Record a segment download of num_bytes completed (now).
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.samples.append((now, num_bytes))
+            while self.samples and self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+
+    def get_rate(self, now: float = None):
+        """
+        Return the throughput in bytes/second, None if not enough segments were downloaded recently.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            samples = [x for x in self.samples if x[0] >= now - self.window]
+        if len(samples) < self.min_samples or samples[-1][0] <= samples[0][0]:
+            return None
+        # the bytes of the first segment were downloaded before the window measured starts.
+        return sum([x[1] for x in samples[1:]]) / (samples[-1][0] - samples[0][0])
+
+
+class AutoQuality:
+    """
+    Picks the highest quality variant (as per video_quality_order) of a flipped lecture that is expected to finish
+    downloading within auto_quality_target minutes, at the throughput measured. Without any recent history the
+    download starts with the lowest quality, and moves up once the first segments have been timed.
+    The choice is checked again every auto_quality_interval segments, switching variants at a segment boundary
+    if the throughput changes. Variants are expected to have the same segment boundaries, those that do not are
+    never switched to.
+    """
+    # a higher quality is switched to only if it is expected to finish well within the target.
+    headroom = 0.8
+
+    def __init__(self, ttid, variants: Dict[str, List], sizes: Dict[str, int], throughput: Throughput = None):
+        """
+        :param ttid: video ttid, used for logging.
+        :param variants: single track segment items (as returned by M3u8Parser) of each variant, highest
+        quality first.
+        :param sizes: estimated download size in bytes of each variant.
+        :param throughput: throughput of the lecture's download, the process wide history is used until it has
+        a measurement.
+        """
+        conf = Config.load(ConfigType.IMPARTUS)
+        self.ttid = ttid
+        self.variants = variants
+        self.qualities = [x for x in variants if sizes.get(x) and variants[x]]
+        self.sizes = sizes
+        self.throughput = throughput or Throughput()
+        self.target = float(conf.get('auto_quality_target') or 30) * 60
+        self.interval = max(1, int(conf.get('auto_quality_interval') or 5))
+
+        self.started = time.monotonic()
+        self.quality = None
+        self.track = list()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get_duration(self, items: List) -> float:
+        return sum([x['duration'] for x in items])
+
+    def choose(self, done_seconds: float = 0.0, current: str = None) -> str:
+        """
+        Return the highest quality expected to download the rest of the lecture in the time left, the lowest
+        quality if none is, or the current quality if the throughput is not known.
+        :param done_seconds: duration of the lecture downloaded already.
+        :param current: quality being downloaded.
+        """
+        rate = self.throughput.get_rate() or Throughput.history().get_rate()
+        if not rate:
+            return current or self.qualities[-1]
+
+        time_left = max(1.0, self.target - (time.monotonic() - self.started))
+        for quality in self.qualities:
+            duration = self.get_duration(self.variants[quality])
+            remaining_bytes = self.sizes[quality] * max(0.0, duration - done_seconds) / max(1.0, duration)
+            budget = time_left
+            if current and self.qualities.index(quality) < self.qualities.index(current):
+                budget *= self.headroom
+            if remaining_bytes / rate <= budget:
+                return quality
+        return self.qualities[-1]
+
+    def start(self) -> str:
+        """
+        Pick the quality to start with.
+        :return: quality chosen, its segments are in self.track.
+        """
+        self.quality = self.choose()
+        self.track = list(self.variants[self.quality])
+        self.logger.info("[{}]: auto quality, starting with {}".format(self.ttid, self.quality))
+        return self.quality
+
+    def check(self, segments_done: int):
+        """
+        Called after every segment appended, switches to another quality if need be.
+        :param segments_done: number of segments of self.track downloaded.
+        :return: segment items to download next if switching to another quality, None otherwise.
+        """
+        if segments_done % self.interval or segments_done >= len(self.track):
+            return None
+
+        done_seconds = self.get_duration(self.track[:segments_done])
+        quality = self.choose(done_seconds, self.quality)
+        if quality == self.quality:
+            return None
+
+        items, offset = M3u8Parser.select_time_range(self.variants[quality], done_seconds)
+        if not items or offset > 0.1:
+            # segment boundaries do not line up, the segment would be partly repeated.
+            return None
+
+        self.logger.info("[{}]: auto quality, switching from {} to {} at {:.0f}s, throughput {:.1f} KB/s".format(
+            self.ttid, self.quality, quality, done_seconds,
+            (self.throughput.get_rate() or Throughput.history().get_rate()) / 1024))
+        self.quality = quality
+        self.track = self.track[:segments_done] + items
+        return items
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime
+from typing import Iterable
+
+from lib.cancellation import CancelToken, DownloadCancelled
+from lib.config import Config, ConfigType
+
+
+class RateLimiter:
+    """
+    Process wide token bucket limiting the download bandwidth used by all the downloads together.
+    The limit comes from the bandwidth_limit / bandwidth_limit_schedule settings, unless overridden at run time.
+    """
+    _lock = threading.Lock()
+    _tokens = 0.0
+    _last_refill = time.monotonic()
+
+    # limit in KB/s set at run time (0 for unlimited), None to follow the configured limit / schedule.
+    _override = None
+
+    @classmethod
+    def set_limit(cls, limit=None):
+        """
+        Override the configured bandwidth limit.
+        :param limit: limit in KB/s, 0 for unlimited, None to go back to the configured limit / schedule.
+        """
+        with cls._lock:
+            cls._override = limit
+
+    @classmethod
+    def get_limit(cls, now: datetime = None) -> int:
+        """
+        Return the bandwidth limit in bytes/second in effect at the given time (default: now), 0 for unlimited.
+        """
+        if cls._override is not None:
+            return int(cls._override) * 1024
+
+        conf = Config.load(ConfigType.IMPARTUS)
+        now = (now or datetime.now()).strftime('%H:%M')
+        for window in conf.get('bandwidth_limit_schedule') or []:
+            start, end = str(window['from']), str(window['to'])
+            # a window may span midnight, e.g. 22:00 - 06:00
+            if (start <= now < end) if start <= end else (now >= start or now < end):
+                return int(window['limit']) * 1024
+        return int(conf.get('bandwidth_limit') or 0) * 1024
+
+    @classmethod
+    def consume(cls, num_bytes: int, cancel_token: CancelToken = None):
+        """
+        Take num_bytes worth of tokens from the bucket, sleep if the bucket runs into deficit.
+        :param cancel_token: the sleep is cut short with DownloadCancelled if cancelled, the tokens are given back.
+        """
+        limit = cls.get_limit()
+        if not limit:
+            return
+
+        with cls._lock:
+            now = time.monotonic()
+            # bucket holds at most 1 second worth of tokens.
+            cls._tokens = min(limit, cls._tokens + (now - cls._last_refill) * limit) - num_bytes
+            cls._last_refill = now
+            deficit = -cls._tokens
+
+        if deficit <= 0:
+            return
+        if cancel_token is None:
+            time.sleep(deficit / limit)
+        elif cancel_token.wait(deficit / limit):
+            with cls._lock:
+                cls._tokens += num_bytes
+            raise DownloadCancelled()
+
+    @classmethod
+    def throttle(cls, chunks: Iterable[bytes], cancel_token: CancelToken = None):
+        """
+        Wrap an iterable of chunks (e.g. requests.Response.iter_content()), so that it is consumed
+        within the bandwidth limit.
+        :param cancel_token: see consume().
+        """
+        for chunk in chunks:
+            cls.consume(len(chunk), cancel_token)
+            yield chunk
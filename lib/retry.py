@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable
+
+import requests
+
+from lib.config import Config, ConfigType
+from lib.media.verifier import CorruptSegment
+
+
+class RetryBudget:
+    """
+    Total number of retries allowed for all the requests made for a lecture, shared by the download threads.
+    """
+
+    def __init__(self, retries: int = None):
+        if retries is None:
+            retries = Config.load(ConfigType.IMPARTUS).get('retry_budget')
+        self.remaining = int(retries or 0)
+        self.lock = threading.Lock()
+
+    def consume(self) -> bool:
+        """
+        Use up a retry, return False if none are left.
+        """
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Retry a request on transient failures: connection errors, timeouts, truncated / corrupt bodies and
+    http status codes that indicate an overloaded / temporarily unavailable server.
+    Retries are spaced out with exponential backoff and jitter.
+    """
+    retryable_status_codes = {408, 425, 429, 500, 502, 503, 504}
+
+    retryable_exceptions = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.ContentDecodingError,
+        ConnectionError,
+        TimeoutError,
+        CorruptSegment,
+    )
+
+    def __init__(self, attempts: int = None, wait: float = None, max_wait: float = None):
+        """
+        :param attempts: max number of attempts for a request, including the first one.
+        :param wait: wait time in seconds before the first retry, doubled for every subsequent retry.
+        :param max_wait: upper limit on the wait time in seconds.
+        """
+        conf = Config.load(ConfigType.IMPARTUS)
+        self.attempts = int(attempts or conf.get('retry_attempts') or 1)
+        self.wait = float(wait if wait is not None else conf.get('retry_wait') or 0)
+        self.max_wait = float(max_wait if max_wait is not None else conf.get('retry_max_wait') or self.wait)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @classmethod
+    def is_retryable(cls, ex: Exception) -> bool:
+        if isinstance(ex, HttpError):
+            return ex.status_code in cls.retryable_status_codes
+        return isinstance(ex, cls.retryable_exceptions)
+
+    @classmethod
+    def raise_for_status(cls, response: requests.Response):
+        """
+        Raise HttpError if the response does not have a 2xx status code.
+        """
+        if not 200 <= response.status_code < 300:
+            raise HttpError(response.status_code, response.url, response.headers.get('Retry-After'))
+
+    def backoff(self, attempt: int, retry_after=None) -> float:
+        """
+        Wait time before the given retry attempt (1, 2, ..), with full jitter.
+        Never shorter than the Retry-After interval asked for by the server.
+        """
+        wait = random.uniform(0, min(self.max_wait, self.wait * 2 ** (attempt - 1)))
+        try:
+            wait = max(wait, min(self.max_wait, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+        return wait
+
+    def call(self, func: Callable, *args, budget: RetryBudget = None, description: str = None,
+             interrupt: threading.Event = None, **kwargs):
+        """
+        Call func(*args, **kwargs), retrying on retryable exceptions or retryable http status codes.
+        :param func: function to call, it may return a requests.Response or raise an exception.
+        :param budget: if given, every retry is charged to this budget, and no more retries once it is used up.
+        :param description: description of the request, for logging.
+        :param interrupt: if given, and set while waiting for the next retry, the last error is raised.
+        :return: return value of func. If retries run out, the last response is returned (if func returned a
+        response), or the last exception is raised.
+        """
+        # urls may carry the auth token as a query parameter, keep those out of the logs.
+        description = description or (str(args[0]).split('?')[0] if args else getattr(func, '__name__', 'request'))
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                result = func(*args, **kwargs)
+                if not isinstance(result, requests.Response) or \
+                        result.status_code not in self.retryable_status_codes:
+                    return result
+                error = HttpError(result.status_code, result.url, result.headers.get('Retry-After'))
+            except Exception as ex:
+                if not self.is_retryable(ex):
+                    raise
+                result, error = None, ex
+
+            if isinstance(error, HttpError):
+                retry_after = error.retry_after
+
+            attempt += 1
+            if attempt >= self.attempts or (budget is not None and not budget.consume()):
+                if attempt < self.attempts:
+                    self.logger.error("{}: retry budget exhausted, giving up.".format(description))
+                if result is not None:
+                    return result
+                raise error
+
+            if result is not None:
+                result.close()
+            wait = self.backoff(attempt, retry_after)
+            self.logger.warning("{}: {}. retrying in {:.1f}s (attempt {} of {}) ...".format(
+                description, error, wait, attempt + 1, self.attempts))
+            if interrupt is None:
+                time.sleep(wait)
+            elif interrupt.wait(wait):
+                raise error
+
+
+class HttpError(Exception):
+    def __init__(self, status_code, url=None, retry_after=None):
+        super().__init__('Http response code: {}, url: {}'.format(status_code, str(url).split('?')[0]))
+        self.status_code = status_code
+        self.url = url
+        self.retry_after = retry_after
@@ -0,0 +1,338 @@
+import enum
+import itertools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict
+
+from lib.cancellation import CancelToken
+from lib.concurrency import AdaptiveLimiter
+from lib.config import Config, ConfigType
+from lib.transport import Transport
+
+
+class JobState(enum.Enum):
+    QUEUED = 'queued'
+    ACTIVE = 'active'
+    PAUSED = 'paused'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __str__(self):
+        return str(self.value)
+
+
+class DownloadJob:
+    """
+    A lecture download submitted to the Scheduler.
+    """
+
+    def __init__(self, func: Callable, encode_func: Callable = None, priority=0, callback: Callable = None,
+                 cancel_func: Callable = None):
+        """
+        :param func: function doing the download, called as func(job) from a 'download' stage worker thread.
+        It should honour job.pause_event / job.resume_event and job.cancel_token, report progress with
+        job.set_progress(), and return True on success.
+        :param encode_func: optional function called as encode_func(job) from an 'encode' stage worker thread,
+        once func has succeeded. Returns True on success. It should honour job.cancel_token too.
+        :param priority: jobs with lower values are started first, see Scheduler.get_priority()
+        :param callback: called as callback(job) whenever the state or progress of the job changes.
+        :param cancel_func: called as cancel_func(job) when the job is cancelled while no stage is working on it,
+        e.g. downloaded and waiting to be encoded, to clean up what the finished stages left in job.data.
+        """
+        self.funcs = [func, encode_func]
+        self.priority = priority
+        self.callback = callback
+        self.cancel_func = cancel_func
+
+        # scratch space for passing data from one stage to the next.
+        self.data = dict()
+
+        self.pause_event = threading.Event()
+        self.resume_event = threading.Event()
+        self.cancel_token = CancelToken()
+        self.state = JobState.QUEUED
+        self.started = False
+        self.progress = 0
+
+    def set_state(self, state: JobState):
+        self.state = state
+        if self.callback:
+            self.callback(self)
+
+    def set_progress(self, progress: int):
+        self.progress = progress
+        if self.callback:
+            self.callback(self)
+
+    def pause(self):
+        self.resume_event.clear()
+        self.pause_event.set()
+        self.set_state(JobState.PAUSED)
+        Scheduler.release_connections()
+
+    def resume(self):
+        self.pause_event.clear()
+        self.resume_event.set()
+        self.set_state(JobState.ACTIVE if self.started else JobState.QUEUED)
+        Scheduler.notify()
+
+    def is_paused(self):
+        return self.pause_event.is_set()
+
+    def cancel(self):
+        """
+        Cancel the job. A queued job is dropped, an active one stops at the next check of its cancel token.
+        """
+        self.cancel_token.cancel()
+        # a paused job is woken up, to notice the cancellation.
+        self.resume_event.set()
+        Scheduler.cancel(self)
+
+    def is_cancelled(self):
+        return self.cancel_token.is_cancelled()
+
+    def on_cancelled(self):
+        """
+        Called by the scheduler once a cancelled job is dropped in between stages.
+        """
+        if self.cancel_func:
+            self.cancel_func(self)
+        self.set_state(JobState.CANCELLED)
+
+
+class Scheduler:
+    """
+    Process wide download pipeline.
+    A lecture goes through two stages, each served by its own pool of worker threads, 'download' (fetch, decrypt
+    and join the segments into track files) and 'encode' (mux the tracks into the mkv file with ffmpeg). This way
+    the next lecture downloads while the previous one is being encoded.
+    At most max_active_downloads lectures are downloaded at a time, the rest wait in the queue and are started in
+    the configured download_order. Lectures waiting to be encoded are limited to encode_queue_size, a download
+    worker waits for room in the encode queue before picking up the next lecture.
+    Segment downloads of all the active lectures share the segment slots, see segment_slot().
+    """
+    stages = ['download', 'encode']
+    _queues = {stage: list() for stage in stages}
+    _workers = {stage: list() for stage in stages}
+    _jobs = set()
+    _condition = threading.Condition()
+    _sequence = itertools.count()
+    _segment_slots = None
+    _executor = None
+    # bumped by shutdown(), workers of an earlier generation exit.
+    _generation = 0
+
+    # priority of background jobs (e.g. upgrading a preview), started after all the other queued jobs.
+    background_priority = float('inf')
+
+    logger = logging.getLogger('Scheduler')
+
+    @classmethod
+    def get_priority(cls, video_metadata: Dict):
+        """
+        Return the priority of a lecture as per the download_order setting, lower values are downloaded first.
+        'fifo': in the order of submission, 'newest': most recent lecture first,
+        'shortest': lecture with the least actualDuration * tapNToggle first.
+        """
+        download_order = Config.load(ConfigType.IMPARTUS).get('download_order')
+        if download_order == 'newest':
+            start_time = datetime.strptime(video_metadata['startTime'], '%Y-%m-%d %H:%M:%S')
+            return -start_time.timestamp()
+        elif download_order == 'shortest':
+            return int(video_metadata['actualDuration']) * int(video_metadata['tapNToggle'])
+        return 0
+
+    @classmethod
+    def get_stage_limits(cls, stage: str):
+        """
+        Return (number of workers, max queue size or None for unbounded) for a stage.
+        """
+        conf = Config.load(ConfigType.IMPARTUS)
+        if stage == 'download':
+            return int(conf.get('max_active_downloads') or 1), None
+        return int(conf.get('max_active_encodes') or 1), int(conf.get('encode_queue_size') or 1)
+
+    @classmethod
+    def submit(cls, job: DownloadJob):
+        with cls._condition:
+            cls._start_workers()
+            cls._jobs.add(job)
+            # set before a worker can pick the job up and make it active.
+            job.state = JobState.PAUSED if job.is_paused() else JobState.QUEUED
+            cls._enqueue('download', job, cls._generation)
+        if job.callback:
+            job.callback(job)
+
+    @classmethod
+    def submit_task(cls, func: Callable, *args, **kwargs):
+        """
+        Run a short auxiliary task (captions, slides ..) in a background thread, alongside the downloads.
+        An exception raised by the task is logged, callers need not keep the future to find out.
+        """
+        with cls._condition:
+            if not cls._executor:
+                cls._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='task')
+        future = cls._executor.submit(func, *args, **kwargs)
+        future.add_done_callback(partial(cls._log_task_error, getattr(func, '__name__', 'task')))
+        return future
+
+    @classmethod
+    def _log_task_error(cls, name: str, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            ex = future.exception()
+            cls.logger.error("{} failed with an exception: {}".format(name, ex), exc_info=ex)
+
+    @classmethod
+    def cancel(cls, job: DownloadJob):
+        """
+        Drop a cancelled job waiting in a stage's queue. A job being worked on is left to its worker.
+        """
+        with cls._condition:
+            queued = False
+            for stage in cls.stages:
+                for index, (_, queued_job) in enumerate(cls._queues[stage]):
+                    if queued_job is job:
+                        del cls._queues[stage][index]
+                        queued = True
+                        break
+            if queued:
+                cls._jobs.discard(job)
+            cls._condition.notify_all()
+        if queued:
+            job.on_cancelled()
+
+    @classmethod
+    def notify(cls):
+        with cls._condition:
+            cls._condition.notify_all()
+
+    @classmethod
+    def has_pending_jobs(cls):
+        with cls._condition:
+            return len(cls._jobs) > 0
+
+    @classmethod
+    def release_connections(cls):
+        """
+        Close the pooled http connections if none of the jobs is active, e.g. all of them paused. Segment
+        requests in flight of a paused download are abandoned by the download itself.
+        """
+        with cls._condition:
+            if any([job.state == JobState.ACTIVE for job in cls._jobs]):
+                return
+        Transport.close()
+
+    @classmethod
+    def shutdown(cls, timeout: float = None):
+        """
+        Stop the worker threads, waiting up to timeout seconds for them to finish the stage they are working on.
+        Queued jobs are dropped, and the scheduler starts afresh on the next submit().
+        """
+        with cls._condition:
+            cls._generation += 1
+            workers = [worker for stage in cls.stages for worker in cls._workers[stage]]
+            cls._queues = {stage: list() for stage in cls.stages}
+            cls._workers = {stage: list() for stage in cls.stages}
+            cls._jobs = set()
+            cls._segment_slots = None
+            executor, cls._executor = cls._executor, None
+            cls._condition.notify_all()
+        if executor:
+            executor.shutdown(wait=False)
+        for worker in workers:
+            worker.join(timeout)
+
+    @classmethod
+    def segment_slot(cls) -> AdaptiveLimiter:
+        """
+        Slot (context manager) to be held while a segment is being downloaded, limits the segments in flight across
+        all the active downloads. The limit adapts to how the server copes, see AdaptiveLimiter.
+        """
+        with cls._condition:
+            if not cls._segment_slots:
+                cls._segment_slots = AdaptiveLimiter()
+            return cls._segment_slots
+
+    @classmethod
+    def _start_workers(cls):
+        for stage in cls.stages:
+            num_workers, _ = cls.get_stage_limits(stage)
+            while len(cls._workers[stage]) < num_workers:
+                worker = threading.Thread(target=cls._run_worker, args=(stage, cls._generation), daemon=True,
+                                          name='{}-worker-{}'.format(stage, len(cls._workers[stage])))
+                cls._workers[stage].append(worker)
+                worker.start()
+
+    @classmethod
+    def _enqueue(cls, stage: str, job: DownloadJob, generation: int) -> bool:
+        """
+        Add a job to a stage's queue, waiting for room if the queue is bounded. Call with cls._condition held.
+        :param generation: generation of the caller, see shutdown().
+        :return: False if the job was cancelled (or the scheduler shut down) while waiting for room, it is not
+        queued.
+        """
+        _, max_size = cls.get_stage_limits(stage)
+        while max_size and len(cls._queues[stage]) >= max_size and not job.is_cancelled() \
+                and generation == cls._generation:
+            cls._condition.wait()
+        if job.is_cancelled() or generation != cls._generation:
+            return False
+
+        # sequence number keeps jobs with equal priority in fifo order.
+        cls._queues[stage].append(((job.priority, next(cls._sequence)), job))
+        cls._queues[stage].sort(key=lambda x: x[0])
+        cls._condition.notify_all()
+        return True
+
+    @classmethod
+    def _next_job(cls, stage: str, generation: int) -> DownloadJob:
+        """
+        Wait for, and return the highest priority job in the stage's queue. Paused jobs are not started.
+        :return: None once the scheduler is shut down.
+        """
+        with cls._condition:
+            while generation == cls._generation:
+                for index, (_, job) in enumerate(cls._queues[stage]):
+                    if stage != 'download' or not job.is_paused():
+                        del cls._queues[stage][index]
+                        cls._condition.notify_all()
+                        return job
+                cls._condition.wait()
+            return None
+
+    @classmethod
+    def _run_worker(cls, stage: str, generation: int):
+        stage_index = cls.stages.index(stage)
+        while True:
+            job = cls._next_job(stage, generation)
+            if not job:
+                return
+            if stage_index == 0:
+                job.started = True
+                job.set_state(JobState.ACTIVE)
+            try:
+                success = job.funcs[stage_index](job)
+            except Exception as ex:
+                cls.logger.exception("{} stage failed with an exception: {}".format(stage, ex))
+                success = False
+
+            # hand over to the next stage if there is one.
+            next_stages = [x for x in range(stage_index + 1, len(cls.stages)) if job.funcs[x]]
+            with cls._condition:
+                if success and next_stages and cls._enqueue(cls.stages[next_stages[0]], job, generation):
+                    continue
+                if generation != cls._generation:
+                    return
+                cls._jobs.discard(job)
+                cls._condition.notify_all()
+            if job.is_cancelled() and success and next_stages:
+                # cancelled once the stage was done, before the next one picked it up.
+                job.on_cancelled()
+            elif job.is_cancelled():
+                job.set_state(JobState.CANCELLED)
+            else:
+                job.set_state(JobState.DONE if success else JobState.FAILED)
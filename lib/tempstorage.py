@@ -0,0 +1,128 @@
+import logging
+import os
+import platform
+import shutil
+import threading
+import time
+
+from lib.cancellation import CancelToken
+from lib.config import Config, ConfigType
+from lib.journal import Journal
+from lib.utils import Utils
+
+
+class TempStorage:
+    """
+    Temp storage for the lecture downloads, one directory per lecture (named after its ttid).
+    The location is configurable (temp_downloads_dir), the temp space reserved by the active downloads is capped
+    by temp_storage_quota, and directories left over from earlier runs are reclaimed.
+    """
+    _reservations = dict()
+    _condition = threading.Condition()
+
+    logger = logging.getLogger('TempStorage')
+
+    @classmethod
+    def get_dir(cls) -> str:
+        """
+        Return the temp downloads directory, as configured for the platform, default: <temp dir>/impartus.media
+        """
+        temp_dirs = Config.load(ConfigType.IMPARTUS).get('temp_downloads_dir') or dict()
+        temp_dir = temp_dirs.get(platform.system()) or os.path.join(Utils.get_temp_dir(), 'impartus.media')
+        os.makedirs(temp_dir, exist_ok=True)
+        return temp_dir
+
+    @classmethod
+    def get_download_dir(cls, ttid) -> str:
+        return os.path.join(cls.get_dir(), str(ttid))
+
+    @classmethod
+    def get_quota(cls) -> int:
+        """
+        Max temp space in bytes for all the active downloads together, 0 for no limit.
+        """
+        return int(Config.load(ConfigType.IMPARTUS).get('temp_storage_quota') or 0) * 1024 * 1024
+
+    @classmethod
+    def reserve(cls, ttid, num_bytes: int, wait: bool = True, cancel_token: CancelToken = None) -> bool:
+        """
+        Reserve temp space for a download, waiting for other downloads to release theirs if the quota is used up.
+        A download holding a reservation owns its directory, which is never reclaimed.
+        :param ttid: video ttid.
+        :param num_bytes: temp space needed, 0 if not known.
+        :param wait: wait for other reservations to be released if the quota is used up.
+        :param cancel_token: the wait is given up with DownloadCancelled if the download is cancelled.
+        :return: True if reserved, False if the download would not fit within the quota.
+        """
+        quota = cls.get_quota()
+        num_bytes = max(0, int(num_bytes or 0))
+        with cls._condition:
+            cls._reservations.pop(ttid, None)
+            if quota and num_bytes > quota:
+                return False
+
+            def fits():
+                return not quota or sum(cls._reservations.values()) + num_bytes <= quota
+
+            if not fits():
+                if not wait:
+                    return False
+                cls.logger.info("[{}]: waiting for temp storage held by other downloads ..".format(ttid))
+                # re-checked periodically, for a cancellation.
+                while not cls._condition.wait_for(fits, timeout=1):
+                    if cancel_token:
+                        cancel_token.raise_if_cancelled()
+            cls._reservations[ttid] = num_bytes
+            return True
+
+    @classmethod
+    def release(cls, ttid):
+        with cls._condition:
+            if cls._reservations.pop(ttid, None) is not None:
+                cls._condition.notify_all()
+
+    @classmethod
+    def is_stale(cls, dirpath: str, max_age: float) -> bool:
+        """
+        A lecture directory is stale if it has no journal (nothing to resume from), its journal is older than
+        max_age seconds, or its lecture has been encoded already (left over in debug mode).
+        """
+        journal_filepath = os.path.join(dirpath, Journal.filename)
+        if not os.path.exists(journal_filepath):
+            return True
+        if max_age and time.time() - os.path.getmtime(journal_filepath) > max_age:
+            return True
+        return Journal(dirpath).is_complete('encode')
+
+    @classmethod
+    def reclaim(cls) -> int:
+        """
+        Delete the stale lecture directories not owned by an active download.
+        :return: number of bytes freed.
+        """
+        max_age = float(Config.load(ConfigType.IMPARTUS).get('temp_storage_max_age') or 0) * 24 * 3600
+        temp_dir = cls.get_dir()
+        freed = 0
+        for name in os.listdir(temp_dir):
+            dirpath = os.path.join(temp_dir, name)
+            with cls._condition:
+                if not os.path.isdir(dirpath) or name in [str(x) for x in cls._reservations]:
+                    continue
+                if not cls.is_stale(dirpath, max_age):
+                    continue
+                size = cls.get_size(dirpath)
+                shutil.rmtree(dirpath, ignore_errors=True)
+            freed += size
+            cls.logger.info("reclaimed {:.1f} MB of stale temp files in {}".format(size / 1024 / 1024, dirpath))
+        return freed
+
+    @classmethod
+    def get_size(cls, dirpath: str) -> int:
+        size = 0
+        for root, _, files in os.walk(dirpath):
+            for filename in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, filename))
+                except OSError:
+                    pass
+        return size
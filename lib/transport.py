@@ -0,0 +1,67 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lib.config import Config, ConfigType
+
+
+class Transport:
+    """
+    Process wide, thread safe http transport used for all the Impartus traffic.
+    A single requests.Session is shared by all the threads, connections are pooled and kept alive per host,
+    and every request gets the configured connect / read timeouts unless the caller sets its own.
+    """
+    _session = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        with cls._lock:
+            if not cls._session:
+                conf = Config.load(ConfigType.IMPARTUS)
+                # pool_block: threads wait for a free connection instead of opening more than
+                # http_connections_per_host connections to a host.
+                adapter = HTTPAdapter(
+                    pool_connections=int(conf.get('http_pooled_hosts') or 10),
+                    pool_maxsize=int(conf.get('http_connections_per_host') or 16),
+                    pool_block=True,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def get_timeout(cls):
+        """
+        Return (connect timeout, read timeout) in seconds, as accepted by requests.
+        """
+        conf = Config.load(ConfigType.IMPARTUS)
+        return conf.get('http_connect_timeout'), conf.get('http_read_timeout')
+
+    @classmethod
+    def get(cls, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', cls.get_timeout())
+        return cls.get_session().get(url, **kwargs)
+
+    @classmethod
+    def head(cls, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', cls.get_timeout())
+        return cls.get_session().head(url, **kwargs)
+
+    @classmethod
+    def post(cls, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', cls.get_timeout())
+        return cls.get_session().post(url, **kwargs)
+
+    @classmethod
+    def close(cls):
+        """
+        Close all the pooled connections, a new session is created on next use.
+        """
+        with cls._lock:
+            if cls._session:
+                cls._session.close()
+                cls._session = None
@@ -97,3 +97,24 @@ class Utils:
         if source != destination:
             os.makedirs(os.path.dirname(destination), exist_ok=True)
             shutil.move(source, destination)
+
+    @classmethod
+    def parse_time(cls, text: str) -> int:
+        """
+        Parse a time of the form [[hh:]mm:]ss into seconds. Raise ValueError if malformed.
+        """
+        parts = str(text).strip().split(':')
+        if not 1 <= len(parts) <= 3 or not all(x.strip().isdigit() for x in parts):
+            raise ValueError('Invalid time: {}, expected [[hh:]mm:]ss'.format(text))
+        seconds = 0
+        for part in parts:
+            seconds = seconds * 60 + int(part)
+        return seconds
+
+    @classmethod
+    def format_time(cls, seconds, separator=':') -> str:
+        """
+        Format seconds as h:mm:ss.
+        """
+        seconds = int(seconds)
+        return '{}{sep}{:02d}{sep}{:02d}'.format(seconds // 3600, (seconds % 3600) // 60, seconds % 60, sep=separator)
@@ -0,0 +1,110 @@
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any
+
+from lib.config import Config, ConfigType
+from lib.media.decrypter import Decrypter
+from lib.media.verifier import Verifier
+
+
+class WorkerPool:
+    """
+    Optional, process wide pool of worker processes for the CPU bound work on the downloaded segments, i.e.
+    decrypting and verifying them, which otherwise runs in the download threads of all the lectures and contends
+    for the GIL. Enabled with worker_processes.
+    Segments are handed over as files, the download thread writes the encrypted segment to a file, and a worker
+    decrypts (and verifies) it into another file, which the download thread appends to the track file. The segment
+    data is never pickled between the processes.
+    """
+    _executor = None
+    _lock = threading.Lock()
+
+    logger = logging.getLogger('WorkerPool')
+
+    @classmethod
+    def get_num_workers(cls) -> int:
+        """
+        Return the number of worker processes, 0 if the segments are processed in the download threads.
+        """
+        workers = Config.load(ConfigType.IMPARTUS).get('worker_processes') or 0
+        if workers == 'auto':
+            return os.cpu_count() or 1
+        return max(0, int(workers))
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return cls.get_num_workers() > 0
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        with cls._lock:
+            if not cls._executor:
+                num_workers = cls.get_num_workers()
+                # the pool is started from a download thread, forking a process with other threads running may
+                # leave the workers with locks held by those threads.
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                cls._executor = ProcessPoolExecutor(max_workers=num_workers,
+                                                    mp_context=multiprocessing.get_context(start_method))
+                cls.logger.info("started {} worker processes.".format(num_workers))
+            return cls._executor
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            if cls._executor:
+                cls._executor.shutdown()
+                cls._executor = None
+
+    @classmethod
+    def process_segment(cls, encryption_key: Any, in_filepath: str, verify: bool = True, content_length: int = None,
+                        received_length: int = None) -> 'TempFile':
+        """
+        Decrypt an encrypted segment file in a worker process, verifying it if asked to (see Verifier.verify()).
+        :return: decrypted segment, positioned at the start, the file is deleted once closed.
+        """
+        fd, out_filepath = tempfile.mkstemp(prefix='segment-', suffix='.ts', dir=os.path.dirname(in_filepath))
+        os.close(fd)
+        try:
+            cls.get_executor().submit(decrypt_segment, encryption_key, in_filepath, out_filepath, verify,
+                                      content_length, received_length).result()
+            return TempFile(out_filepath, 'rb')
+        except BaseException:
+            os.unlink(out_filepath)
+            raise
+
+
+class TempFile(io.FileIO):
+    """
+    Unbuffered file, deleted once closed.
+    """
+
+    @classmethod
+    def create(cls, dir: str = None) -> 'TempFile':
+        fd, filepath = tempfile.mkstemp(prefix='segment-', dir=dir)
+        os.close(fd)
+        return cls(filepath, 'wb+')
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if os.path.exists(self.name):
+                os.unlink(self.name)
+
+
+def decrypt_segment(encryption_key: Any, in_filepath: str, out_filepath: str, verify: bool = True,
+                    content_length: int = None, received_length: int = None):
+    """
+    Worker process entry point, decrypts in_filepath into out_filepath, and verifies it if asked to.
+    Raises CorruptSegment if the verification fails.
+    """
+    with open(in_filepath, 'rb') as in_fh, open(out_filepath, 'wb+') as out_fh:
+        Decrypter.decrypt_stream(encryption_key, iter(partial(in_fh.read, 1024 * 1024), b''), out_fh)
+        if verify:
+            Verifier.verify(out_fh, content_length, received_length)
@@ -0,0 +1,107 @@
+"""
+Benchmark of the segment processing (decrypt, verify, join) of a batch of lectures downloaded together, in the
+download threads (worker_processes: 0) and with 1 .. N worker processes.
+The network is taken out of the picture, segments are served from memory, so that only the CPU bound work and
+the handoff between the processes is measured.
+
+Run from the repository root:
+    python -m test.benchmark_workers --lectures 4 --segments 30 --segment-size 1 --max-workers 8
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from Crypto.Cipher import AES  # noqa
+
+from lib.downloader import SegmentDownloader
+from lib.workerpool import WorkerPool
+
+key = b'0123456789abcdef'
+
+
+def make_segment(size: int, seed: int) -> bytes:
+    """
+    Encrypted MPEG-TS segment of about size bytes, that passes the verification.
+    """
+    num_packets = max(1, size // 188)
+    payload = bytes([seed % 256]) * 184
+    data = b''.join([bytes([0x47, 0x01, 0x00, 0x10 | (x & 0xf)]) + payload for x in range(num_packets)])
+    data += b'\x00' * (-len(data) % 16)
+    return AES.new(key, AES.MODE_CBC, b'\0' * 16).encrypt(data)
+
+
+def serve(segments, url, **kwargs):
+    response = mock.MagicMock()
+    response.__enter__.return_value.status_code = 200
+    response.__enter__.return_value.headers = {}
+    content = segments[url.rsplit('/', 1)[-1]]
+    response.__enter__.return_value.iter_content.side_effect = \
+        lambda chunk_size: (content[x:x + chunk_size] for x in range(0, len(content), chunk_size))
+    return response
+
+
+def download_lecture(lecture: int, num_segments: int, temp_dir: str):
+    """
+    Download (from memory) and join the segments of a lecture into its track file.
+    """
+    download_dir = os.path.join(temp_dir, str(lecture))
+    os.makedirs(download_dir, exist_ok=True)
+    items = [{'url': 'http://bench/{}'.format(x % 8), 'encryption_method': 'AES-128'} for x in range(num_segments)]
+    downloader = SegmentDownloader(lecture, threading.Event(), threading.Event(), lambda item: key,
+                                   temp_dir=download_dir)
+    with open(os.path.join(download_dir, 'track-0.ts'), 'wb') as track_fh:
+        for _, segment_fh in downloader.download(items):
+            with segment_fh:
+                shutil.copyfileobj(segment_fh, track_fh)
+    return os.path.getsize(track_fh.name)
+
+
+def run_batch(num_workers: int, num_lectures: int, num_segments: int) -> (float, int):
+    """
+    Download the lectures concurrently, return (seconds taken, bytes joined).
+    """
+    temp_dir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        with mock.patch.object(WorkerPool, 'get_num_workers', return_value=num_workers):
+            if num_workers:
+                # workers are started upfront, not counted against the first run.
+                WorkerPool.get_executor().submit(int).result()
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=num_lectures) as executor:
+                sizes = list(executor.map(lambda x: download_lecture(x, num_segments, temp_dir), range(num_lectures)))
+            elapsed = time.monotonic() - start
+            WorkerPool.shutdown()
+        return elapsed, sum(sizes)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lectures', type=int, default=4, help='lectures downloaded at a time')
+    parser.add_argument('--segments', type=int, default=30, help='segments per lecture')
+    parser.add_argument('--segment-size', type=float, default=1.0, help='segment size in MB')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help='max worker processes')
+    args = parser.parse_args()
+
+    segments = {str(x): make_segment(int(args.segment_size * 1024 * 1024), x) for x in range(8)}
+    with mock.patch('lib.transport.Transport.get', side_effect=lambda url, **kwargs: serve(segments, url)):
+        print('{} lectures x {} segments of {:.1f} MB, {} cpu cores'.format(
+            args.lectures, args.segments, args.segment_size, os.cpu_count()))
+        print('{:>18} {:>10} {:>10} {:>8}'.format('worker_processes', 'seconds', 'MB/s', 'speedup'))
+        baseline = None
+        worker_counts = [0] + sorted({min(x, args.max_workers) for x in [1, 2, 4, 8, 16, args.max_workers]})
+        for num_workers in worker_counts:
+            elapsed, num_bytes = run_batch(num_workers, args.lectures, args.segments)
+            baseline = baseline or elapsed
+            print('{:>18} {:>10.2f} {:>10.1f} {:>7.2f}x'.format(
+                num_workers or '0 (threads)', elapsed, num_bytes / 1024 / 1024 / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
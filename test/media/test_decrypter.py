@@ -71,3 +71,39 @@ def test_decrypt_with_bad_encryption_key_lengths(mocker, bad_enc_key_lengths):
         with pytest.raises(ValueError) as err:
             Decrypter.decrypt(enc_key, infile, '/tmp')
         assert 'Incorrect AES key length' in err.value.args[0]
+
+
+def test_decrypt_stream(enc_keys):
+    import io
+    from Crypto.Cipher import AES
+    from lib.media.decrypter import Decrypter
+
+    plaintext = bytes(range(256)) * 10
+    for enc_key in enc_keys:
+        key_bytes = Decrypter.get_key_bytes(enc_key)
+        ciphertext = AES.new(key_bytes, AES.MODE_CBC, Decrypter.iv).encrypt(plaintext)
+
+        # chunk sizes not aligned to the cipher block size.
+        chunks = [ciphertext[i:i + 37] for i in range(0, len(ciphertext), 37)]
+        out_fh = io.BytesIO()
+        assert Decrypter.decrypt_stream(enc_key, chunks, out_fh) == len(plaintext)
+        assert out_fh.getvalue() == plaintext
+
+
+def test_decrypt_stream_without_encryption_key():
+    import io
+    from lib.media.decrypter import Decrypter
+
+    out_fh = io.BytesIO()
+    assert Decrypter.decrypt_stream(None, [b'plain', b'', b'text'], out_fh) == 9
+    assert out_fh.getvalue() == b'plaintext'
+
+
+def test_decrypt_stream_truncated(enc_keys):
+    import io
+    from lib.media.decrypter import Decrypter
+    from lib.media.verifier import CorruptSegment
+
+    with pytest.raises(CorruptSegment) as err:
+        Decrypter.decrypt_stream(enc_keys[0], [b'x' * 16, b'x' * 4], io.BytesIO())
+    assert err.value.reason == 'truncated body: 20 bytes not a multiple of 16'
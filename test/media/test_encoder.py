@@ -48,33 +48,43 @@ def tests_data():
     ]
 
 
-def test_split_track(mocker, tests_data):
+@pytest.fixture
+def popen(mocker):
+    popen = mocker.patch('subprocess.Popen')
+    popen.return_value.wait.return_value = 0
+    return popen
+
+
+def commands(popen):
+    """
+    Return the ffmpeg commands run, as command lines.
+    """
+    return [call(' '.join(x.args[0])) for x in popen.call_args_list]
+
+
+def test_split_track(mocker, popen, tests_data):
     mocker.patch('shutil.move')
-    os_system = mocker.patch('os.system')
     from lib.media.encoder import Encoder
 
     for test_data in tests_data:
         Encoder.split_track(test_data['files'], test_data['duration'])
-        assert os_system.call_count == len(test_data['files'])
-        os_system.assert_has_calls(test_data['split_calls'])
-        os_system.reset_mock()
+        assert popen.call_count == len(test_data['files'])
+        assert commands(popen) == test_data['split_calls']
+        popen.reset_mock()
 
 
-def test_encode_mkv_no_split(mocker, tests_data):
-    os_system = mocker.patch('os.system')
+def test_encode_mkv_no_split(mocker, popen, tests_data):
     mocker.patch('os.stat')
     from lib.media.encoder import Encoder
 
     for test_data in tests_data:
         Encoder.encode_mkv(1234, test_data['files'], test_data['filepath'], test_data['duration'], debug=False)
-        assert os_system.call_count == 1
-        os_system.assert_has_calls(test_data['encode_calls'])
-        os_system.reset_mock()
-
+        assert popen.call_count == 1
+        assert commands(popen) == test_data['encode_calls']
+        popen.reset_mock()
 
-def test_encode_mkv_with_split(mocker, tests_data):
-    os_system = mocker.patch('os.system')
 
+def test_encode_mkv_with_split(mocker, popen, tests_data):
     # mock os.stat.st_size to return 0, so that the split branch is called.
     os_stat = mocker.patch('os.stat')
     type(os_stat.return_value).st_size = PropertyMock(return_value=0)
@@ -83,15 +93,14 @@ def test_encode_mkv_with_split(mocker, tests_data):
 
     for test_data in tests_data:
         Encoder.encode_mkv(1234, test_data['files'], test_data['filepath'], test_data['duration'], debug=False)
-        assert os_system.call_count == 1 + len(test_data['files'])
-        os_system.assert_has_calls(*[test_data['split_calls'], test_data['encode_calls']])
-        os_system.reset_mock()
+        assert popen.call_count == 1 + len(test_data['files'])
+        assert commands(popen) == test_data['split_calls'] + test_data['encode_calls']
+        popen.reset_mock()
 
 
-def test_encode_mkv_with_exception(mocker, tests_data, caplog):
-    # mock os.system to throw an exception.
-    os_system = mocker.patch('os.system')
-    os_system.side_effect = Exception('os.system error!')
+def test_encode_mkv_with_exception(mocker, popen, tests_data, caplog):
+    # mock subprocess.Popen to throw an exception.
+    popen.side_effect = Exception('ffmpeg not found!')
 
     mocker.patch('os.stat')
 
@@ -99,20 +108,20 @@ def test_encode_mkv_with_exception(mocker, tests_data, caplog):
 
     for test_data in tests_data:
         output = Encoder.encode_mkv(1234, test_data['files'], test_data['filepath'], test_data['duration'], debug=False)
-        assert os_system.call_count == 1
+        assert popen.call_count == 1
         assert output is False
 
         capiter = iter(caplog.records)
         assert len(caplog.records) == 2
         record = next(capiter)
-        assert record.message == '[1234]: ffmpeg exception: os.system error!'
+        assert record.message == '[1234]: ffmpeg exception: ffmpeg not found!'
         assert record.levelno == logging.ERROR
         assert record.module == 'encoder'
         record2 = next(capiter)
         assert record2.message == test_data['exception']
         assert record2.levelno == logging.ERROR
         assert record2.module == 'encoder'
-        os_system.reset_mock()
+        popen.reset_mock()
         caplog.clear()
 
 
@@ -126,3 +135,190 @@ def test_join(mocker, tests_data):
     Encoder.join(stream_files, "/tmp", 0)
     assert mock_open.call_count == 1 + len(stream_files)
 
+
+def test_encode_mkv_trimmed(mocker, popen):
+    mocker.patch('os.stat')
+    from lib.media.encoder import Encoder
+
+    Encoder.encode_mkv(1234, ['0.ts', '1.ts'], '/tmp/test.mkv', 10, trims=[(2.5, 1800), (0, None)])
+    assert commands(popen) == [call(
+        'ffmpeg -y -loglevel quiet -analyzeduration 2147483647 -probesize 2147483647 -ss 2.500 -t 1800.000 -i 0.ts'
+        + ' -analyzeduration 2147483647 -probesize 2147483647 -i 1.ts -metadata ttid=1234 -c copy -map 0 -map 1'
+        + ' /tmp/test.mkv')]
+
+
+def test_encode_mkv_selected_tracks(mocker, popen):
+    mocker.patch('os.stat')
+    from lib.media.encoder import Encoder
+
+    Encoder.encode_mkv(1234, ['0.ts', '1.ts', '2.ts'], '/tmp/test.mkv', 10, tracks=[2])
+    assert commands(popen) == [call('ffmpeg -y -loglevel quiet -analyzeduration 2147483647 -probesize 2147483647'
+                                    + ' -i 2.ts -metadata ttid=1234 -c copy -map 0 /tmp/test.mkv')]
+
+
+def test_encode_mkv_selected_tracks_with_split(mocker, popen):
+    mocker.patch('shutil.move')
+    os_stat = mocker.patch('os.stat')
+    type(os_stat.return_value).st_size = PropertyMock(return_value=0)
+    from lib.media.encoder import Encoder
+
+    # only the selected tracks are split out of track 0, track 0 is not trimmed when not selected.
+    Encoder.encode_mkv(1234, ['0.ts', '1.ts', '2.ts'], '/tmp/test.mkv', 10, tracks=[1, 2])
+    assert commands(popen) == [
+        call('ffmpeg -y -loglevel quiet -i 0.ts -c copy -ss 10 -t 10 1.ts'),
+        call('ffmpeg -y -loglevel quiet -i 0.ts -c copy -ss 20 -t 10 2.ts'),
+        call('ffmpeg -y -loglevel quiet -analyzeduration 2147483647 -probesize 2147483647 -i 1.ts'
+             + ' -analyzeduration 2147483647 -probesize 2147483647 -i 2.ts -metadata ttid=1234 -c copy -map 0 -map 1'
+             + ' /tmp/test.mkv'),
+    ]
+
+
+def test_encode_mkv_stream(mocker, tmp_path):
+    import io
+    popen = mocker.patch('subprocess.Popen')
+    process = popen.return_value
+    process.stdin = io.BytesIO()
+    process.stdin.close = mocker.MagicMock()
+    process.wait.return_value = 0
+
+    filepath = str(tmp_path / 'test.mkv')
+
+    # ffmpeg output, as it would be written.
+    def create_output(*args, **kwargs):
+        with open(filepath + '.part', 'wb') as fh:
+            fh.write(b'mkv')
+        return process
+    popen.side_effect = create_output
+
+    from lib.media.encoder import Encoder
+    segments = [io.BytesIO(b'abc'), io.BytesIO(b'def')]
+    assert Encoder.encode_mkv_stream(1234, [iter(segments)], filepath, trims=[(4, 60)])
+
+    command = popen.call_args[0][0]
+    assert command[command.index('-i') - 4:command.index('-i') + 2] == ['-ss', '4.000', '-t', '60.000', '-i', 'pipe:0']
+    assert '-probesize' not in command
+    assert process.stdin.getvalue() == b'abcdef'
+    assert process.stdin.close.called
+    assert all(segment.closed for segment in segments)
+    assert open(filepath, 'rb').read() == b'mkv'
+
+
+def test_encode_mkv_stream_ffmpeg_error(mocker, tmp_path):
+    import io
+    popen = mocker.patch('subprocess.Popen')
+    popen.return_value.stdin = io.BytesIO()
+    popen.return_value.stdin.close = mocker.MagicMock()
+    popen.return_value.wait.return_value = 1
+
+    from lib.media.encoder import Encoder
+    filepath = str(tmp_path / 'test.mkv')
+    assert not Encoder.encode_mkv_stream(1234, [iter([io.BytesIO(b'abc')])], filepath)
+    assert not (tmp_path / 'test.mkv').exists()
+
+
+@pytest.mark.skipif(not hasattr(__import__('os'), 'mkfifo'), reason='named pipes are POSIX only')
+def test_encode_mkv_stream_multiple_tracks(mocker, tmp_path):
+    import io
+    popen = mocker.patch('subprocess.Popen')
+    filepath = str(tmp_path / 'test.mkv')
+    temp_dir = tmp_path / 'temp'
+    temp_dir.mkdir()
+
+    # stand-in for ffmpeg, reading each of its inputs and writing them to the output.
+    def ffmpeg(command, **kwargs):
+        inputs = [command[index + 1] for index, arg in enumerate(command) if arg == '-i']
+
+        def wait():
+            with open(command[-1], 'wb') as out_fh:
+                for source in inputs:
+                    with open(source, 'rb') as in_fh:
+                        out_fh.write(in_fh.read())
+            return 0
+        popen.return_value.wait.side_effect = wait
+        return popen.return_value
+    popen.side_effect = ffmpeg
+
+    from lib.media.encoder import Encoder
+    tracks = [iter([io.BytesIO(b'a0'), io.BytesIO(b'a1')]), iter([io.BytesIO(b'b0'), io.BytesIO(b'b1')])]
+    assert Encoder.encode_mkv_stream(1234, tracks, filepath, temp_dir=str(temp_dir))
+
+    command = popen.call_args[0][0]
+    assert command.count('-i') == 2
+    # named pipes are created in the temp dir, not next to the mkv.
+    assert all(x.startswith(str(temp_dir)) for x in command if 'track-' in x)
+    assert command.count('-map') == 2
+    assert open(filepath, 'rb').read() == b'a0a1b0b1'
+
+    # named pipes are removed.
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['temp', 'test.mkv']
+    assert not list(temp_dir.iterdir())
+
+
+@pytest.mark.skipif(__import__('os').name != 'posix', reason='uses POSIX commands')
+def test_run_cancelled():
+    import threading
+    import time
+    from lib.cancellation import CancelToken, DownloadCancelled
+    from lib.media.encoder import Encoder
+
+    cancel_token = CancelToken()
+    assert Encoder.run(['sh', '-c', 'exit 3'], cancel_token) == 3
+
+    # a long running command is killed once cancelled.
+    threading.Timer(0.2, cancel_token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(DownloadCancelled):
+        Encoder.run(['sleep', '10'], cancel_token)
+    assert time.monotonic() - start < 2
+
+
+def test_encode_mkv_cancelled(mocker, tmp_path):
+    from lib.cancellation import CancelToken, DownloadCancelled
+    from lib.media.encoder import Encoder
+
+    ts_file = tmp_path / 'track-0.ts'
+    ts_file.write_bytes(b'ts')
+    filepath = tmp_path / 'test.mkv'
+
+    def run(command, cancel_token):
+        # cancelled with the mkv partly written.
+        filepath.write_bytes(b'part')
+        raise DownloadCancelled()
+    mocker.patch.object(Encoder, 'run', side_effect=run)
+
+    with pytest.raises(DownloadCancelled):
+        Encoder.encode_mkv(1234, [str(ts_file)], str(filepath), 60, cancel_token=CancelToken())
+    assert not filepath.exists()
+
+
+def test_encode_mkv_ffmpeg_error(mocker, popen, tmp_path):
+    from lib.cancellation import CancelToken
+    from lib.media.encoder import Encoder
+
+    ts_file = tmp_path / 'track-0.ts'
+    ts_file.write_bytes(b'ts')
+    filepath = tmp_path / 'test.mkv'
+
+    def wait(timeout=None):
+        # ffmpeg fails with the mkv partly written, e.g. disk full.
+        filepath.write_bytes(b'part')
+        return 1
+    popen.return_value.wait.side_effect = wait
+
+    for cancel_token in [None, CancelToken()]:
+        assert Encoder.encode_mkv(1234, [str(ts_file)], str(filepath), 60, cancel_token=cancel_token) is False
+        assert not filepath.exists()
+
+
+def test_encode_mkv_split_error(mocker, tmp_path):
+    from lib.media.encoder import Encoder
+
+    ts_files = [tmp_path / 'track-0.ts', tmp_path / 'track-1.ts']
+    ts_files[0].write_bytes(b'ts0ts1')
+    ts_files[1].write_bytes(b'')
+    run = mocker.patch.object(Encoder, 'run', return_value=1)
+
+    # the mkv is not encoded, track 0 is left as it was.
+    assert Encoder.encode_mkv(1234, [str(x) for x in ts_files], str(tmp_path / 'test.mkv'), 60) is False
+    assert run.call_count == 1
+    assert ts_files[0].read_bytes() == b'ts0ts1'
@@ -217,3 +217,36 @@ def test_parse(mocker, m3u8_sample):
     assert len(tracks_object[0]) == 70      # 70 media files in track 0.
     assert len(tracks_object[1]) == 0       # 0 media files in track 1.
     assert len(tracks_object[2]) == 0       # 0 media files in track 2.
+
+
+def test_select_time_range(m3u8_sample):
+    from lib.media.m3u8parser import M3u8Parser
+
+    _, tracks = M3u8Parser(m3u8_sample).parse()
+    track = tracks[0]
+
+    # segments 0: [0, 10.28), 1: [10.28, 20.28), 2: [20.28, 30.28) ..
+    items, offset = M3u8Parser.select_time_range(track, 15, 25)
+    assert [x['file_number'] for x in items] == [1, 2]
+    assert offset == pytest.approx(15 - 10.276278)
+
+    items, offset = M3u8Parser.select_time_range(track, 0, 10)
+    assert [x['file_number'] for x in items] == [0]
+    assert offset == 0
+
+    # up to the end.
+    items, offset = M3u8Parser.select_time_range(track, 690)
+    assert [x['file_number'] for x in items] == [68, 69]
+
+    assert M3u8Parser.select_time_range(track, 800) == ([], 0.0)
+
+
+def test_to_m3u8(m3u8_sample):
+    from lib.media.m3u8parser import M3u8Parser
+
+    _, tracks = M3u8Parser(m3u8_sample, num_tracks=2).parse()
+    tracks[1] = tracks[0][30:]
+    tracks[0] = tracks[0][:30]
+    summary, parsed = M3u8Parser(M3u8Parser.to_m3u8(tracks), num_tracks=2).parse()
+    assert parsed == tracks
+    assert summary['media_files'] == 70
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+
+def packet(pid=0x100, counter=0, payload=True, discontinuity=False):
+    adaptation_field_control = 0x3 if discontinuity else (0x1 if payload else 0x2)
+    header = bytes([0x47, (pid >> 8) & 0x1f, pid & 0xff, (adaptation_field_control << 4) | (counter & 0xf)])
+    if adaptation_field_control & 0x2:
+        header += bytes([1, 0x80 if discontinuity else 0x00])
+    return header + b'\xff' * (188 - len(header))
+
+
+def segment(*packets, padding=b''):
+    return io.BytesIO(b''.join(packets) + padding)
+
+
+def test_verify_ok():
+    from lib.media.verifier import Verifier
+
+    fh = segment(*[packet(counter=x) for x in range(20)], packet(pid=0x101, counter=7), padding=b'\x10' * 16)
+    Verifier.verify(fh, content_length=100, received_length=100)
+    assert fh.tell() == 0
+
+    # counters wrap around, repeated packets and packets without payload are allowed.
+    Verifier.verify(segment(packet(counter=15), packet(counter=0), packet(counter=0), packet(counter=0, payload=False),
+                            packet(counter=1)))
+
+    # discontinuity indicator allows a jump.
+    Verifier.verify(segment(packet(counter=3), packet(counter=9, discontinuity=True)))
+
+
+def test_verify_length_mismatch():
+    from lib.media.verifier import CorruptSegment, Verifier
+
+    with pytest.raises(CorruptSegment, match='expected 100 bytes, received 90 bytes'):
+        Verifier.verify(segment(packet()), content_length=100, received_length=90)
+
+
+def test_verify_bad_content():
+    from lib.media.verifier import CorruptSegment, Verifier
+
+    with pytest.raises(CorruptSegment, match='empty segment'):
+        Verifier.verify(segment())
+
+    with pytest.raises(CorruptSegment, match='sync byte missing at offset 0'):
+        Verifier.verify(io.BytesIO(b'<html><body>Service Unavailable</body></html>' * 10))
+
+    with pytest.raises(CorruptSegment, match='truncated packet at offset 188'):
+        Verifier.verify(segment(packet(), padding=packet()[:100]))
+
+    with pytest.raises(CorruptSegment, match='sync byte missing at offset 376') as ex:
+        Verifier.verify(segment(packet(), packet(counter=1), b'\x00' * 188))
+    assert not ex.value.continuity_error
+
+
+def test_verify_continuity_error():
+    from lib.media.verifier import CorruptSegment, Verifier
+
+    with pytest.raises(CorruptSegment, match='continuity counter of pid 256 jumped from 1 to 3') as ex:
+        Verifier.verify(segment(packet(counter=0), packet(counter=1), packet(counter=3)))
+    assert ex.value.continuity_error
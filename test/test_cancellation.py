@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from mock import MagicMock
+
+
+def test_cancel_token():
+    from lib.cancellation import CancelToken, DownloadCancelled
+
+    token = CancelToken()
+    assert not token.is_cancelled()
+    token.raise_if_cancelled()
+    assert not token.wait(0.01)
+
+    threading.Timer(0.1, token.cancel).start()
+    assert token.wait(1)
+    assert token.is_cancelled()
+    with pytest.raises(DownloadCancelled):
+        token.raise_if_cancelled()
+
+
+def test_on_cancel():
+    from lib.cancellation import CancelToken
+
+    token = CancelToken()
+    callback = MagicMock()
+    with token.on_cancel(callback):
+        assert not callback.called
+        token.cancel()
+        assert callback.call_count == 1
+
+    # not called once out of the block.
+    token.cancel()
+    assert callback.call_count == 1
+
+    # called right away if already cancelled.
+    with token.on_cancel(callback):
+        assert callback.call_count == 2
+
+
+def test_on_cancel_callback_error():
+    from lib.cancellation import CancelToken
+
+    token = CancelToken()
+    callback = MagicMock()
+    with token.on_cancel(MagicMock(side_effect=OSError())), token.on_cancel(callback):
+        token.cancel()
+    assert callback.called
+
+
+def test_link():
+    from lib.cancellation import CancelToken
+
+    # cancelled on its own, the token it is linked to is not.
+    token = CancelToken()
+    linked = token.link()
+    linked.cancel()
+    assert linked.is_cancelled()
+    assert not token.is_cancelled()
+
+    # cancelled along with the token it is linked to.
+    linked = token.link()
+    token.cancel()
+    assert linked.is_cancelled()
+    assert token.link().is_cancelled()
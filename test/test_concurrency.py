@@ -0,0 +1,107 @@
+import pytest
+from mock import MagicMock
+
+
+@pytest.fixture
+def limiter(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'max_inflight_segments': 16, 'min_inflight_segments': 2,
+                                                         'adaptive_concurrency': True})
+    clock = [1000.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    from lib.concurrency import AdaptiveLimiter
+
+    limiter = AdaptiveLimiter()
+    limiter.clock = clock
+    return limiter
+
+
+def saturate(limiter):
+    # all the slots in use, so that the limit is what holds the requests back.
+    limiter.in_flight = limiter.get_limit()
+
+
+def test_additive_increase(limiter):
+    listener = MagicMock()
+    limiter.add_listener(listener)
+    assert limiter.get_limit() == 8
+
+    # about 1 more for every limit requests completed.
+    saturate(limiter)
+    for _ in range(9):
+        limiter.on_success(1.0)
+    assert limiter.get_limit() == 9
+    listener.assert_called_with(9)
+
+    # no growth while the limit is not in use.
+    limiter.in_flight = 1
+    for _ in range(100):
+        limiter.on_success(1.0)
+    assert limiter.get_limit() == 9
+
+    # never above max.
+    for _ in range(1000):
+        saturate(limiter)
+        limiter.on_success(1.0)
+    assert limiter.get_limit() == 16
+
+
+def test_multiplicative_decrease_on_errors(limiter):
+    limiter.on_success(1.0)
+    limiter.on_failure()
+    assert limiter.get_limit() == 4
+
+    # failures of the requests in flight together count once.
+    limiter.on_failure()
+    assert limiter.get_limit() == 4
+
+    limiter.clock[0] += 2
+    limiter.on_failure()
+    assert limiter.get_limit() == 2
+
+    # never below min.
+    limiter.clock[0] += 2
+    limiter.on_failure()
+    assert limiter.get_limit() == 2
+
+
+def test_decrease_on_latency_build_up(limiter):
+    saturate(limiter)
+    for _ in range(10):
+        limiter.on_success(1.0)
+    limit = limiter.get_limit()
+
+    # latencies climbing well above the baseline.
+    for _ in range(20):
+        limiter.clock[0] += 10
+        saturate(limiter)
+        limiter.on_success(5.0)
+    assert limiter.get_limit() < limit
+
+
+def test_fixed_limit(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'max_inflight_segments': 6, 'adaptive_concurrency': False})
+    from lib.concurrency import AdaptiveLimiter
+
+    limiter = AdaptiveLimiter()
+    assert limiter.get_limit() == 6
+    limiter.on_failure()
+    assert limiter.get_limit() == 6
+
+
+def test_acquire_cancelled(mocker):
+    import threading
+    import time
+    from lib.cancellation import CancelToken, DownloadCancelled
+    mocker.patch('lib.config.Config.load', return_value={'max_inflight_segments': 1, 'adaptive_concurrency': False})
+    from lib.concurrency import AdaptiveLimiter
+
+    limiter = AdaptiveLimiter()
+    cancel_token = CancelToken()
+    with limiter.hold(cancel_token):
+        # waiting for the slot held above, until cancelled.
+        threading.Timer(0.1, cancel_token.cancel).start()
+        start = time.monotonic()
+        with pytest.raises(DownloadCancelled):
+            limiter.acquire(cancel_token, interval=0.05)
+        assert time.monotonic() - start < 1
+    assert limiter.in_flight == 0
@@ -0,0 +1,67 @@
+import threading
+from collections import namedtuple
+
+import pytest
+
+DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free'])
+
+
+@pytest.fixture
+def disk_space(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'disk_space_margin': 1})
+    mocker.patch('shutil.disk_usage', return_value=DiskUsage(0, 0, 11 * 1024 * 1024))
+    from lib.diskspace import DiskSpace
+
+    mocker.patch.object(DiskSpace, '_reservations', dict())
+    mocker.patch.object(DiskSpace, '_condition', threading.Condition())
+    return DiskSpace
+
+
+def test_reserve(disk_space, tmp_path):
+    mb = 1024 * 1024
+
+    # 10 MB usable, temp and final paths on the same disk add up.
+    assert not disk_space.reserve(1, {str(tmp_path / 'temp'): 6 * mb, str(tmp_path / 'final.mkv'): 6 * mb})
+    assert disk_space.reserve(1, {str(tmp_path / 'temp'): 4 * mb, str(tmp_path / 'final.mkv'): 4 * mb})
+
+    # does not fit with the other reservation.
+    assert not disk_space.reserve(2, {str(tmp_path): 4 * mb}, wait=False)
+
+    # waits for the other reservation to be released.
+    reserved = threading.Event()
+    thread = threading.Thread(target=lambda: disk_space.reserve(2, {str(tmp_path): 4 * mb}) and reserved.set())
+    thread.start()
+    assert not reserved.wait(0.2)
+    disk_space.release(1)
+    assert reserved.wait(2)
+    thread.join()
+
+
+def test_reserve_cancelled(disk_space, tmp_path):
+    from lib.cancellation import CancelToken, DownloadCancelled
+
+    mb = 1024 * 1024
+    assert disk_space.reserve(1, {str(tmp_path): 8 * mb})
+
+    # a download waiting for disk space gives up once cancelled.
+    cancel_token = CancelToken()
+    errors = list()
+    thread = threading.Thread(target=lambda: errors.append(pytest.raises(
+        DownloadCancelled, disk_space.reserve, 2, {str(tmp_path): 4 * mb}, cancel_token=cancel_token)))
+    thread.start()
+    cancel_token.cancel()
+    thread.join(3)
+    assert not thread.is_alive()
+    assert errors
+    assert 2 not in disk_space._reservations
+
+
+def test_preallocate(disk_space, tmp_path):
+    import os
+    if not hasattr(os, 'posix_fallocate'):
+        pytest.skip('posix_fallocate not available')
+
+    with open(tmp_path / 'track-0.ts', 'wb') as fh:
+        fh.write(b'abc')
+        disk_space.preallocate(fh, 3, 1000)
+        assert os.path.getsize(tmp_path / 'track-0.ts') == 1003
@@ -0,0 +1,502 @@
+import threading
+import time
+
+import pytest
+
+from mock import MagicMock
+
+
+@pytest.fixture(autouse=True)
+def host_health():
+    from lib.hosthealth import HostHealth
+    HostHealth.clear()
+    yield
+    HostHealth.clear()
+
+
+def response(content: bytes):
+    # a streamed requests.Response, used as a context manager.
+    mock_response = MagicMock()
+    mock_response.__enter__.return_value.status_code = 200
+    mock_response.__enter__.return_value.iter_content.return_value = [content]
+    return mock_response
+
+
+def test_download_in_order(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 4, 'retry_wait': 0})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = lambda url, stream: response(url.encode())
+
+    from lib.downloader import SegmentDownloader
+
+    items = [{'url': 'http://foo/{}'.format(i), 'encryption_method': 'NONE'} for i in range(20)]
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+
+    # results arrive in the same order as the items, irrespective of the order of completion.
+    results = list(downloader.download(items))
+    assert [x[0] for x in results] == items
+    assert [x[1].read() for x in results] == [item['url'].encode() for item in items]
+    assert mock_get.call_count == 20
+
+
+def test_download_retry_on_timeout(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 0})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = [TimeoutError(), TimeoutError(), response(b'content')]
+
+    from lib.downloader import SegmentDownloader
+
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    segment_fh = downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+    assert mock_get.call_count == 3
+    assert segment_fh.read() == b'content'
+
+
+def test_download_fails_on_http_error(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 0})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.return_value = response(b'<html>not found</html>')
+    mock_get.return_value.__enter__.return_value.status_code = 404
+
+    from lib.downloader import SegmentDownloader
+    from lib.retry import HttpError
+
+    # error bodies are never handed over as segment data.
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    with pytest.raises(HttpError):
+        downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+    assert mock_get.call_count == 1
+
+
+def test_download_decrypts_stream(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.return_value = response(b'encrypted content')
+    mock_decrypt = mocker.patch('lib.media.decrypter.Decrypter.decrypt_stream')
+    key_func = MagicMock(return_value=b'0123456789abcdef')
+
+    from lib.downloader import SegmentDownloader
+
+    item = {'url': 'http://foo/0', 'encryption_method': 'AES-128', 'encryption_key_id': '0'}
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), key_func)
+    downloader.download_segment(item)
+    key_func.assert_called_once_with(item)
+    mock_get.assert_called_once_with('http://foo/0', stream=True)
+    assert mock_decrypt.call_count == 1
+    assert mock_decrypt.call_args[0][0] == b'0123456789abcdef'
+
+
+def test_download_refetch_truncated_encrypted_segment(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 0})
+    from Crypto.Cipher import AES
+    from lib.media.decrypter import Decrypter
+    key = b'0123456789abcdef'
+    ciphertext = AES.new(key, AES.MODE_CBC, Decrypter.iv).encrypt(b'x' * 64)
+
+    # the connection dropped mid way through a body sent without a Content-Length.
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = [response(ciphertext[:40]), response(ciphertext)]
+
+    from lib.downloader import SegmentDownloader
+
+    item = {'url': 'http://foo/0', 'encryption_method': 'AES-128', 'encryption_key_id': '0'}
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock(return_value=key))
+    segment_fh = downloader.download_segment(item)
+    assert mock_get.call_count == 2
+    assert segment_fh.read() == b'x' * 64
+    assert downloader.stats['corrupt'] == 1
+
+
+def test_download_window(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 2})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = lambda url, stream: response(url.encode())
+
+    from lib.downloader import SegmentDownloader
+
+    items = [{'url': 'http://foo/{}'.format(i), 'encryption_method': 'NONE'} for i in range(20)]
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+
+    # only a window of segments is fetched ahead of the consumer.
+    results = downloader.download(items)
+    next(results)
+    assert mock_get.call_count <= downloader.window + 1
+    results.close()
+
+
+def test_adaptive_concurrency_workers(mocker):
+    config = {'segment_download_threads': 4, 'max_inflight_segments': 16, 'adaptive_concurrency': True}
+    mocker.patch('lib.config.Config.load', return_value=config)
+
+    from lib.downloader import SegmentDownloader
+
+    # with adaptive concurrency, the pool does not cap the segments in flight below the adaptive limit.
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    assert downloader.num_workers == 16
+    assert downloader.window == 32
+
+    config['adaptive_concurrency'] = False
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    assert downloader.num_workers == 4
+
+
+def test_wait_if_paused(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 2})
+
+    from lib.downloader import SegmentDownloader
+
+    pause_ev = threading.Event()
+    resume_ev = threading.Event()
+    downloader = SegmentDownloader(1234, pause_ev, resume_ev, MagicMock())
+
+    # not paused, returns immediately.
+    downloader.wait_if_paused()
+
+    # paused, blocks until resumed.
+    pause_ev.set()
+    worker = threading.Thread(target=downloader.wait_if_paused)
+    worker.start()
+    worker.join(0.1)
+    assert worker.is_alive()
+    resume_ev.set()
+    pause_ev.clear()
+    worker.join(1)
+    assert not worker.is_alive()
+
+
+def test_pause_abandons_request(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_wait': 0})
+    pause_ev = threading.Event()
+    resume_ev = threading.Event()
+
+    def chunks():
+        yield b'part'
+        # paused mid way through the segment.
+        pause_ev.set()
+        threading.Timer(0.1, lambda: (pause_ev.clear(), resume_ev.set())).start()
+        yield b'rest'
+
+    first = response(b'')
+    first.__enter__.return_value.iter_content.return_value = chunks()
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = [first, response(b'content')]
+
+    from lib.downloader import SegmentDownloader
+
+    downloader = SegmentDownloader(1234, pause_ev, resume_ev, MagicMock())
+    segment_fh = downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+
+    # the request in flight is closed on pause, and the segment fetched again in full once resumed.
+    assert first.__exit__.called
+    assert mock_get.call_count == 2
+    assert segment_fh.read() == b'content'
+
+
+def test_cancel_abandons_request(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 0})
+    from lib.cancellation import CancelToken, DownloadCancelled
+    cancel_token = CancelToken()
+    read = threading.Event()
+
+    # a read blocked on a slow server, until the response is closed.
+    def chunks():
+        yield b'part'
+        read.wait(5)
+        raise ConnectionError('closed')
+
+    mock_response = response(b'')
+    mock_response.__enter__.return_value.iter_content.return_value = chunks()
+    mock_get = mocker.patch('lib.transport.Transport.get', return_value=mock_response)
+
+    from lib.downloader import SegmentDownloader
+
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock(),
+                                   cancel_token=cancel_token)
+    mock_response.__enter__.return_value.close.side_effect = read.set
+    threading.Timer(0.1, cancel_token.cancel).start()
+    with pytest.raises(DownloadCancelled):
+        downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+
+    # not retried.
+    assert mock_get.call_count == 1
+    with pytest.raises(DownloadCancelled):
+        downloader.download_segment({'url': 'http://foo/1', 'encryption_method': 'NONE'})
+    assert mock_get.call_count == 1
+
+
+def test_stop(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_wait': 0})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    from lib.cancellation import CancelToken, DownloadCancelled
+    from lib.downloader import SegmentDownloader
+
+    # stopped like a cancelled download, the lecture is not cancelled.
+    cancel_token = CancelToken()
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock(),
+                                   cancel_token=cancel_token)
+    downloader.stop()
+    with pytest.raises(DownloadCancelled):
+        downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+    assert not mock_get.called
+    assert not cancel_token.is_cancelled()
+
+
+def test_cancel_while_waiting_for_response(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_wait': 0})
+    from lib.cancellation import CancelToken, DownloadCancelled
+    cancel_token = CancelToken()
+    release = threading.Event()
+    mock_response = response(b'content')
+
+    # the server accepts the connection, but takes its time to respond.
+    def get(url, stream):
+        release.wait(5)
+        return mock_response
+    mocker.patch('lib.transport.Transport.get', side_effect=get)
+
+    from lib.downloader import SegmentDownloader
+
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock(),
+                                   cancel_token=cancel_token)
+    downloader.cancel_check_interval = 0.05
+    threading.Timer(0.1, cancel_token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(DownloadCancelled):
+        list(downloader.download([{'url': 'http://foo/0', 'encryption_method': 'NONE'}]))
+    assert time.monotonic() - start < 1
+
+    # the response is closed without being read, once it arrives.
+    release.set()
+    for _ in range(20):
+        if mock_response.__exit__.called:
+            break
+        time.sleep(0.05)
+    assert mock_response.__exit__.called
+    assert not mock_response.__enter__.return_value.iter_content.called
+
+
+def test_cancel_interrupts_retry_wait(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 10, 'retry_max_wait': 10})
+    mocker.patch('random.uniform', side_effect=lambda low, high: high)
+    from lib.cancellation import CancelToken, DownloadCancelled
+    cancel_token = CancelToken()
+    mock_get = mocker.patch('lib.transport.Transport.get', return_value=response(b''))
+    mock_get.return_value.__enter__.return_value.status_code = 503
+
+    from lib.downloader import SegmentDownloader
+
+    # cancelled while waiting 10s for the retry.
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock(),
+                                   cancel_token=cancel_token)
+    threading.Timer(0.1, cancel_token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(DownloadCancelled):
+        downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+    assert time.monotonic() - start < 2
+    assert mock_get.call_count == 1
+
+
+def test_download_concurrent_tracks(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 2, 'retry_wait': 0})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = lambda url, stream: response(url.encode())
+
+    from lib.downloader import SegmentDownloader
+
+    tracks = [[{'url': 'http://foo/{}/{}'.format(t, i), 'encryption_method': 'NONE'} for i in range(10)]
+              for t in range(3)]
+    results = dict()
+
+    def download_track(index):
+        results[index] = [x[1].read() for x in downloader.download(tracks[index])]
+
+    # tracks share the worker threads of the downloader.
+    with SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock()) as downloader:
+        threads = [threading.Thread(target=download_track, args=(index,)) for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert downloader.executor._max_workers == 2
+
+    assert downloader.executor is None
+    for index in range(3):
+        assert results[index] == [item['url'].encode() for item in tracks[index]]
+
+
+def test_download_refetch_corrupt_segment(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 0, 'verify_segments': True})
+    from test.media.test_verifier import packet
+    good = packet(counter=0) + packet(counter=1)
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = [response(b'<html>Bad Gateway</html>'), response(good[:300]), response(good)]
+
+    from lib.downloader import SegmentDownloader
+
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    segment_fh = downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+    assert mock_get.call_count == 3
+    assert segment_fh.read() == good
+    assert downloader.stats == {'verified': 1, 'corrupt': 2, 'accepted': 0, 'hedged': 0, 'hedge_wins': 0}
+
+
+def test_download_accept_continuity_error(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 2,
+                                                         'retry_wait': 0, 'verify_segments': True})
+    from test.media.test_verifier import packet
+    glitched = packet(counter=0) + packet(counter=5)
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = lambda url, stream: response(glitched)
+
+    from lib.downloader import SegmentDownloader
+
+    # continuity errors that persist across re-fetches are accepted.
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    segment_fh = downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+    assert segment_fh.read() == glitched
+    assert mock_get.call_count == 3
+    assert downloader.stats == {'verified': 0, 'corrupt': 2, 'accepted': 1, 'hedged': 0, 'hedge_wins': 0}
+
+
+def test_download_hedged_request(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_wait': 0,
+                                                         'hedge_requests': True, 'hedge_max_fraction': 1,
+                                                         'media_host_mirrors': ['http://mirror']})
+    release = threading.Event()
+
+    def stalled():
+        release.wait(5)
+        yield b'slow'
+
+    def get(url, stream):
+        if url.startswith('http://mirror'):
+            return response(b'fast')
+        mock_response = response(b'')
+        mock_response.__enter__.return_value.iter_content.return_value = stalled()
+        return mock_response
+
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = get
+
+    from lib.downloader import SegmentDownloader
+
+    with SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock()) as downloader:
+        for _ in range(downloader.hedge_policy.min_samples):
+            downloader.hedge_policy.record(0.05)
+
+        segment_fh = downloader.download_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'})
+        assert segment_fh.read() == b'fast'
+        assert [x[0][0] for x in mock_get.call_args_list] == ['http://foo/0', 'http://mirror/0']
+        assert downloader.stats['hedged'] == 1
+        assert downloader.stats['hedge_wins'] == 1
+        release.set()
+
+
+def test_no_hedge_while_waiting_for_a_slot(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_wait': 0,
+                                                         'hedge_requests': True, 'hedge_max_fraction': 1,
+                                                         'media_host_mirrors': ['http://mirror']})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = lambda url, stream: response(b'fast')
+
+    from lib.downloader import SegmentDownloader
+    from lib.scheduler import Scheduler
+
+    # all the segment slots held by other downloads.
+    slot = Scheduler.segment_slot()
+    for _ in range(slot.get_limit()):
+        slot.acquire()
+    try:
+        with SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock()) as downloader:
+            # a hedge delay well below the wait for the slot, yet not so short that a hiccup hedges the request.
+            for _ in range(downloader.hedge_policy.min_samples):
+                downloader.hedge_policy.record(0.1)
+
+            result = list()
+            thread = threading.Thread(target=lambda: result.append(downloader.download_segment(
+                {'url': 'http://foo/0', 'encryption_method': 'NONE'})))
+            thread.start()
+            thread.join(0.3)
+            assert not mock_get.called
+
+            slot.release()
+            thread.join(2)
+            assert result[0].read() == b'fast'
+            assert mock_get.call_count == 1
+            assert downloader.stats['hedged'] == 0
+            # the time spent waiting for the slot is not counted.
+            assert max(downloader.hedge_policy.latencies.latencies) < 0.2
+    finally:
+        for _ in range(slot.get_limit() - 1):
+            slot.release()
+
+
+def test_cancelled_request_waiting_for_a_slot(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_wait': 0})
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = lambda url, stream: response(b'late')
+
+    from lib.downloader import SegmentDownloader
+    from lib.hedging import RequestCancelled
+    from lib.scheduler import Scheduler
+
+    slot = Scheduler.segment_slot()
+    for _ in range(slot.get_limit()):
+        slot.acquire()
+    try:
+        downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+        cancel_event = threading.Event()
+        errors = list()
+
+        def fetch():
+            try:
+                downloader.fetch_segment({'url': 'http://foo/0', 'encryption_method': 'NONE'}, None,
+                                         cancel_event=cancel_event)
+            except RequestCancelled as ex:
+                errors.append(ex)
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        thread.join(0.1)
+
+        # the other request won meanwhile, this one is not sent once it gets a slot.
+        cancel_event.set()
+        slot.release()
+        thread.join(2)
+        assert len(errors) == 1
+        assert not mock_get.called
+        assert slot.in_flight == slot.get_limit() - 1
+    finally:
+        for _ in range(slot.get_limit() - 1):
+            slot.release()
+
+
+def test_download_failover(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'segment_download_threads': 1, 'retry_attempts': 3,
+                                                         'retry_wait': 0, 'media_host_mirrors': ['http://mirror'],
+                                                         'circuit_breaker_failures': 2})
+
+    def get(url, stream):
+        mock_response = response(url.encode())
+        if url.startswith('http://foo'):
+            mock_response.__enter__.return_value.status_code = 503
+        return mock_response
+
+    mock_get = mocker.patch('lib.transport.Transport.get')
+    mock_get.side_effect = get
+
+    from lib.downloader import SegmentDownloader
+
+    items = [{'url': 'http://foo/{}'.format(i), 'encryption_method': 'NONE'} for i in range(4)]
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), MagicMock())
+    results = [x[1].read() for x in downloader.download(items)]
+
+    # the failing host is retried elsewhere, and avoided once its circuit opens.
+    assert results == [b'http://mirror/0', b'http://mirror/1', b'http://mirror/2', b'http://mirror/3']
+    assert [x[0][0] for x in mock_get.call_args_list][:2] == ['http://foo/0', 'http://mirror/0']
+    assert len([x for x in mock_get.call_args_list if x[0][0].startswith('http://foo')]) <= 2
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture
+def download_queue(mocker, tmp_path):
+    mocker.patch('lib.config.Config.load', return_value={'persist_download_queue': True})
+    mocker.patch('lib.utils.Utils.get_temp_dir', return_value=str(tmp_path))
+    from lib.downloadqueue import DownloadQueue
+
+    # fresh queue for every test.
+    mocker.patch.object(DownloadQueue, '_entries', dict())
+    mocker.patch.object(DownloadQueue, '_loaded', False)
+    return DownloadQueue
+
+
+def test_add_remove(download_queue):
+    download_queue.add('1', {'filepath': '/tmp/1.mkv'})
+    download_queue.add('2', {'filepath': '/tmp/2.mkv', 'paused': True})
+    assert download_queue.get_all() == {
+        '1': {'filepath': '/tmp/1.mkv', 'paused': False},
+        '2': {'filepath': '/tmp/2.mkv', 'paused': True},
+    }
+
+    download_queue.set_paused('1', True)
+    assert download_queue.get_all()['1']['paused']
+
+    download_queue.remove('1')
+    assert list(download_queue.get_all().keys()) == ['2']
+
+    # unknown keys are ignored.
+    download_queue.remove('1')
+    download_queue.set_paused('1', False)
+    assert list(download_queue.get_all().keys()) == ['2']
+
+
+def test_persistent(download_queue):
+    download_queue.add('2', {'time_range': [60, None]})
+    download_queue.add('1', {'time_range': None})
+    download_queue.set_paused('1', True)
+
+    # a new process loads the queue saved on disk, in the order requested.
+    download_queue._entries.clear()
+    download_queue._loaded = False
+    assert download_queue.get_all() == {
+        '2': {'time_range': [60, None], 'paused': False},
+        '1': {'time_range': None, 'paused': True},
+    }
+    assert list(download_queue.get_all().keys()) == ['2', '1']
+
+    download_queue.clear()
+    download_queue._loaded = False
+    assert download_queue.get_all() == {}
+
+
+def test_not_persistent(download_queue, mocker):
+    mocker.patch('lib.config.Config.load', return_value={'persist_download_queue': False})
+    download_queue.add('1', {})
+
+    download_queue._entries.clear()
+    download_queue._loaded = False
+    assert download_queue.get_all() == {}
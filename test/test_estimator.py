@@ -0,0 +1,28 @@
+from mock import MagicMock
+
+
+def test_estimate(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'size_estimate_samples': 3})
+    from lib.estimator import SizeEstimator
+
+    tracks_info = [
+        [{'url': 'a{}'.format(i), 'duration': 10.0} for i in range(6)],
+        [{'url': 'b{}'.format(i), 'duration': 5.0} for i in range(6)],
+    ]
+    head_func = MagicMock(return_value=1000)
+
+    estimate = SizeEstimator(1234, head_func).estimate(tracks_info)
+    assert head_func.call_count == 3
+
+    # samples a0, a4, b2: 3000 bytes in 25 seconds, 120 bytes / second.
+    assert estimate == {'tracks': [7200, 3600], 'total': 10800}
+
+
+def test_estimate_unknown(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'size_estimate_samples': 3})
+    from lib.estimator import SizeEstimator
+
+    tracks_info = [[{'url': 'a{}'.format(i), 'duration': 10.0} for i in range(6)]]
+    assert SizeEstimator(1234, MagicMock(return_value=None)).estimate(tracks_info) is None
+    assert SizeEstimator(1234, MagicMock(side_effect=TimeoutError())).estimate(tracks_info) is None
+    assert SizeEstimator(1234, MagicMock(), num_samples=0).estimate(tracks_info) is None
@@ -0,0 +1,46 @@
+def test_latency_percentile():
+    from lib.hedging import LatencyTracker
+
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(95) is None
+    for latency in range(1, 101):
+        tracker.record(latency / 10)
+    assert tracker.percentile(50) == 5.1
+    assert tracker.percentile(95) == 9.6
+    assert tracker.percentile(100) == 10.0
+
+    # only the most recent latencies count.
+    for _ in range(100):
+        tracker.record(1.0)
+    assert tracker.percentile(95) == 1.0
+
+
+def test_hedge_delay(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'hedge_requests': True, 'hedge_percentile': 90,
+                                                         'hedge_max_fraction': 0.1})
+    from lib.hedging import HedgePolicy
+
+    policy = HedgePolicy()
+    for _ in range(HedgePolicy.min_samples - 1):
+        policy.record(1.0)
+    assert policy.get_delay() is None
+    policy.record(1.0)
+    assert policy.get_delay() == 1.0
+
+    mocker.patch('lib.config.Config.load', return_value={'hedge_requests': False})
+    policy = HedgePolicy()
+    for _ in range(HedgePolicy.min_samples):
+        policy.record(1.0)
+    assert policy.get_delay() is None
+
+
+def test_hedge_max_fraction(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'hedge_requests': True, 'hedge_max_fraction': 0.1})
+    from lib.hedging import HedgePolicy
+
+    policy = HedgePolicy()
+    for _ in range(25):
+        policy.count_request()
+    assert policy.acquire_hedge()
+    assert policy.acquire_hedge()
+    assert not policy.acquire_hedge()
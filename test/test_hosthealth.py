@@ -0,0 +1,109 @@
+import pytest
+
+
+@pytest.fixture
+def health(mocker):
+    mocker.patch('lib.config.Config.load', return_value={
+        'media_host_mirrors': ['https://b.example.com', 'c.example.com'],
+        'circuit_breaker_failures': 2,
+        'circuit_breaker_cooldown': 30,
+    })
+    clock = [1000.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    from lib.hosthealth import HostHealth
+
+    HostHealth.clear()
+    HostHealth.clock = clock
+    yield HostHealth
+    HostHealth.clear()
+
+
+def request(health, url, latency=1.0, error=None):
+    try:
+        with health.track(url):
+            health.clock[0] += latency
+            if error:
+                raise error
+    except Exception as ex:
+        if ex is not error:
+            raise
+
+
+url = 'http://a.example.com/media/0.ts?token=x'
+
+
+def test_no_mirrors(mocker):
+    mocker.patch('lib.config.Config.load', return_value={})
+    from lib.hosthealth import HostHealth
+
+    assert HostHealth.choose_url(url) == url
+
+
+def test_choose_fastest(health):
+    # hosts not tried yet come first, in order.
+    assert health.choose_url(url) == url
+    request(health, 'http://a.example.com/1.ts', latency=2.0)
+    assert health.choose_url(url) == 'https://b.example.com/media/0.ts?token=x'
+    request(health, 'https://b.example.com/1.ts', latency=1.0)
+    assert health.choose_url(url) == 'http://c.example.com/media/0.ts?token=x'
+    request(health, 'http://c.example.com/1.ts', latency=3.0)
+    assert health.choose_url(url) == 'https://b.example.com/media/0.ts?token=x'
+
+    # requests in flight count against a host.
+    with health.track('https://b.example.com/2.ts'), health.track('https://b.example.com/3.ts'):
+        assert health.choose_url(url) == url
+
+    assert health.choose_url(url, exclude='b.example.com') == url
+
+
+def test_circuit_breaker(health):
+    for host in ['http://a.example.com', 'https://b.example.com', 'http://c.example.com']:
+        request(health, host, latency=1.0)
+    request(health, 'http://a.example.com', latency=0.1)
+    assert health.choose_url(url) == url
+
+    # a failing host is tried after the others, a success resets its failures.
+    request(health, 'http://a.example.com', error=TimeoutError())
+    assert health.choose_url(url) != url
+    request(health, 'http://a.example.com', latency=0.1)
+    assert health.choose_url(url) == url
+    request(health, 'http://a.example.com', error=TimeoutError())
+
+    # failures in a row open it.
+    request(health, 'http://a.example.com', error=TimeoutError())
+    assert health.choose_url(url) != url
+    assert health.choose_url(url, exclude='b.example.com') == 'http://c.example.com/media/0.ts?token=x'
+
+    # half open after the cooldown, a single request probes the host.
+    health.clock[0] += 30
+    assert health.choose_url(url) == url
+    with health.track(url):
+        assert health.choose_url(url) != url
+    assert health.choose_url(url) == url
+
+
+def test_circuit_reopens(health):
+    for _ in range(2):
+        request(health, 'http://a.example.com', error=ConnectionError())
+    assert health.choose_url(url) != url
+
+    health.clock[0] += 30
+    request(health, 'http://a.example.com', error=ConnectionError())
+    assert health.choose_url(url) != url
+
+
+def test_all_hosts_down(health):
+    for host in ['http://a.example.com', 'https://b.example.com', 'http://c.example.com']:
+        for _ in range(2):
+            request(health, host, error=ConnectionError())
+    assert health.choose_url(url) == url
+
+
+def test_ignored_errors(health):
+    for _ in range(3):
+        try:
+            with health.track(url, is_failure=lambda ex: False):
+                raise ValueError()
+        except ValueError:
+            pass
+    assert health.choose_url(url) == url
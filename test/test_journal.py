@@ -0,0 +1,64 @@
+def test_new_journal(tmp_path):
+    from lib.journal import Journal
+
+    journal = Journal(str(tmp_path))
+    assert journal.get_playlist() is None
+    assert journal.get_key(0) is None
+    assert journal.get_track_progress(0) == (0, 0)
+    assert not journal.is_complete('encode')
+
+
+def test_resume_journal(tmp_path):
+    from lib.journal import Journal
+
+    journal = Journal(str(tmp_path))
+    journal.set_playlist(['#EXTM3U', 'http://foo/0.ts'])
+    journal.set_key('1', b'0123456789abcdef')
+    journal.set_track_progress(0, 10, 12345)
+    journal.set_complete('download-track-0')
+
+    # a new journal object for the same directory picks up the saved state.
+    journal = Journal(str(tmp_path))
+    assert journal.get_playlist() == ['#EXTM3U', 'http://foo/0.ts']
+    assert journal.get_key(1) == b'0123456789abcdef'
+    assert journal.get_track_progress(0) == (10, 12345)
+    assert journal.get_track_progress(1) == (0, 0)
+    assert journal.is_complete('download-track-0')
+    assert not journal.is_complete('encode')
+
+    journal.delete()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_corrupt_journal(tmp_path):
+    from lib.journal import Journal
+
+    (tmp_path / Journal.filename).write_text('{"tracks": {"0": ')
+    journal = Journal(str(tmp_path))
+    assert journal.get_track_progress(0) == (0, 0)
+
+
+def test_time_range(tmp_path):
+    from lib.journal import Journal
+
+    journal = Journal(str(tmp_path))
+    assert journal.get_time_range() is None
+    journal.set_track_progress(0, 10, 12345)
+    journal.set_complete('download-track-0')
+
+    # the same range keeps the progress.
+    journal.set_time_range(None)
+    assert journal.get_track_progress(0) == (10, 12345)
+
+    # a different range discards it, the keys are kept.
+    journal.set_key('1', b'0123456789abcdef')
+    journal.set_time_range((1800, 3600))
+    assert journal.get_track_progress(0) == (0, 0)
+    assert not journal.is_complete('download-track-0')
+    assert journal.get_key(1) == b'0123456789abcdef'
+
+    journal.set_track_progress(0, 2, 100)
+    journal = Journal(str(tmp_path))
+    assert journal.get_time_range() == [1800, 3600]
+    journal.set_time_range((1800, 3600))
+    assert journal.get_track_progress(0) == (2, 100)
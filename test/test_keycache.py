@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+from mock import MagicMock
+
+
+@pytest.fixture
+def key_cache(mocker, tmp_path):
+    mocker.patch('lib.config.Config.load', return_value={'persist_key_cache': True})
+    mocker.patch('lib.utils.Utils.get_temp_dir', return_value=str(tmp_path))
+    from lib.keycache import KeyCache
+
+    # fresh cache for every test.
+    mocker.patch.object(KeyCache, '_keys', dict())
+    mocker.patch.object(KeyCache, '_key_locks', dict())
+    mocker.patch.object(KeyCache, '_loaded', False)
+    return KeyCache
+
+
+def test_get_set(key_cache):
+    assert key_cache.get(1, '100') is None
+    key_cache.set(1, '100', b'key')
+    assert key_cache.get(1, '100') == b'key'
+
+    # same key id of another lecture is a different key.
+    assert key_cache.get(2, '100') is None
+
+
+def test_persistent(key_cache):
+    key_cache.set(1, '100', b'\x01\x02')
+
+    # a new process loads the keys saved on disk.
+    key_cache._keys.clear()
+    key_cache._loaded = False
+    assert key_cache.get(1, '100') == b'\x01\x02'
+
+    key_cache.clear()
+    key_cache._loaded = False
+    assert key_cache.get(1, '100') is None
+
+
+def test_get_or_fetch_single_fetch(key_cache):
+    def fetch():
+        time.sleep(0.1)
+        return b'key'
+    fetch_func = MagicMock(side_effect=fetch)
+
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(key_cache.get_or_fetch(1, '100', fetch_func)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b'key'] * 4
+    assert fetch_func.call_count == 1
@@ -0,0 +1,89 @@
+import pytest
+
+
+@pytest.fixture
+def clock(mocker):
+    clock = [1000.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    return clock
+
+
+def test_throughput(clock):
+    from lib.quality import Throughput
+
+    throughput = Throughput(window=30, min_samples=3)
+    assert throughput.get_rate() is None
+    throughput.record(1000)
+    clock[0] += 1
+    throughput.record(1000)
+    assert throughput.get_rate() is None
+    clock[0] += 1
+    throughput.record(3000)
+    assert throughput.get_rate() == pytest.approx(2000)
+
+    # old samples drop out of the window.
+    clock[0] += 60
+    assert throughput.get_rate() is None
+
+
+def items(quality, count=10):
+    return [{'duration': 10.0, 'url': 'http://foo/{}/{}.ts'.format(quality, x), 'encryption_method': 'NONE',
+             'encryption_key_url': None} for x in range(count)]
+
+
+@pytest.fixture
+def auto_quality(mocker, clock):
+    mocker.patch('lib.config.Config.load', return_value={'auto_quality_target': 10, 'auto_quality_interval': 2})
+    from lib.quality import AutoQuality, Throughput
+
+    mocker.patch.object(Throughput, '_history', Throughput())
+    variants = {'1280xHD': items('hd'), '800xHigh': items('high'), '400xLow': items('low')}
+    # 100 seconds of video, in 10 minutes: 1 MB/s needed for 600 MB.
+    sizes = {'1280xHD': 600 * 1024 * 1024, '800xHigh': 300 * 1024 * 1024, '400xLow': 60 * 1024 * 1024}
+    return AutoQuality(1234, variants, sizes, Throughput(min_samples=2))
+
+
+def measure(auto_quality, clock, rate):
+    for _ in range(3):
+        clock[0] += 1
+        auto_quality.throughput.record(rate)
+
+
+def test_start_lowest_without_history(auto_quality, clock):
+    assert auto_quality.start() == '400xLow'
+    assert auto_quality.track == auto_quality.variants['400xLow']
+
+    # moves up once the throughput is known, at a segment boundary.
+    measure(auto_quality, clock, 2 * 1024 * 1024)
+    assert auto_quality.check(1) is None
+    next_items = auto_quality.check(2)
+    assert next_items == auto_quality.variants['1280xHD'][2:]
+    assert auto_quality.quality == '1280xHD'
+    assert [x['url'] for x in auto_quality.track[:3]] == ['http://foo/low/0.ts', 'http://foo/low/1.ts',
+                                                          'http://foo/hd/2.ts']
+
+
+def test_start_with_history(auto_quality):
+    from lib.quality import Throughput
+
+    for x in range(3):
+        Throughput.history().record(600 * 1024, now=998.0 + x)
+    assert auto_quality.start() == '800xHigh'
+
+
+def test_switch_down(auto_quality, clock):
+    measure(auto_quality, clock, 2 * 1024 * 1024)
+    assert auto_quality.start() == '1280xHD'
+
+    # throughput collapses.
+    clock[0] += 60
+    measure(auto_quality, clock, 100 * 1024)
+    assert auto_quality.check(4) == auto_quality.variants['400xLow'][4:]
+    assert auto_quality.quality == '400xLow'
+
+
+def test_no_switch_unaligned(auto_quality, clock):
+    auto_quality.variants['1280xHD'] = [dict(x, duration=7.0) for x in auto_quality.variants['1280xHD']]
+    assert auto_quality.start() == '400xLow'
+    measure(auto_quality, clock, 2 * 1024 * 1024)
+    assert auto_quality.check(2) is None
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def limiter(mocker):
+    from lib.ratelimiter import RateLimiter
+    mocker.patch.object(RateLimiter, '_override', None)
+    mocker.patch.object(RateLimiter, '_tokens', 0.0)
+    return RateLimiter
+
+
+def test_get_limit(mocker, limiter):
+    mocker.patch('lib.config.Config.load', return_value={
+        'bandwidth_limit': 1024,
+        'bandwidth_limit_schedule': [
+            {'from': '09:00', 'to': '18:00', 'limit': 256},
+            {'from': '22:00', 'to': '06:00', 'limit': 0},
+        ]
+    })
+
+    assert limiter.get_limit(datetime(2021, 1, 1, 10, 30)) == 256 * 1024
+    assert limiter.get_limit(datetime(2021, 1, 1, 18, 0)) == 1024 * 1024
+    assert limiter.get_limit(datetime(2021, 1, 1, 8, 59)) == 1024 * 1024
+    # window spanning midnight.
+    assert limiter.get_limit(datetime(2021, 1, 1, 23, 0)) == 0
+    assert limiter.get_limit(datetime(2021, 1, 1, 1, 0)) == 0
+
+    # run time override takes precedence.
+    limiter.set_limit(512)
+    assert limiter.get_limit(datetime(2021, 1, 1, 10, 30)) == 512 * 1024
+    limiter.set_limit(0)
+    assert limiter.get_limit(datetime(2021, 1, 1, 10, 30)) == 0
+    limiter.set_limit(None)
+    assert limiter.get_limit(datetime(2021, 1, 1, 10, 30)) == 256 * 1024
+
+
+def test_unlimited(mocker, limiter):
+    mocker.patch('lib.config.Config.load', return_value={'bandwidth_limit': 0})
+    mock_sleep = mocker.patch('time.sleep')
+
+    assert list(limiter.throttle([b'x' * 1024 * 1024] * 10)) == [b'x' * 1024 * 1024] * 10
+    assert mock_sleep.call_count == 0
+
+
+def test_throttle(mocker, limiter):
+    mocker.patch('lib.config.Config.load', return_value={'bandwidth_limit': 100})
+
+    # fake clock, advanced by sleep.
+    clock = [1000.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('time.sleep', side_effect=lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    mocker.patch.object(limiter, '_last_refill', clock[0])
+
+    # 1000 KB at 100 KB/s needs ~10 seconds.
+    list(limiter.throttle([b'x' * 1024] * 1000))
+    assert 9.9 <= clock[0] - 1000.0 <= 10.1
+
+
+def test_throttle_cancelled(mocker, limiter):
+    import threading
+    import time
+    from lib.cancellation import CancelToken, DownloadCancelled
+    mocker.patch('lib.config.Config.load', return_value={'bandwidth_limit': 1})
+    mocker.patch.object(limiter, '_last_refill', time.monotonic())
+
+    # 100 KB at 1 KB/s, cancelled well before the bucket lets it through.
+    cancel_token = CancelToken()
+    threading.Timer(0.1, cancel_token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(DownloadCancelled):
+        limiter.consume(100 * 1024, cancel_token)
+    assert time.monotonic() - start < 1
+    # the tokens are given back.
+    assert limiter._tokens > -1024
@@ -0,0 +1,117 @@
+import pytest
+import requests
+from mock import MagicMock
+
+
+@pytest.fixture
+def retry_conf():
+    return {'retry_attempts': 3, 'retry_wait': 1, 'retry_max_wait': 4, 'retry_budget': 2}
+
+
+def response(status_code):
+    mock_response = MagicMock(spec=requests.Response)
+    mock_response.status_code = status_code
+    mock_response.headers = {}
+    mock_response.url = 'http://foo'
+    return mock_response
+
+
+def test_retry_on_exceptions(mocker, retry_conf):
+    mocker.patch('lib.config.Config.load', return_value=retry_conf)
+    mock_sleep = mocker.patch('time.sleep')
+
+    from lib.retry import RetryPolicy
+
+    func = MagicMock(side_effect=[requests.exceptions.ConnectionError(), requests.exceptions.ReadTimeout(), 'ok'])
+    assert RetryPolicy().call(func, 'http://foo') == 'ok'
+    assert func.call_count == 3
+    assert mock_sleep.call_count == 2
+
+    # retries exhausted, last exception is raised.
+    func = MagicMock(side_effect=requests.exceptions.ConnectionError())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        RetryPolicy().call(func, 'http://foo')
+    assert func.call_count == 3
+
+
+def test_retry_interrupted(mocker, retry_conf):
+    import threading
+    mocker.patch('lib.config.Config.load', return_value=retry_conf)
+    mock_sleep = mocker.patch('time.sleep')
+
+    from lib.retry import RetryPolicy
+
+    # the wait for the next retry is cut short, and the last error raised.
+    interrupt = threading.Event()
+    interrupt.set()
+    func = MagicMock(side_effect=requests.exceptions.ConnectionError())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        RetryPolicy().call(func, 'http://foo', interrupt=interrupt)
+    assert func.call_count == 1
+    assert not mock_sleep.called
+
+
+def test_no_retry_on_other_exceptions(mocker, retry_conf):
+    mocker.patch('lib.config.Config.load', return_value=retry_conf)
+    mocker.patch('time.sleep')
+
+    from lib.retry import HttpError, RetryPolicy
+
+    for ex in [ValueError(), HttpError(404), HttpError(403)]:
+        func = MagicMock(side_effect=ex)
+        with pytest.raises(type(ex)):
+            RetryPolicy().call(func)
+        assert func.call_count == 1
+
+
+def test_retry_on_status_codes(mocker, retry_conf):
+    mocker.patch('lib.config.Config.load', return_value=retry_conf)
+    mocker.patch('time.sleep')
+
+    from lib.retry import RetryPolicy
+
+    func = MagicMock(side_effect=[response(503), response(429), response(200)])
+    assert RetryPolicy().call(func).status_code == 200
+    assert func.call_count == 3
+
+    # non retryable status codes are returned as is.
+    func = MagicMock(side_effect=[response(404)])
+    assert RetryPolicy().call(func).status_code == 404
+    assert func.call_count == 1
+
+    # retries exhausted, last response is returned.
+    func = MagicMock(side_effect=[response(500), response(502), response(504)])
+    assert RetryPolicy().call(func).status_code == 504
+
+
+def test_retry_budget(mocker, retry_conf):
+    mocker.patch('lib.config.Config.load', return_value=retry_conf)
+    mocker.patch('time.sleep')
+
+    from lib.retry import RetryBudget, RetryPolicy
+
+    budget = RetryBudget()
+    func = MagicMock(side_effect=[TimeoutError(), 'ok', TimeoutError(), TimeoutError()])
+    assert RetryPolicy().call(func, budget=budget) == 'ok'
+
+    # 1 retry left in the budget, the request fails after 2 attempts instead of 3.
+    with pytest.raises(TimeoutError):
+        RetryPolicy().call(func, budget=budget)
+    assert func.call_count == 4
+    assert budget.remaining == 0
+
+
+def test_backoff(mocker, retry_conf):
+    mocker.patch('lib.config.Config.load', return_value=retry_conf)
+
+    from lib.retry import RetryPolicy
+
+    policy = RetryPolicy()
+    for attempt, max_wait in [(1, 1), (2, 2), (3, 4), (4, 4), (10, 4)]:
+        for _ in range(20):
+            assert 0 <= policy.backoff(attempt) <= max_wait
+
+    # Retry-After is honoured, up to max wait.
+    assert policy.backoff(1, retry_after='3') == 3
+    assert policy.backoff(1, retry_after='30') == 4
+    assert policy.backoff(1, retry_after='Wed, 21 Oct 2015 07:28:00 GMT') <= 1
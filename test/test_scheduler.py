@@ -0,0 +1,390 @@
+import logging
+import threading
+import time
+
+import pytest
+from mock import MagicMock
+
+
+@pytest.fixture
+def scheduler(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'max_active_downloads': 1, 'max_inflight_segments': 3,
+                                                         'max_active_encodes': 1, 'encode_queue_size': 1,
+                                                         'download_order': 'fifo'})
+    from lib.scheduler import Scheduler
+
+    # fresh scheduler state for every test, the workers of the test are stopped.
+    Scheduler.shutdown()
+    yield Scheduler
+    Scheduler.shutdown(timeout=5)
+
+
+def test_get_priority(mocker):
+    mock_config_load = mocker.patch('lib.config.Config.load')
+    from lib.scheduler import Scheduler
+
+    older = {'startTime': '2021-01-01 09:00:00', 'actualDuration': '7200', 'tapNToggle': '1'}
+    newer = {'startTime': '2021-02-01 09:00:00', 'actualDuration': '3000', 'tapNToggle': '3'}
+
+    mock_config_load.return_value = {'download_order': 'fifo'}
+    assert Scheduler.get_priority(older) == Scheduler.get_priority(newer)
+
+    mock_config_load.return_value = {'download_order': 'newest'}
+    assert Scheduler.get_priority(newer) < Scheduler.get_priority(older)
+
+    mock_config_load.return_value = {'download_order': 'shortest'}
+    assert Scheduler.get_priority(older) < Scheduler.get_priority(newer)
+
+
+def test_max_active_downloads(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    release = threading.Event()
+    order = list()
+
+    def download(name, job):
+        order.append(name)
+        release.wait(5)
+        return True
+
+    from functools import partial
+    job1 = DownloadJob(partial(download, 'job1'))
+    job2 = DownloadJob(partial(download, 'job2'), priority=1)
+    job3 = DownloadJob(partial(download, 'job3'), priority=0)
+    scheduler.submit(job1)
+    scheduler.submit(job2)
+    scheduler.submit(job3)
+
+    # only 1 active download, others are queued.
+    assert not release.wait(0.2)
+    assert order == ['job1']
+    assert job1.state == JobState.ACTIVE
+    assert job2.state == JobState.QUEUED
+    assert job3.state == JobState.QUEUED
+    assert scheduler.has_pending_jobs()
+
+    # queued jobs run in order of priority.
+    release.set()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+    assert order == ['job1', 'job3', 'job2']
+    assert all(job.state == JobState.DONE for job in [job1, job2, job3])
+
+
+def test_background_priority(scheduler):
+    from functools import partial
+    from lib.scheduler import DownloadJob
+
+    release = threading.Event()
+    order = list()
+
+    def download(name, job):
+        order.append(name)
+        release.wait(5)
+        return True
+
+    scheduler.submit(DownloadJob(partial(download, 'job1')))
+    for _ in range(50):
+        if order:
+            break
+        time.sleep(0.01)
+    scheduler.submit(DownloadJob(partial(download, 'upgrade'), priority=scheduler.background_priority))
+    # e.g. the newest lecture first, with a large negative priority.
+    scheduler.submit(DownloadJob(partial(download, 'job2'), priority=-1e10))
+    scheduler.submit(DownloadJob(partial(download, 'job3'), priority=1e10))
+
+    release.set()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+    assert order == ['job1', 'job2', 'job3', 'upgrade']
+
+
+def test_release_connections_when_paused(scheduler, mocker):
+    from lib.scheduler import DownloadJob
+
+    mock_close = mocker.patch('lib.transport.Transport.close')
+    started = threading.Event()
+
+    def download(job):
+        started.set()
+        job.resume_event.wait(5)
+        return True
+
+    job1 = DownloadJob(download)
+    job2 = DownloadJob(download)
+    scheduler.submit(job1)
+    assert started.wait(1)
+    scheduler.submit(job2)
+
+    # queued job paused, job1 still downloading.
+    job2.pause()
+    assert not mock_close.called
+
+    # no download running.
+    job1.pause()
+    assert mock_close.called
+
+    job1.resume()
+    job2.resume()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+
+
+def test_cancel_queued_job(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    release = threading.Event()
+    download = MagicMock(side_effect=lambda job: release.wait(5))
+    job1 = DownloadJob(download)
+    job2 = DownloadJob(download)
+    scheduler.submit(job1)
+    scheduler.submit(job2)
+
+    job2.cancel()
+    assert job2.state == JobState.CANCELLED
+    release.set()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+    assert download.call_count == 1
+    assert job1.state == JobState.DONE
+
+
+def test_cancel_active_job(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    started = threading.Event()
+
+    def download(job):
+        started.set()
+        # paused jobs are woken up by cancel.
+        job.resume_event.wait(5)
+        return not job.is_cancelled()
+
+    encode = MagicMock(return_value=True)
+    job = DownloadJob(download, encode_func=encode)
+    scheduler.submit(job)
+    assert started.wait(1)
+    job.pause()
+    job.cancel()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+    assert job.state == JobState.CANCELLED
+    assert not encode.called
+
+
+def test_paused_jobs_are_skipped(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    done = threading.Event()
+    callback = MagicMock()
+    job = DownloadJob(lambda job: done.set() or True, callback=callback)
+    job.pause()
+    scheduler.submit(job)
+    assert not done.wait(0.2)
+    assert job.state == JobState.PAUSED
+
+    job.resume()
+    assert done.wait(2)
+    assert callback.called
+
+
+def test_failed_job(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    done = threading.Event()
+
+    def download(job):
+        done.set()
+        raise ValueError('boom')
+
+    job = DownloadJob(download, callback=lambda job: None)
+    scheduler.submit(job)
+    assert done.wait(2)
+    for _ in range(20):
+        if job.state == JobState.FAILED:
+            break
+        time.sleep(0.1)
+    assert job.state == JobState.FAILED
+
+
+def test_segment_slot(scheduler):
+    slot = scheduler.segment_slot()
+    assert slot is scheduler.segment_slot()
+    assert slot.get_limit() == 3
+    for _ in range(3):
+        slot.acquire()
+
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: slot.acquire() or acquired.set())
+    thread.start()
+    assert not acquired.wait(0.2)
+    slot.release()
+    assert acquired.wait(2)
+    thread.join()
+
+
+def test_pipelined_stages(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    encoding = threading.Event()
+    release = threading.Event()
+    downloaded = list()
+
+    def download(name, job):
+        downloaded.append(name)
+        job.data['name'] = name
+        return True
+
+    def encode(job):
+        encoding.set()
+        release.wait(5)
+        return True
+
+    from functools import partial
+    jobs = [DownloadJob(partial(download, 'job{}'.format(i)), encode_func=encode) for i in range(4)]
+    for job in jobs:
+        scheduler.submit(job)
+
+    # next lectures download while the first one encodes, until the encode queue (size 1) is full.
+    assert encoding.wait(2)
+    time.sleep(0.2)
+    assert downloaded == ['job0', 'job1', 'job2']
+    assert scheduler.has_pending_jobs()
+
+    release.set()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+    assert downloaded == ['job0', 'job1', 'job2', 'job3']
+    assert all(job.state == JobState.DONE for job in jobs)
+
+
+def test_encode_skipped_on_failed_download(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    encode = MagicMock()
+    job = DownloadJob(lambda job: False, encode_func=encode)
+    scheduler.submit(job)
+    for _ in range(20):
+        if job.state == JobState.FAILED:
+            break
+        time.sleep(0.1)
+    assert job.state == JobState.FAILED
+    assert not encode.called
+
+
+def test_submit_task(scheduler):
+    assert scheduler.submit_task(lambda x: x * 2, 21).result(2) == 42
+
+
+def test_submit_task_error_logged(scheduler, caplog):
+    def save_captions():
+        raise ConnectionError('connection reset')
+
+    future = scheduler.submit_task(save_captions)
+    with pytest.raises(ConnectionError):
+        future.result(2)
+    for _ in range(20):
+        if caplog.records:
+            break
+        time.sleep(0.05)
+    assert caplog.records[0].message == 'save_captions failed with an exception: connection reset'
+    assert caplog.records[0].levelno == logging.ERROR
+
+
+def test_cancel_job_waiting_to_encode(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    encoding = threading.Event()
+    release = threading.Event()
+    downloaded = list()
+
+    def download(job):
+        downloaded.append(job)
+        job.data['media'] = {}
+        return True
+
+    def encode(job):
+        encoding.set()
+        release.wait(5)
+        return True
+
+    encode_func = MagicMock(side_effect=encode)
+    cancel_func = MagicMock()
+    jobs = [DownloadJob(download, encode_func=encode_func, cancel_func=cancel_func) for _ in range(3)]
+    for job in jobs:
+        scheduler.submit(job)
+
+    # job0 encoding, job1 in the encode queue (size 1), job2 downloaded and waiting for room in it.
+    assert encoding.wait(2)
+    for _ in range(20):
+        if len(downloaded) == 3:
+            break
+        time.sleep(0.1)
+    time.sleep(0.1)
+
+    jobs[2].cancel()
+    for _ in range(20):
+        if jobs[2].state == JobState.CANCELLED:
+            break
+        time.sleep(0.1)
+    assert jobs[2].state == JobState.CANCELLED
+    cancel_func.assert_called_once_with(jobs[2])
+
+    jobs[1].cancel()
+    assert jobs[1].state == JobState.CANCELLED
+    cancel_func.assert_called_with(jobs[1])
+
+    release.set()
+    for _ in range(50):
+        if not scheduler.has_pending_jobs():
+            break
+        time.sleep(0.1)
+    assert jobs[0].state == JobState.DONE
+    assert encode_func.call_count == 1
+    assert cancel_func.call_count == 2
+
+
+def test_shutdown(scheduler):
+    from lib.scheduler import DownloadJob, JobState
+
+    started = threading.Event()
+    release = threading.Event()
+    download = MagicMock(side_effect=lambda job: started.set() or release.wait(5))
+    job1 = DownloadJob(download)
+    job2 = DownloadJob(download)
+    scheduler.submit(job1)
+    scheduler.submit(job2)
+    assert started.wait(1)
+    workers = [worker for stage in scheduler.stages for worker in scheduler._workers[stage]]
+    generation = scheduler._generation
+
+    # the active job finishes its stage, the queued one is dropped.
+    thread = threading.Thread(target=scheduler.shutdown, kwargs={'timeout': 2})
+    thread.start()
+    for _ in range(50):
+        if scheduler._generation != generation:
+            break
+        time.sleep(0.01)
+    release.set()
+    thread.join(3)
+    assert not any(worker.is_alive() for worker in workers)
+    assert download.call_count == 1
+    assert job2.state == JobState.QUEUED
+    assert not scheduler.has_pending_jobs()
+
+    # started afresh.
+    done = threading.Event()
+    scheduler.submit(DownloadJob(lambda job: done.set() or True))
+    assert done.wait(2)
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def temp_storage(mocker, tmp_path):
+    mocker.patch('lib.config.Config.load', return_value={
+        'temp_downloads_dir': {'Linux': str(tmp_path), 'Darwin': str(tmp_path), 'Windows': str(tmp_path)},
+        'temp_storage_quota': 10,
+        'temp_storage_max_age': 7,
+    })
+    from lib.tempstorage import TempStorage
+
+    mocker.patch.object(TempStorage, '_reservations', dict())
+    mocker.patch.object(TempStorage, '_condition', threading.Condition())
+    return TempStorage
+
+
+def test_get_dir(temp_storage, tmp_path):
+    assert temp_storage.get_dir() == str(tmp_path)
+    assert temp_storage.get_download_dir(1234) == os.path.join(str(tmp_path), '1234')
+
+
+def test_reserve_within_quota(temp_storage):
+    mb = 1024 * 1024
+    assert not temp_storage.reserve(1, 11 * mb)
+    assert temp_storage.reserve(1, 6 * mb)
+    assert not temp_storage.reserve(2, 6 * mb, wait=False)
+
+    # waits for the quota to be released by the other download.
+    reserved = threading.Event()
+    thread = threading.Thread(target=lambda: temp_storage.reserve(2, 6 * mb) and reserved.set())
+    thread.start()
+    assert not reserved.wait(0.2)
+    temp_storage.release(1)
+    assert reserved.wait(2)
+    thread.join()
+
+
+def test_reserve_cancelled(temp_storage):
+    from lib.cancellation import CancelToken, DownloadCancelled
+
+    mb = 1024 * 1024
+    assert temp_storage.reserve(1, 6 * mb)
+
+    # a download waiting for the quota gives up once cancelled.
+    cancel_token = CancelToken()
+    errors = list()
+    thread = threading.Thread(target=lambda: errors.append(pytest.raises(
+        DownloadCancelled, temp_storage.reserve, 2, 6 * mb, cancel_token=cancel_token)))
+    thread.start()
+    cancel_token.cancel()
+    thread.join(3)
+    assert not thread.is_alive()
+    assert errors
+    assert 2 not in temp_storage._reservations
+
+
+def test_reclaim(temp_storage, tmp_path):
+    from lib.journal import Journal
+
+    def lecture_dir(ttid, stages=None, age_days=0):
+        dirpath = tmp_path / str(ttid)
+        dirpath.mkdir()
+        (dirpath / 'track-0.ts').write_bytes(b'x' * 100)
+        if stages is not None:
+            journal = Journal(str(dirpath))
+            for stage in stages:
+                journal.set_complete(stage)
+            journal.save()
+            mtime = time.time() - age_days * 24 * 3600
+            os.utime(journal.filepath, (mtime, mtime))
+        return dirpath
+
+    orphan = lecture_dir(1)
+    resumable = lecture_dir(2, stages=['download-track-0'])
+    old = lecture_dir(3, stages=[], age_days=10)
+    encoded = lecture_dir(4, stages=['encode'])
+    active = lecture_dir(5)
+    (tmp_path / 'keys.json').write_text('{}')
+
+    temp_storage.reserve(5, 0)
+    stale_size = sum(temp_storage.get_size(str(x)) for x in [orphan, old, encoded])
+    assert temp_storage.reclaim() == stale_size
+    assert not orphan.exists()
+    assert resumable.exists()
+    assert not old.exists()
+    assert not encoded.exists()
+    assert active.exists()
+    assert (tmp_path / 'keys.json').exists()
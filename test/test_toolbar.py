@@ -0,0 +1,21 @@
+from mock import MagicMock
+
+
+def test_watch_concurrency(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'max_inflight_segments': 8, 'min_inflight_segments': 1,
+                                                         'adaptive_concurrency': True})
+    mock_variables = mocker.patch('ui.toolbar.Variables')
+    from lib.concurrency import AdaptiveLimiter
+    from ui.toolbar import Toolbar
+
+    mock_app = MagicMock()
+    mock_app.after.side_effect = lambda delay, func, *args: func(*args)
+    limiter = AdaptiveLimiter()
+
+    Toolbar(mock_app).watch_concurrency(limiter)
+    mock_variables.return_value.concurrency_var.assert_called_with('⇅  Segments In Flight: 4')
+
+    # updates on the download threads are posted to the main loop.
+    limiter.on_failure()
+    mock_app.after.assert_called_once()
+    mock_variables.return_value.concurrency_var.assert_called_with('⇅  Segments In Flight: 2')
@@ -0,0 +1,41 @@
+import threading
+
+
+def test_shared_session(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'http_pooled_hosts': 2, 'http_connections_per_host': 4})
+
+    from lib.transport import Transport
+    Transport.close()
+
+    sessions = list()
+    threads = [threading.Thread(target=lambda: sessions.append(Transport.get_session())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # one session for all the threads.
+    assert len(sessions) == 8
+    assert all(session is sessions[0] for session in sessions)
+
+    adapter = sessions[0].get_adapter('https://a.impartus.com')
+    assert adapter._pool_maxsize == 4
+    assert adapter._pool_block is True
+
+    Transport.close()
+    assert Transport.get_session() is not sessions[0]
+    Transport.close()
+
+
+def test_default_timeout(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'http_connect_timeout': 5, 'http_read_timeout': 30})
+    mock_session = mocker.patch('lib.transport.Transport.get_session')
+
+    from lib.transport import Transport
+
+    Transport.get('http://foo')
+    mock_session.return_value.get.assert_called_once_with('http://foo', timeout=(5, 30))
+
+    # caller's timeout takes precedence.
+    Transport.post('http://foo', json={}, timeout=1)
+    mock_session.return_value.post.assert_called_once_with('http://foo', json={}, timeout=1)
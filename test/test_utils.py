@@ -149,3 +149,17 @@ def test_add_new_fields(mocker):
     from lib.utils import Utils
 
     assert Utils.add_new_fields(metadata_given, video_slide_mapping) == metadata_processed
+
+
+def test_parse_time():
+    from lib.utils import Utils
+
+    assert Utils.parse_time('45') == 45
+    assert Utils.parse_time('30:00') == 1800
+    assert Utils.parse_time(' 1:02:03 ') == 3723
+    for text in ['', '1:xx', '1:2:3:4', '-5']:
+        with pytest.raises(ValueError):
+            Utils.parse_time(text)
+
+    assert Utils.format_time(3723) == '1:02:03'
+    assert Utils.format_time(1800, separator='.') == '0.30.00'
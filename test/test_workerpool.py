@@ -0,0 +1,98 @@
+import os
+import threading
+
+import pytest
+from Crypto.Cipher import AES  # noqa
+from mock import MagicMock
+
+key = b'0123456789abcdef'
+
+
+def packets(count, counters=None):
+    counters = counters or range(count)
+    return b''.join([bytes([0x47, 0x01, 0x00, 0x10 | (x & 0xf)]) + b'\xff' * 184 for x in counters])
+
+
+def encrypt(data: bytes):
+    # padded to the cipher block size, as served.
+    data += b'\x00' * (-len(data) % 16)
+    return AES.new(key, AES.MODE_CBC, b'\0' * 16).encrypt(data)
+
+
+@pytest.fixture
+def worker_pool(mocker):
+    mocker.patch('lib.config.Config.load', return_value={'worker_processes': 2, 'segment_download_threads': 2,
+                                                         'verify_segments': True, 'retry_wait': 0})
+    from lib.workerpool import WorkerPool
+    mocker.patch.object(WorkerPool, '_executor', None)
+    yield WorkerPool
+    WorkerPool.shutdown()
+
+
+def test_get_num_workers(mocker):
+    mock_config_load = mocker.patch('lib.config.Config.load')
+    from lib.workerpool import WorkerPool
+
+    mock_config_load.return_value = {'worker_processes': 0}
+    assert not WorkerPool.is_enabled()
+    mock_config_load.return_value = {'worker_processes': 3}
+    assert WorkerPool.get_num_workers() == 3
+    mock_config_load.return_value = {'worker_processes': 'auto'}
+    assert WorkerPool.get_num_workers() == (os.cpu_count() or 1)
+
+
+def test_process_segment(worker_pool, tmp_path):
+    content = packets(20)
+    in_filepath = tmp_path / 'segment.enc'
+    in_filepath.write_bytes(encrypt(content))
+
+    segment_fh = worker_pool.process_segment(key, str(in_filepath))
+    assert segment_fh.read()[:len(content)] == content
+
+    # the decrypted file is deleted once closed.
+    segment_fh.close()
+    assert os.listdir(str(tmp_path)) == ['segment.enc']
+
+
+def test_process_segment_corrupt(worker_pool, tmp_path):
+    from lib.media.verifier import CorruptSegment
+
+    in_filepath = tmp_path / 'segment.enc'
+    in_filepath.write_bytes(encrypt(packets(2, counters=[0, 5])))
+
+    # raised in the worker, with its details intact.
+    with pytest.raises(CorruptSegment) as ex:
+        worker_pool.process_segment(key, str(in_filepath))
+    assert ex.value.continuity_error
+    assert str(ex.value).count('Corrupt segment') == 1
+    assert os.listdir(str(tmp_path)) == ['segment.enc']
+
+    # not verified.
+    worker_pool.process_segment(key, str(in_filepath), verify=False).close()
+
+
+def test_download_with_worker_pool(worker_pool, mocker, tmp_path):
+    from lib.hosthealth import HostHealth
+    HostHealth.clear()
+
+    segments = {'http://foo/{}'.format(i): packets(10 + i) for i in range(6)}
+
+    def get(url, stream):
+        mock_response = MagicMock()
+        mock_response.__enter__.return_value.status_code = 200
+        mock_response.__enter__.return_value.headers = {}
+        mock_response.__enter__.return_value.iter_content.return_value = [encrypt(segments[url])]
+        return mock_response
+    mocker.patch('lib.transport.Transport.get', side_effect=get)
+
+    from lib.downloader import SegmentDownloader
+    items = [{'url': url, 'encryption_method': 'AES-128'} for url in segments]
+    downloader = SegmentDownloader(1234, threading.Event(), threading.Event(), lambda item: key,
+                                   temp_dir=str(tmp_path))
+    for item, segment_fh in downloader.download(items):
+        with segment_fh:
+            assert segment_fh.read()[:len(segments[item['url']])] == segments[item['url']]
+    assert downloader.stats['verified'] == len(items)
+
+    # the encrypted and decrypted segment files are all deleted.
+    assert os.listdir(str(tmp_path)) == []
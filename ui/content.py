@@ -3,7 +3,6 @@ import os
 import pathlib
 import platform
 import shutil
-import threading
 import ast
 from datetime import datetime
 from functools import partial
@@ -15,8 +14,10 @@ from tksheet import Sheet
 import tkinter.messagebox
 
 from lib.config import ConfigType, Config
+from lib.downloadqueue import DownloadQueue
 from lib.impartus import Impartus
 from lib.captions import Captions, CaptionsNotFound
+from lib.scheduler import DownloadJob, JobState, Scheduler
 from lib.utils import Utils
 from ui.data import Columns, Labels
 from ui.data import Icons
@@ -62,6 +63,11 @@ class Content:
         # threads for downloading videos / slides.
         self.threads = None
 
+        # download jobs by lecture ttid, kept across reloads, and the row index of each lecture listed.
+        self.jobs = dict()
+        self.ttid_rows = dict()
+        self.downloads_restored = False
+
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def _init_content(self):
@@ -105,7 +111,7 @@ class Content:
         self.sort_by = None
         self.sort_order = None
 
-        # threads for downloading videos / slides.
+        # download jobs for videos, keyed by row index.
         self.threads = dict()
 
 
@@ -276,7 +282,7 @@ class Content:
         col_data = self.sheet.get_column_data(col_index)
         return col_data.index(str(index_value))
 
-    def progress_bar_text(self, value, processed=False):
+    def progress_bar_text(self, value, processed=False, state=None):
         """
         return progress bar text, calls the unicode/ascii implementation.
         """
@@ -287,7 +293,11 @@ class Content:
             text = self.progress_bar_text_ascii(value)
 
         pad = ' ' * 2
-        if 0 < value < 100:
+        if state == JobState.QUEUED:
+            status = '{}{}{}'.format(pad, Icons.DOWNLOAD_QUEUED, pad)
+        elif state == JobState.PAUSED:
+            status = '{}{}{}'.format(pad, Icons.DOWNLOAD_PAUSED, pad)
+        elif 0 < value < 100:
             percent_text = '{:2d}%'.format(value)
             status = percent_text
         elif value == 0:
@@ -333,13 +343,13 @@ class Content:
             full_text = '{} '.format(unicode_space * 13)
         return full_text
 
-    def progress_bar_callback(self, count, row, col, processed=False):
+    def progress_bar_callback(self, count, row, col, processed=False, state=None):
         """
         Callback function passed to the backend, where it computes the download progress.
         Every time the function is called, it will update the progress bar value.
         """
         updated_row = self.get_row_after_sort(row)
-        new_text = self.progress_bar_text(count, processed)
+        new_text = self.progress_bar_text(count, processed, state)
         if new_text != self.sheet.get_cell_data(updated_row, col):
             self.sheet.set_cell_data(updated_row, col, new_text, redraw=True)
 
@@ -389,8 +399,10 @@ class Content:
 
         row = 0
         sheet_rows = list()
+        self.ttid_rows = dict()
         for subject_id, videos in self.videos.items():
             for ttid, video_metadata in videos.items():
+                self.ttid_rows[str(ttid)] = row
                 video_metadata = Utils.add_new_fields(video_metadata, self.video_slide_mapping)
 
                 video_path = self.impartus.get_mkv_path(video_metadata)
@@ -465,6 +477,13 @@ class Content:
 
         # update button status
         self.set_button_status(redraw=True)
+
+        # downloads in progress carry on across reloads, shown in their lecture's new row.
+        for key, job in list(self.jobs.items()):
+            job.data['row_index'] = self.ttid_rows.get(key)
+            if job.data['row_index'] is not None:
+                self.threads[job.data['row_index']] = job
+                self.show_job(job)
         self.sheet.grid(row=0, column=0, sticky='nsew')
 
     def sort_table(self, args):
@@ -508,33 +527,64 @@ class Content:
             return
         return True
 
-    def _download_video(self, video_metadata, filepath, captions_path, root_url, row, col, pause_ev, resume_ev):  # noqa
+    def _download_video(self, video_metadata, filepath, captions_path, root_url, job: DownloadJob):
         """
-        Download a video in a thread. Update the UI upon completion.
+        Download a video in a scheduler 'download' stage worker thread. The track files are handed over to
+        _encode_video() via job.data. Only the time range in job.data['time_range'], and the tracks in
+        job.data['tracks'] are downloaded, if set.
+        """
+        # Impartus objects share a pooled transport, reuse the existing one in all download threads.
+        imp = self.impartus
+
+        # lecture chats are fetched alongside the video, and saved as a webvtt subtitles file.
+        Scheduler.submit_task(self.save_captions_if_needed, video_metadata, root_url, captions_path)
+
+        # a flipped lecture may be previewed in a low quality first, and upgraded in the background.
+        video_quality = Variables().lecture_quality_var().get()
+        if not job.data.get('time_range') and not job.data.get('tracks'):
+            preview_quality = imp.get_preview_quality(video_metadata, video_quality, root_url)
+            if preview_quality:
+                job.data['upgrade_quality'], video_quality = video_quality, preview_quality
+
+        job.data['media'] = imp.download_video(video_metadata, filepath, root_url, job.pause_event, job.resume_event,
+                                               job.set_progress, video_quality=video_quality,
+                                               time_range=job.data.get('time_range'), tracks=job.data.get('tracks'),
+                                               cancel_token=job.cancel_token)
+        return bool(job.data['media'])
+
+    def _encode_video(self, job: DownloadJob):
+        """
+        Encode a downloaded video in a scheduler 'encode' stage worker thread. Update the UI upon completion.
         """
-        # create a new Impartus session reusing existing token.
-        imp = Impartus(self.impartus.token)
-        pb_col = Columns.column_names.index('downloaded')
-
         # # voodoo alert:
-        # It is possible for user to sort the table while download is in progress.
-        # In such a case, the row index supplied to the function call won't match the row index
+        # It is possible for user to sort the table (or reload the content) while download is in progress.
+        # In such a case, the row index the download was started from won't match the row index
         # required to update the correct progressbar/open/play buttons, which now exists at a new
         # location.
-        # The hidden column index keeps the initial row index, and remains unchanged.
+        # The hidden column index keeps the initial row index (job.data['row_index']), and remains unchanged
+        # on sorting, a reload sets it to the lecture's new row.
         # Use row_index to identify the new correct location of the progress bar.
-        row_index = self.get_index(row)
+        success = self.impartus.encode_video(job.data['media'], job.cancel_token)
+        if not success:
+            return False
 
-        imp.process_video(video_metadata, filepath, root_url, pause_ev, resume_ev,
-                          partial(self.progress_bar_callback, row=row_index, col=pb_col),
-                          video_quality=Variables().lecture_quality_var())
+        if job.data.get('upgrade_quality'):
+            self.upgrade_video(job.data['video_metadata'], job.data['media']['mkv_filepath'],
+                               job.data['root_url'], job.data['upgrade_quality'])
 
-        # also download lecture chats, and create a webvtt subtitles file.
-        self.save_captions_if_needed(video_metadata, root_url, captions_path)
+        row_index = job.data.get('row_index')
+        if row_index is None:
+            return True
+        self.threads.pop(row_index, None)
+
+        if job.data.get('time_range') or job.data.get('tracks'):
+            self.on_download_clip_complete(row_index, job.data['media']['mkv_filepath'])
+            return True
 
         # download complete, enable open / play buttons
         updated_row = self.get_row_after_sort(row_index)
         # update progress bar status to complete.
+        pb_col = Columns.column_names.index('downloaded')
         self.progress_bar_callback(row=row_index, col=pb_col, count=100, processed=True)
 
         self.sheet.set_cell_data(updated_row, Columns.column_names.index('download_video'), Icons.DOWNLOAD_VIDEO)
@@ -543,6 +593,168 @@ class Content:
         # enable buttons.
         self.enable_button(updated_row, Columns.column_names.index('open_folder'))
         self.enable_button(updated_row, Columns.column_names.index('play_video'))
+        return True
+
+    def upgrade_video(self, video_metadata, filepath, root_url, video_quality, paused=False):
+        """
+        Queue the download of a previewed lecture in video_quality, at background priority. The preview is
+        replaced once the download is encoded. The preview stays in place if the upgrade fails.
+        """
+        def download(job: DownloadJob):
+            job.data['media'] = self.impartus.download_video(video_metadata, filepath, root_url, job.pause_event,
+                                                             job.resume_event, job.set_progress,
+                                                             video_quality=video_quality, upgrade=True,
+                                                             cancel_token=job.cancel_token)
+            return bool(job.data['media'])
+
+        def encode(job: DownloadJob):
+            return self.impartus.encode_video(job.data['media'], job.cancel_token)
+
+        key = '{}:upgrade'.format(video_metadata['ttid'])
+        job = DownloadJob(download, encode_func=encode, priority=Scheduler.background_priority,
+                          callback=self.on_download_job_update, cancel_func=self.discard_download)
+        job.data['key'] = key
+        self.add_job(job, {
+            'video_metadata': video_metadata,
+            'filepath': filepath,
+            'root_url': root_url,
+            'upgrade_quality': video_quality,
+        }, paused)
+        self.logger.info("queued the upgrade of {} to {} quality.".format(filepath, video_quality))
+
+    def add_job(self, job: DownloadJob, entry: Dict, paused=False):
+        """
+        Submit a download job to the scheduler, and record it in the download queue (entry being the details
+        needed to queue it again after a restart), so that it outlives reloads and restarts.
+        """
+        if paused:
+            job.pause()
+        self.jobs[job.data['key']] = job
+        DownloadQueue.add(job.data['key'], dict(entry, paused=paused))
+        Scheduler.submit(job)
+
+    def discard_download(self, job: DownloadJob):
+        """
+        Clean up after a job cancelled in between stages, i.e. downloaded and waiting to be encoded.
+        """
+        if job.data.get('media'):
+            self.impartus.discard_download(job.data['media'])
+
+    def on_download_video_failed(self, job: DownloadJob):
+        """
+        Allow the user to retry a failed download, a retry resumes from where the download stopped.
+        """
+        row_index = job.data.get('row_index')
+        if row_index is None:
+            return
+        self.threads.pop(row_index, None)
+        updated_row = self.get_row_after_sort(row_index)
+        self.sheet.set_cell_data(updated_row, Columns.column_names.index('download_video'), Icons.DOWNLOAD_VIDEO)
+        # called from a scheduler worker, the dialog is shown from the main loop, without holding up the worker.
+        self.sheet.after(0, partial(tkinter.messagebox.showerror, 'Error',
+                                    'Error downloading video, see console logs for details.'))
+
+    def on_download_clip_complete(self, row_index, filepath):
+        """
+        A clip does not count as the lecture downloaded, the lecture can still be downloaded in full.
+        """
+        updated_row = self.get_row_after_sort(row_index)
+        pb_col = Columns.column_names.index('downloaded')
+        self.progress_bar_callback(row=row_index, col=pb_col, count=0)
+        self.sheet.set_cell_data(updated_row, Columns.column_names.index('download_video'), Icons.DOWNLOAD_VIDEO)
+        self.enable_button(updated_row, Columns.column_names.index('open_folder'))
+        # called from an encode worker, the dialog is shown from the main loop, without holding up the worker.
+        self.sheet.after(0, partial(tkinter.messagebox.showinfo, 'Done', 'Saved the clip to {}'.format(filepath)))
+
+    def on_download_job_update(self, job: DownloadJob):
+        """
+        Callback from the download job on every state / progress change, updates the progress bar.
+        A job done (failed or cancelled) is dropped from the download queue, the row of a failed or cancelled job
+        is reset to be downloaded again.
+        """
+        if job.state in [JobState.DONE, JobState.FAILED, JobState.CANCELLED]:
+            if self.jobs.get(job.data['key']) is job:
+                self.jobs.pop(job.data['key'], None)
+                DownloadQueue.remove(job.data['key'])
+            if job.data.get('row_index') is not None:
+                self.disable_button(self.get_row_after_sort(job.data['row_index']),
+                                    Columns.column_names.index('cancel_download'), redraw=True)
+                if job.state == JobState.CANCELLED:
+                    self.on_download_cancelled(job.data['row_index'])
+                elif job.state == JobState.FAILED:
+                    self.on_download_video_failed(job)
+            return
+        if job.data.get('row_index') is None:
+            return
+        pb_col = Columns.column_names.index('downloaded')
+        self.progress_bar_callback(job.progress, row=job.data['row_index'], col=pb_col, state=job.state)
+
+    def show_job(self, job: DownloadJob):
+        """
+        Show the state of a download job in the lecture's row, e.g. after a reload.
+        """
+        row_index = job.data.get('row_index')
+        if row_index is None:
+            return
+        updated_row = self.get_row_after_sort(row_index)
+        icon = Icons.RESUME_DOWNLOAD if job.is_paused() else Icons.PAUSE_DOWNLOAD
+        self.sheet.set_cell_data(updated_row, Columns.column_names.index('download_video'), icon)
+        self.enable_button(updated_row, Columns.column_names.index('cancel_download'))
+        self.on_download_job_update(job)
+
+    def on_download_cancelled(self, row_index):
+        """
+        A cancelled lecture can be downloaded again, from scratch (or from where it was cancelled, with
+        keep_cancelled_downloads set).
+        """
+        self.threads.pop(row_index, None)
+        updated_row = self.get_row_after_sort(row_index)
+        pb_col = Columns.column_names.index('downloaded')
+        self.progress_bar_callback(row=row_index, col=pb_col, count=0)
+        self.sheet.set_cell_data(updated_row, Columns.column_names.index('download_video'), Icons.DOWNLOAD_VIDEO,
+                                 redraw=True)
+
+    def cancel_download(self, row, col):  # noqa
+        """
+        callback function for Cancel button.
+        """
+        job = self.threads.get(self.get_index(row))
+        if not job:
+            return
+        response = tk.messagebox.askquestion('Cancel download', 'Cancel the download of this lecture?',
+                                             icon='warning')
+        if response == 'yes':
+            job.cancel()
+
+    def cancel_all_downloads(self):
+        """
+        Cancel all the downloads, queued or in progress, including the background upgrades.
+        """
+        if not self.jobs:
+            return
+        response = tk.messagebox.askquestion('Cancel all downloads',
+                                             'Cancel {} download(s)?'.format(len(self.jobs)), icon='warning')
+        if response != 'yes':
+            return
+        for job in list(self.jobs.values()):
+            job.cancel()
+
+    def restore_downloads(self):
+        """
+        Queue again the downloads pending when the app was last closed, in the order they were requested.
+        Each of them resumes from where it stopped, paused downloads stay paused.
+        """
+        for key, entry in DownloadQueue.get_all().items():
+            if key in self.jobs:
+                continue
+            if entry.get('upgrade_quality'):
+                self.upgrade_video(entry['video_metadata'], entry['filepath'], entry['root_url'],
+                                   entry['upgrade_quality'], entry['paused'])
+            else:
+                time_range = tuple(entry['time_range']) if entry.get('time_range') else None
+                self.submit_download(entry['video_metadata'], entry['filepath'], entry['captions_path'],
+                                     entry['root_url'], time_range, entry.get('tracks'), entry['paused'])
+            self.logger.info("restored the download of {}.".format(entry['filepath']))
 
     def add_slides(self, row, col):  # noqa
         conf = Config.load(ConfigType.IMPARTUS)
@@ -555,23 +767,24 @@ class Content:
         for filepath in filepaths:
             shutil.copy(filepath, slides_folder_path)
 
-    def pause_resume_button_click(self, row, col, pause_event, resume_event):
+    def pause_resume_button_click(self, row, col, job: DownloadJob):
         row_index = self.get_index(row)
         updated_row = self.get_row_after_sort(row_index)
 
-        if pause_event.is_set():
+        if job.is_paused():
             self.sheet.set_cell_data(updated_row, col, Icons.PAUSE_DOWNLOAD, redraw=True)
-            resume_event.set()
-            pause_event.clear()
+            job.resume()
         else:
             self.sheet.set_cell_data(updated_row, col, Icons.RESUME_DOWNLOAD, redraw=True)
-            pause_event.set()
-            resume_event.clear()
+            job.pause()
+        DownloadQueue.set_paused(job.data['key'], job.is_paused())
 
-    def download_video(self, row, col):
+    def download_video(self, row, col, time_range=None, tracks=None):
         """
         callback function for Download button.
-        Creates a thread to download the request video.
+        Queues the requested video for download with the scheduler.
+        :param time_range: (start, end) in seconds, to download only part of the video.
+        :param tracks: indices of the tracks to download, None for the download_tracks config.
         """
         data = self.read_metadata(row)
 
@@ -583,44 +796,125 @@ class Content:
         real_row = self.get_index(row)
 
         if self.threads.get(real_row):
-            pause_ev = self.threads.get(real_row)['pause_event']
-            resume_ev = self.threads.get(real_row)['resume_event']
-            self.pause_resume_button_click(row, col, pause_ev, resume_ev)
+            self.pause_resume_button_click(row, col, self.threads.get(real_row))
             return
 
-        from threading import Event
+        if time_range or tracks:
+            filepath = self.impartus.get_clip_path(filepath, time_range, tracks)
+
+        self.submit_download(video_metadata, filepath, captions_path, root_url, time_range, tracks)
 
-        pause_event = Event()
-        resume_event = Event()
+    def submit_download(self, video_metadata, filepath, captions_path, root_url, time_range=None, tracks=None,
+                        paused=False):
+        """
+        Queue a video for download with the scheduler, shown in the lecture's row if it is listed.
+        """
+        key = str(video_metadata['ttid'])
+        job = DownloadJob(partial(self._download_video, video_metadata, filepath, captions_path, root_url),
+                          encode_func=self._encode_video,
+                          priority=Scheduler.get_priority(video_metadata),
+                          callback=self.on_download_job_update, cancel_func=self.discard_download)
+        job.data['key'] = key
+        job.data['row_index'] = self.ttid_rows.get(key)
+        job.data['time_range'] = time_range
+        job.data['tracks'] = tracks
+        job.data['video_metadata'] = video_metadata
+        job.data['root_url'] = root_url
+        if job.data['row_index'] is not None:
+            self.threads[job.data['row_index']] = job
+        self.add_job(job, {
+            'video_metadata': video_metadata,
+            'filepath': filepath,
+            'captions_path': captions_path,
+            'root_url': root_url,
+            'time_range': list(time_range) if time_range else None,
+            'tracks': tracks,
+        }, paused)
+        self.show_job(job)
+
+    def download_clip(self, row, col):
+        """
+        callback function for Clip button.
+        Asks for a time range and the tracks, and queues that part of the video for download.
+        """
+        if self.threads.get(self.get_index(row)):
+            tkinter.messagebox.showinfo('Busy', 'This lecture is already being downloaded.')
+            return
 
-        # note: args is a tuple.
-        thread = threading.Thread(target=self._download_video,
-                                  args=(video_metadata, filepath, captions_path, root_url, row, col,
-                                        pause_event, resume_event,))
-        self.threads[real_row] = {
-            'thread': thread,
-            'pause_event': pause_event,
-            'resume_event': resume_event,
-        }
-        thread.start()
+        data = self.read_metadata(row)
+        duration = int(data.get('video_metadata')['actualDuration'])
+        num_tracks = int(data.get('video_metadata')['tapNToggle'])
+        default_tracks = self.impartus.get_selected_tracks(num_tracks)
+
+        dialog = Dialogs.create_dialog(size='400x{}+200+200'.format(180 + 30 * num_tracks), title=Labels.DOWNLOAD_CLIP)
+        if not dialog:
+            return
+        entries = dict()
+        for index, (name, default) in enumerate([('Start', '0:00:00'), ('End', Utils.format_time(duration))]):
+            tk.Label(dialog, text='{} (h:mm:ss)'.format(name)).grid(row=index, column=0, sticky='w', padx=10, pady=5)
+            entries[name] = tk.Entry(dialog)
+            entries[name].insert(0, default)
+            entries[name].grid(row=index, column=1, sticky='ew', padx=10, pady=5)
+        dialog.columnconfigure(1, weight=1)
+
+        track_vars = [tk.IntVar(None, int(x in default_tracks)) for x in range(num_tracks)]
+        if num_tracks > 1:
+            for index, track_var in enumerate(track_vars):
+                tk.Checkbutton(dialog, text='Track {}'.format(index), variable=track_var, onvalue=1, offvalue=0) \
+                    .grid(row=2 + index, column=1, sticky='w', padx=10)
+
+        def on_ok():
+            try:
+                start = Utils.parse_time(entries['Start'].get())
+                end = Utils.parse_time(entries['End'].get())
+            except ValueError as ex:
+                tkinter.messagebox.showerror('Error', str(ex), parent=dialog)
+                return
+            if not 0 <= start < end:
+                tkinter.messagebox.showerror('Error', 'Start must be before the end.', parent=dialog)
+                return
+            tracks = [x for x, track_var in enumerate(track_vars) if track_var.get()]
+            if not tracks:
+                tkinter.messagebox.showerror('Error', 'Select at least one track.', parent=dialog)
+                return
+            Dialogs.on_dialog_close()
+            # till the end of the lecture, if the end is past it.
+            time_range = (start, end if end < duration else None)
+            if time_range == (0, None):
+                time_range = None
+            download_col = Columns.column_names.index('download_video')
+            self.sheet.set_cell_data(row, download_col, Icons.PAUSE_DOWNLOAD, redraw=True)
+            self.download_video(row, download_col, time_range=time_range,
+                                tracks=tracks if tracks != default_tracks else None)
+
+        tk.Button(dialog, text='Download', command=on_ok).grid(row=2 + num_tracks, column=0, columnspan=2, padx=10,
+                                                               pady=10)
 
     def _download_slides(self, ttid, file_url, filepath, root_url, row):
         """
         Download a slide doc in a thread. Update the UI upon completion.
         """
-        # create a new Impartus session reusing existing token.
-        imp = Impartus(self.impartus.token)
-        if imp.download_slides(ttid, file_url, filepath, root_url):
+        # Impartus objects share a pooled transport, reuse the existing one in all download threads.
+        imp = self.impartus
+        try:
+            success = imp.download_slides(ttid, file_url, filepath, root_url)
+        except Exception as ex:
+            # e.g. retries run out, or the file could not be written.
+            self.logger.exception("[{}]: Error downloading slides {}: {}".format(ttid, filepath, ex))
+            success = False
+        if success:
             # download complete, enable show slides buttons
             self.enable_button(row, Columns.column_names.index('show_slides'))
         else:
-            tkinter.messagebox.showerror('Error', 'Error downloading slides, see console logs for details.')
+            # called from a background task, the dialog is shown from the main loop.
+            self.sheet.after(0, partial(tkinter.messagebox.showerror, 'Error',
+                                        'Error downloading slides, see console logs for details.'))
             self.enable_button(row, Columns.column_names.index('download_slides'))
 
     def download_slides(self, row, col):  # noqa
         """
         callback function for Download button.
-        Creates a thread to download the request video.
+        Downloads the slides in a background task, alongside any video downloads.
         """
         data = self.read_metadata(row)
 
@@ -630,11 +924,7 @@ class Content:
         filepath = data.get('slides_path')
         root_url = self.login.url_box.get()
 
-        # note: args is a tuple.
-        thread = threading.Thread(target=self._download_slides,
-                                  args=(ttid, file_url, filepath, root_url, row,))
-        # self.threads.append(thread)
-        thread.start()
+        Scheduler.submit_task(self._download_slides, ttid, file_url, filepath, root_url, row)
 
     def read_metadata(self, row):
         """
@@ -791,7 +1081,10 @@ class Content:
         Checks to identify when certain buttons should be enabled/disabled.
         """
         state = True
-        if key == 'download_video' and video_exists_on_disk:
+        if key in ['download_video', 'download_clip'] and video_exists_on_disk:
+            state = False
+        elif key == 'cancel_download':
+            # enabled while the lecture is being downloaded.
             state = False
         elif key == 'open_folder' and not video_exists_on_disk:
             state = False
@@ -878,16 +1171,6 @@ class Content:
         self.sheet.align_columns([Columns.column_names.index(k) for k in Columns.button_columns.keys()], align='center')
 
     def show_video_callback(self, impartus: Impartus, event=None):  # noqa
-        if threading.activeCount() > 1:     # 1. main thread, 2,3... download threads.
-            response = tk.messagebox.askquestion(
-                'Download(s) in progress!',
-                "Reloading the content will lose the downloads in progress.\n"
-                + "Do you want to continue?",
-                icon='warning'
-            )
-            if response != 'yes':
-                return
-
         self.toolbar.reload_button.config(state='disabled')
         self.menubar.actions_menu.entryconfig(Labels.RELOAD, state='disabled')
 
@@ -898,6 +1181,11 @@ class Content:
 
         self.login.authenticate(impartus)
         self.set_display_widgets()
+
+        # downloads left pending when the app was last closed.
+        if not self.downloads_restored:
+            self.downloads_restored = True
+            self.restore_downloads()
         self.toolbar.reload_button.config(state='normal')
         self.menubar.actions_menu.entryconfig(Labels.RELOAD, state='normal')
 
@@ -4,6 +4,8 @@ import enum
 class Icons(enum.Enum):
 
     DOWNLOAD_VIDEO = '⬇'
+    DOWNLOAD_CLIP = '✂'
+    CANCEL_DOWNLOAD = '✕'
     PLAY_VIDEO = '▶'
     OPEN_FOLDER = '⏏'
     DOWNLOAD_SLIDES = '⬇'
@@ -14,6 +16,8 @@ class Icons(enum.Enum):
     VIDEO_PROCESSING = '⧗'
     VIDEO_DOWNLOADED = '✓'
     VIDEO_NOT_DOWNLOADED = '⃠'
+    DOWNLOAD_QUEUED = '⋯'
+    DOWNLOAD_PAUSED = '❘❘'
     SORT_DESC = '▼'
     SORT_ASC = '▲'
     UNSORTED = '⇅'
@@ -27,8 +31,12 @@ class Icons(enum.Enum):
 class Labels(enum.Enum):
     RELOAD = '⟳  Reload'
     AUTO_ORGANIZE = '⇄  Auto Organize Lectures'
+    CANCEL_ALL = '✕  Cancel All Downloads'
     COLUMNS = '❘❘❘  Columns'
     FLIPPED_QUALITY = '☇  Flipped Lecture Quality'
+    BANDWIDTH_LIMIT = '⇣  Bandwidth Limit'
+    CONCURRENCY = '⇅  Segments In Flight: {}'
+    DOWNLOAD_CLIP = 'Download Part of the Lecture'
     QUIT = 'Quit'
     ACTIONS = 'Actions'
     COLORSCHEME = 'Color Scheme'
@@ -69,6 +77,14 @@ class Columns:
                            'function': 'download_video', 'text': Icons.DOWNLOAD_VIDEO.value,
                            'state': 'download_video_state'
                            },
+        'download_clip': {'type': 'button', 'editable': False, 'display_name': 'Clip',
+                          'function': 'download_clip', 'text': Icons.DOWNLOAD_CLIP.value,
+                          'state': 'download_clip_state'
+                          },
+        'cancel_download': {'type': 'button', 'editable': False, 'display_name': 'Cancel',
+                            'function': 'cancel_download', 'text': Icons.CANCEL_DOWNLOAD.value,
+                            'state': 'cancel_download_state'
+                            },
         'play_video': {'type': 'button', 'editable': False, 'display_name': 'Video',
                        'function': 'play_video', 'text': Icons.PLAY_VIDEO.value,
                        'state': 'play_video_state'
@@ -93,6 +109,8 @@ class Columns:
 
     button_state_columns = {k: {'display_name': k, 'type': 'button_state'} for k in [
         'download_video_state',
+        'download_clip_state',
+        'cancel_download_state',
         'play_video_state',
         'open_folder_state',
         'download_slides_state',
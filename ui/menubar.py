@@ -37,6 +37,7 @@ class Menubar:
         actions_menu = tkinter.Menu(menubar, tearoff=0)
         actions_menu.add_command(label=Labels.RELOAD, command=callbacks['authentication_callback'])
         actions_menu.add_command(label=Labels.AUTO_ORGANIZE, command=callbacks['auto_organize_callback'])
+        actions_menu.add_command(label=Labels.CANCEL_ALL, command=callbacks['cancel_all_callback'])
         actions_menu.add_separator()
         actions_menu.add_command(label=Labels.QUIT, command=partial(sys.exit, 0))
 
@@ -63,7 +64,7 @@ class Menubar:
         video_menu.add_command(label=str(Labels.FLIPPED_QUALITY), state=tk.DISABLED)
 
         conf = Config.load(ConfigType.IMPARTUS)
-        for item in ['highest', *conf.get('video_quality_order'), 'lowest']:
+        for item in ['auto', 'highest', *conf.get('video_quality_order'), 'lowest']:
             video_menu.add_radiobutton(label=item, variable=variables.lecture_quality_var())
         menubar.add_cascade(label=Labels.VIDEO, menu=video_menu)
 
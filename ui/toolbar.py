@@ -18,6 +18,7 @@ class Toolbar:
         self.auto_organize_button = None
         self.display_columns_dropdown = None
         self.flipped_video_quality_dropdown = None
+        self.bandwidth_limit_dropdown = None
         self.expected_real_paths_differ = False
 
         self.frame_toolbar = None
@@ -64,13 +65,31 @@ class Toolbar:
         lecture_quality_dropdown.menu = tk.Menu(lecture_quality_dropdown, tearoff=1)
         lecture_quality_dropdown['menu'] = lecture_quality_dropdown.menu
         conf = Config.load(ConfigType.IMPARTUS)
-        for display_name in ['highest', *conf.get('video_quality_order'), 'lowest']:
+        for display_name in ['auto', 'highest', *conf.get('video_quality_order'), 'lowest']:
             lecture_quality_dropdown.menu.add_radiobutton(
                 label=display_name, variable=variables.lecture_quality_var()
             )
         lecture_quality_dropdown.grid(row=0, column=4, **grid_options)
         self.flipped_video_quality_dropdown = lecture_quality_dropdown
 
+        # bandwidth limit dropdown.
+        bandwidth_limit_dropdown = tk.Menubutton(
+            self.frame_toolbar, text=Labels.BANDWIDTH_LIMIT, **button_options
+        )
+        bandwidth_limit_dropdown.menu = tk.Menu(bandwidth_limit_dropdown, tearoff=1)
+        bandwidth_limit_dropdown['menu'] = bandwidth_limit_dropdown.menu
+        for display_name, value in self.bandwidth_limit_options().items():
+            bandwidth_limit_dropdown.menu.add_radiobutton(
+                label=display_name, variable=variables.bandwidth_limit_var(), value=value,
+                command=partial(callback_functions['set_bandwidth_limit_callback'], value)
+            )
+        bandwidth_limit_dropdown.grid(row=0, column=5, **grid_options)
+        self.bandwidth_limit_dropdown = bandwidth_limit_dropdown
+
+        # segment downloads in flight.
+        concurrency_label = tk.Label(self.frame_toolbar, textvariable=variables.concurrency_var())
+        concurrency_label.grid(row=0, column=6, **grid_options)
+
         # color scheme change.
         grid_options_cs = {
             'padx': 0, 'pady': 0, 'ipadx': 0, 'ipady': 0,
@@ -83,14 +102,36 @@ class Toolbar:
                 bg=item.get('theme_color'),
                 command=partial(callback_functions['set_colorscheme_callback'], item)
             )
-            colorscheme_button.grid(row=0, column=5 + i, **grid_options_cs, sticky='e')
+            colorscheme_button.grid(row=0, column=7 + i, **grid_options_cs, sticky='e')
             # Set the radio button to indicate currently active color scheme.
             i += 1
 
-        # empty column, to keep columns 1-5 centered
+        # empty column, to keep columns 1-7 centered
         self.frame_toolbar.columnconfigure(0, weight=1)
         # move the color scheme buttons to extreme right
-        self.frame_toolbar.columnconfigure(5, weight=1)
+        self.frame_toolbar.columnconfigure(7, weight=1)
+
+    def bandwidth_limit_options(self):  # noqa
+        """
+        bandwidth limit options for the dropdown, display name -> limit in KB/s.
+        """
+        options = {'as per config': -1, 'unlimited': 0}
+        for limit in [256, 512, 1024, 2048, 5120, 10240]:
+            display_name = '{} MB/s'.format(limit // 1024) if limit >= 1024 else '{} KB/s'.format(limit)
+            options[display_name] = limit
+        return options
+
+    def watch_concurrency(self, segment_slots):
+        """
+        Show the limit of segment downloads in flight, and keep it updated as it adapts.
+        :param segment_slots: AdaptiveLimiter, see Scheduler.segment_slot().
+        """
+        self.set_concurrency(segment_slots.get_limit())
+        # the limit changes on the download threads, the label is updated on the main loop.
+        segment_slots.add_listener(lambda limit: self.app.after(0, self.set_concurrency, limit))
+
+    def set_concurrency(self, limit):   # noqa
+        Variables().concurrency_var(str(Labels.CONCURRENCY).format(limit))
 
     def set_colorscheme(self, cs):
         self.frame_toolbar.configure(bg=cs['root']['bg'])
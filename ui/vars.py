@@ -7,6 +7,8 @@ from ui.data import Columns
 class Variables(object):
 
     _lecture_quality_var = None
+    _bandwidth_limit_var = None
+    _concurrency_var = None
     _display_columns_vars = None
     _colorscheme_var = None
 
@@ -23,6 +25,12 @@ class Variables(object):
             }
 
             cls._lecture_quality_var = tk.StringVar(None, Config.load(ConfigType.IMPARTUS)['video_quality'])
+
+            # -1: as per config / schedule, 0: unlimited, N: N KB/s
+            cls._bandwidth_limit_var = tk.IntVar(None, -1)
+
+            # segment downloads in flight, as adapted by the scheduler.
+            cls._concurrency_var = tk.StringVar(None, '')
         return cls._instance
 
     @classmethod
@@ -45,3 +53,17 @@ class Variables(object):
             cls._lecture_quality_var.set(lecture_quality)
         else:
             return cls._lecture_quality_var
+
+    @classmethod
+    def bandwidth_limit_var(cls, bandwidth_limit=None):
+        if bandwidth_limit is not None:
+            cls._bandwidth_limit_var.set(bandwidth_limit)
+        else:
+            return cls._bandwidth_limit_var
+
+    @classmethod
+    def concurrency_var(cls, concurrency=None):
+        if concurrency is not None:
+            cls._concurrency_var.set(concurrency)
+        else:
+            return cls._concurrency_var